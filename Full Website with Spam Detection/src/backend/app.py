@@ -3,32 +3,214 @@ Flask Backend for Email Spam Detection
 Ready to run with spam mail.csv dataset
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
-from spam_detector import SpamDetector
+from spam_detector import SpamDetector, saved_models_exist, MODELS_DIR
+from retrain_jobs import RetrainJobs
+from online_learning import OnlineLearner
+from micro_batching import MicroBatcher
+from metrics import Metrics
+from cascade import parse_band
+from bounded_input import InputLimits, HEAD_CHARS, TAIL_CHARS
+from model_registry import ModelRegistry
+from shadow_scoring import ShadowScorer
 import os
+import threading
+import time
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
-# Initialize spam detector
-detector = SpamDetector()
+# Running in a worker forked by serve.py: the models are loaded before forking
+# and feedback is applied by the serve.py parent process
+PREFORK = os.environ.get('SPAM_PREFORK') == '1'
 
-# Check if models are trained
-if os.path.exists('models/vectorizer.pkl'):
-    print("Loading pre-trained models...")
-    detector.load_models()
-    print("Models loaded successfully!")
-else:
-    print("No trained models found. Please run train_model.py first.")
+# Maximum number of emails accepted by /api/predict/batch
+app.config['MAX_BATCH_SIZE'] = int(os.environ.get('MAX_BATCH_SIZE', 1000))
+
+# Request/stage/model timings for /api/metrics (METRICS_ENABLED=0 turns them off)
+metrics = Metrics(enabled=os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no', 'off'))
+
+# Set by serve.py: the metrics of all pre-forked workers, combined through a shared directory
+shared_metrics = None
+
+def campaign_settings():
+    """Campaign index settings from the environment (None unless CAMPAIGN_INDEX=1)"""
+    if os.environ.get('CAMPAIGN_INDEX', '0').lower() in ('0', 'false', 'no', 'off'):
+        return None
+    return {
+        'threshold': float(os.environ.get('CAMPAIGN_THRESHOLD', 0.7)),
+        'max_entries': int(os.environ.get('CAMPAIGN_MAX_ENTRIES', 10000)),
+        'max_age': float(os.environ.get('CAMPAIGN_MAX_AGE_DAYS', 30)) * 86400,
+        'min_score': float(os.environ.get('CAMPAIGN_MIN_SCORE', 0.99))
+    }
+
+# Initialize spam detector (prediction cache size/TTL are configurable)
+detector = SpamDetector(
+    cache_size=int(os.environ.get('PREDICTION_CACHE_SIZE', 10000)),
+    cache_ttl=float(os.environ['PREDICTION_CACHE_TTL']) if os.environ.get('PREDICTION_CACHE_TTL') else None,
+    metrics=metrics,
+    cascade_band=parse_band(os.environ.get('CASCADE_BAND')),
+    campaigns=campaign_settings(),
+    # Per-request latency budget (ms): serve the most accurate combination of models that fits it
+    latency_budget_ms=float(os.environ['LATENCY_BUDGET_MS']) if os.environ.get('LATENCY_BUDGET_MS') else None,
+    # Characters of cleaned text scored from the start and the end of a long message
+    input_limits=InputLimits(
+        head_chars=int(os.environ.get('INPUT_HEAD_CHARS', HEAD_CHARS)),
+        tail_chars=int(os.environ.get('INPUT_TAIL_CHARS', TAIL_CHARS))
+    )
+)
+
+# Versions of the trained models and the active pointer (see model_registry.py)
+registry = ModelRegistry(MODELS_DIR)
+
+# Shadow scoring: a candidate version scores a sample of /api/predict traffic
+# in the background (SHADOW_VERSION=v0003, or POST /api/models/shadow)
+shadow = None
+if os.environ.get('SHADOW_VERSION'):
+    try:
+        shadow = ShadowScorer(detector, MODELS_DIR, os.environ['SHADOW_VERSION'],
+                              fraction=float(os.environ.get('SHADOW_FRACTION', 0.05)))
+    except ValueError as e:
+        print(f"✗ Shadow scoring not started: {e}")
+
+# Group concurrent /api/predict calls into batches (off unless MICRO_BATCH_WINDOW_MS is set)
+micro_batcher = None
+if os.environ.get('MICRO_BATCH_WINDOW_MS'):
+    micro_batcher = MicroBatcher(
+        detector,
+        window=float(os.environ['MICRO_BATCH_WINDOW_MS']) / 1000,
+        max_batch_size=int(os.environ.get('MICRO_BATCH_MAX_SIZE', 32))
+    )
+
+# Model loading state for /api/health: 'loading' until the saved models are
+# loaded and warmed up, then 'ready' (or 'no_models' / 'error')
+boot_state = {'status': 'loading', 'error': None, 'load_seconds': None, 'warmup_seconds': None}
+
+def boot_models():
+    """Load the saved models and warm them up before reporting ready"""
+    try:
+        if not saved_models_exist():
+            print("No trained models found. Please run train_model.py first.")
+            boot_state['status'] = 'no_models'
+            return
+        
+        print("Loading pre-trained models...")
+        start = time.perf_counter()
+        with detector.swap_lock:
+            detector.load_models()
+        boot_state['load_seconds'] = round(time.perf_counter() - start, 3)
+        
+        if not detector.models_loaded:
+            boot_state['status'] = 'no_models'
+            return
+        
+        boot_state['warmup_seconds'] = round(detector.warm_up(), 3)
+        print(f"Models loaded successfully! ({boot_state['load_seconds']}s, "
+              f"warm-up {boot_state['warmup_seconds']}s)")
+        boot_state['status'] = 'ready'
+        
+        # Shadow process for the loaded models (serve.py workers start their own after forking)
+        if shadow is not None and not PREFORK:
+            shadow.start()
+    except Exception as e:
+        boot_state['error'] = str(e)
+        boot_state['status'] = 'error'
+        print(f"✗ Loading models failed: {e}")
+
+def model_status():
+    """'loading', 'ready', 'no_models' or 'error' (models trained after start-up count as ready)"""
+    if boot_state['status'] != 'loading' and detector.models_loaded:
+        return 'ready'
+    return boot_state['status']
+
+# Load in the background so the server answers right away
+# (LOAD_MODELS_IN_BACKGROUND=0 loads the models before the app starts serving)
+boot_thread = threading.Thread(target=boot_models, daemon=True)
+boot_thread.start()
+if PREFORK or os.environ.get('LOAD_MODELS_IN_BACKGROUND', '1').lower() in ('0', 'false', 'no', 'off'):
+    boot_thread.join()
+
+# Background retraining (see /api/retrain)
+retrain_jobs = RetrainJobs(detector)
+
+# Incremental updates from user feedback (see /api/feedback)
+online_learner = OnlineLearner(
+    detector,
+    batch_size=int(os.environ.get('FEEDBACK_BATCH_SIZE', 32)),
+    flush_interval=float(os.environ.get('FEEDBACK_FLUSH_INTERVAL', 2)),
+    checkpoint_interval=float(os.environ.get('FEEDBACK_CHECKPOINT_INTERVAL', 300)),
+    apply_updates=not PREFORK
+)
+if not PREFORK:
+    online_learner.start()
+
+def format_prediction(predictions):
+    """
+    Convert a predict_all result into the API response format
+    Models skipped by the cascade have a null prediction and are missing from modelsRun;
+    campaignMatch is set (and modelsRun empty) when a known spam campaign answered;
+    input says whether the text was cut to its head and tail windows, stripped of HTML
+    or had encoded runs (base64 etc.) dropped before scoring
+    """
+    info = predictions['input']
+    return {
+        'isSpam': predictions['is_spam'],
+        'spamScore': float(predictions['ensemble']),
+        'detectedPatterns': predictions['patterns'],
+        'modelPredictions': {
+            'naiveBayes': predictions['naive_bayes'],
+            'svm': predictions['svm'],
+            'randomForest': predictions['random_forest'],
+            'logisticRegression': predictions['logistic_regression']
+        },
+        'modelsRun': predictions['models_run'],
+        'campaignMatch': predictions.get('campaign'),
+        'input': {
+            'truncated': info['truncated'],
+            'originalChars': info['original_chars'],
+            'analyzedChars': info['analyzed_chars'],
+            'htmlStripped': info['html'],
+            'encodedRunsDropped': info['dropped_runs']
+        }
+    }
+
+@app.before_request
+def start_timer():
+    if metrics.enabled:
+        g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    if metrics.enabled and 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.inc('spam_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        metrics.observe('spam_request_duration_seconds', time.perf_counter() - g.request_start, endpoint=endpoint)
+        if response.status_code >= 500:
+            metrics.inc('spam_request_errors_total', endpoint=endpoint)
+    return response
+
+def models_unavailable():
+    """503 response for prediction requests while no models are being served"""
+    status = model_status()
+    message = 'Models are still loading' if status == 'loading' else 'Models not loaded. Please train models first.'
+    return jsonify({'error': message, 'status': status}), 503
 
 @app.route('/api/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """
+    Health check endpoint
+    Responds 503 with status "loading" until the models are loaded and warmed up,
+    then 200 with status "ready" ("no_models" / "error" if there is nothing to serve)
+    """
+    status = model_status()
     return jsonify({
-        'status': 'running',
-        'models_loaded': detector.models_loaded
-    })
+        'status': status,
+        'models_loaded': detector.models_loaded,
+        'load_seconds': boot_state['load_seconds'],
+        'warmup_seconds': boot_state['warmup_seconds'],
+        'error': boot_state['error']
+    }), 503 if status == 'loading' else 200
 
 @app.route('/api/predict', methods=['POST'])
 def predict():
@@ -49,20 +231,62 @@ def predict():
         if not subject and not content:
             return jsonify({'error': 'Please provide subject or content'}), 400
         
-        # Get predictions from all models
-        predictions = detector.predict_all(subject, content)
+        if not detector.models_loaded:
+            return models_unavailable()
         
-        return jsonify({
-            'isSpam': predictions['ensemble'] >= 0.5,
-            'spamScore': float(predictions['ensemble']),
-            'detectedPatterns': predictions['patterns'],
-            'modelPredictions': {
-                'naiveBayes': float(predictions['naive_bayes']),
-                'svm': float(predictions['svm']),
-                'randomForest': float(predictions['random_forest']),
-                'logisticRegression': float(predictions['logistic_regression'])
-            }
-        })
+        # Get predictions from all models (batched with concurrent requests if enabled)
+        if micro_batcher is not None:
+            predictions = micro_batcher.predict(subject, content)
+        else:
+            predictions = detector.predict_all(subject, content)
+        
+        # A sample goes to the shadow candidate (queued; scored off the request path)
+        # Shadow scoring must never fail the request
+        if shadow is not None:
+            try:
+                shadow.offer({'subject': subject, 'content': content}, predictions)
+            except Exception as e:
+                print(f"✗ Shadow scoring error: {e}")
+        
+        return jsonify(format_prediction(predictions))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_batch():
+    """
+    Predict a batch of emails in one call
+    
+    Request body:
+    [
+        {"subject": "Email subject", "content": "Email content"},
+        ...
+    ]
+    
+    Response: array of /api/predict results, in request order
+    """
+    try:
+        data = request.json
+        
+        if not isinstance(data, list):
+            return jsonify({'error': 'Request body must be a JSON array of emails'}), 400
+        
+        max_batch_size = app.config['MAX_BATCH_SIZE']
+        if len(data) > max_batch_size:
+            return jsonify({'error': f'Batch too large: {len(data)} emails (maximum {max_batch_size})'}), 413
+        
+        for i, item in enumerate(data):
+            if not isinstance(item, dict) or (not item.get('subject') and not item.get('content')):
+                return jsonify({'error': f'Email {i}: please provide subject or content'}), 400
+        
+        if not detector.models_loaded:
+            return models_unavailable()
+        
+        # Score the whole batch at once
+        predictions = detector.predict_batch(data)
+        
+        return jsonify([format_prediction(p) for p in predictions])
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -72,19 +296,108 @@ def stats():
     """Get model statistics and training info"""
     try:
         stats = detector.get_stats()
+        stats['feedback'] = online_learner.stats()
+        stats['micro_batching'] = micro_batcher.stats() if micro_batcher is not None else {'enabled': False}
+        stats['registry'] = dict(registry.summary(), serving=detector.training_stats.get('version'))
+        stats['shadow'] = shadow.stats() if shadow is not None else {'enabled': False}
+        # Under serve.py these counters are the answering worker's (/api/metrics sums all workers)
+        stats['worker_pid'] = os.getpid()
         return jsonify(stats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def metric_extras():
+    """Values owned outside the metrics registry, for /api/metrics"""
+    cache = detector.prediction_cache.stats()
+    return [
+        ('spam_model_version', 'gauge', 'Version of the live models (bumped on every swap)', detector.model_version),
+        ('spam_models_loaded', 'gauge', 'Whether models are loaded', int(detector.models_loaded)),
+        ('spam_cache_hits_total', 'counter', 'Prediction cache hits', cache['hits']),
+        ('spam_cache_misses_total', 'counter', 'Prediction cache misses', cache['misses']),
+        ('spam_cache_entries', 'gauge', 'Entries in the prediction cache', cache['size']),
+        ('spam_microbatch_queue_depth', 'gauge', 'Requests waiting for a micro-batch',
+         micro_batcher.queue_depth() if micro_batcher is not None else 0)
+    ]
+
+def publish_metrics():
+    """serve.py workers: share this process's metrics with the other workers"""
+    if shared_metrics is not None and metrics.enabled:
+        try:
+            shared_metrics.publish(metrics, metric_extras())
+        except OSError as e:
+            print(f"✗ Could not publish metrics: {e}")
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Request, stage and model timings in the Prometheus text format
+    Under serve.py the series of all workers are summed (see SharedMetrics).
+    """
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled (METRICS_ENABLED=0)'}), 404
+    
+    if shared_metrics is None:
+        text = metrics.render(extra=metric_extras())
+    else:
+        publish_metrics()
+        totals, extra = shared_metrics.combined()
+        text = totals.render(extra=extra)
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/feedback', methods=['POST'])
+def feedback():
+    """
+    Report the correct label of one or more emails
+    Feedback is logged, then applied to the models within a few seconds
+    (in mini-batches, without retraining from the dataset).
+    
+    Request body (one email or an array of them):
+    {
+        "subject": "Email subject",
+        "content": "Email content",
+        "label": "spam"  (or "ham")
+    }
+    
+    Response (202): {"accepted": 1, "pending": 1}
+    """
+    try:
+        data = request.json
+        items = data if isinstance(data, list) else [data]
+        
+        max_batch_size = app.config['MAX_BATCH_SIZE']
+        if len(items) > max_batch_size:
+            return jsonify({'error': f'Too much feedback at once: {len(items)} emails (maximum {max_batch_size})'}), 413
+        
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or (not item.get('subject') and not item.get('content')):
+                return jsonify({'error': f'Email {i}: please provide subject or content'}), 400
+            if item.get('label') not in ('spam', 'ham'):
+                return jsonify({'error': f'Email {i}: label must be "spam" or "ham"'}), 400
+        
+        pending = online_learner.submit(items)
+        
+        return jsonify({'accepted': len(items), 'pending': pending}), 202
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/retrain', methods=['POST'])
 def retrain():
     """
-    Retrain models (use with caution in production)
+    Retrain models in the background
+    Predictions keep being served by the current models until the new ones
+    are ready, then the new models are swapped in atomically.
+    
+    The new models are saved as a registry version. With "activate": false
+    they are only saved (not served), e.g. to be shadow-scored first.
     
     Request body:
     {
-        "dataset_path": "spam mail.csv"  (optional, defaults to spam mail.csv)
+        "dataset_path": "spam mail.csv",  (optional, defaults to spam mail.csv)
+        "activate": true                  (optional)
     }
+    
+    Response (202): {"job_id": "...", "status_url": "/api/retrain/<job_id>"}
     """
     try:
         data = request.json or {}
@@ -93,14 +406,135 @@ def retrain():
         if not os.path.exists(dataset_path):
             return jsonify({'error': f'Dataset not found: {dataset_path}'}), 404
         
-        print(f"Training models with dataset: {dataset_path}")
-        results = detector.train_models(dataset_path)
+        print(f"Starting background training with dataset: {dataset_path}")
+        job, started = retrain_jobs.start(dataset_path, activate=bool(data.get('activate', True)))
+        
+        if not started:
+            return jsonify({
+                'error': 'A retraining job is already running',
+                'job_id': job['id'],
+                'status_url': f"/api/retrain/{job['id']}"
+            }), 409
         
         return jsonify({
-            'message': 'Models trained successfully',
-            'results': results
+            'message': 'Retraining started',
+            'job_id': job['id'],
+            'status_url': f"/api/retrain/{job['id']}"
+        }), 202
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/retrain/<job_id>', methods=['GET'])
+def retrain_status(job_id):
+    """Status and progress of a retraining job"""
+    job = retrain_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job: {job_id}'}), 404
+    return jsonify(job)
+
+def swap_in_version(version, move_pointer):
+    """Load a registry version off to the side, move the active pointer, then swap the models in"""
+    candidate = SpamDetector(cache_size=0, campaigns=detector.campaign_settings)
+    candidate.load_models(registry.path(version))
+    if not candidate.models_loaded:
+        raise ValueError(f"Version {version} could not be loaded")
+    pointer = move_pointer()
+    detector.adopt_models(candidate)
+    # The shadow process scores against the active models: restart it for the new ones
+    if shadow is not None:
+        shadow.start()
+    return pointer
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Registered model versions with their test metrics, the active one and the shadow candidate"""
+    try:
+        versions = [{
+            'version': manifest['version'],
+            'created': manifest['created'],
+            'source': manifest['source'],
+            'parent': manifest['parent'],
+            'dataset': manifest['dataset'],
+            'models': {
+                name: {'accuracy': results['test_accuracy'], 'f1_score': results['f1_score']}
+                for name, results in manifest['training_stats'].get('results', {}).items()
+            }
+        } for manifest in registry.versions()]
+        return jsonify({
+            'active': registry.active(),
+            'serving': detector.training_stats.get('version'),
+            'shadow': shadow.version if shadow is not None else None,
+            'versions': versions
         })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/models/activate', methods=['POST'])
+def activate_model():
+    """
+    Serve another registry version
+    The version is loaded before the active pointer moves, so a version that
+    fails to load changes nothing. serve.py reloads its workers on its own.
     
+    Request body: {"version": "v0003"}
+    """
+    try:
+        version = (request.json or {}).get('version')
+        try:
+            registry.get(str(version))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
+        pointer = swap_in_version(version, lambda: registry.activate(version))
+        return jsonify({'active': pointer['active'], 'history': pointer['history']})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/models/rollback', methods=['POST'])
+def rollback_model():
+    """Serve the version that was active before the current one"""
+    try:
+        try:
+            version, _ = registry.previous()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+        pointer = swap_in_version(version, registry.rollback)
+        return jsonify({'active': pointer['active'], 'history': pointer['history']})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/models/shadow', methods=['POST'])
+def shadow_model():
+    """
+    Start shadow scoring of a candidate version, or stop it
+    
+    Request body:
+    {
+        "version": "v0004",  (null stops shadow scoring)
+        "fraction": 0.05     (optional: share of /api/predict requests sampled)
+    }
+    
+    Response: shadow stats (as in /api/stats)
+    """
+    global shadow
+    try:
+        data = request.json or {}
+        version = data.get('version')
+        scorer = None
+        if version is not None:
+            if version == registry.active():
+                return jsonify({'error': f'{version} is the active version'}), 400
+            try:
+                scorer = ShadowScorer(detector, MODELS_DIR, str(version), fraction=float(data.get('fraction', 0.05)))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        previous, shadow = shadow, scorer
+        if previous is not None:
+            previous.stop()
+        if shadow is not None and detector.models_loaded:
+            shadow.start()
+        return jsonify(shadow.stats() if shadow is not None else {'enabled': False})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
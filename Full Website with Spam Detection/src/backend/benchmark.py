@@ -0,0 +1,442 @@
+"""
+Offline Benchmark Suite
+Measures prediction latency, batch throughput, model load time, training time
+and memory, and the Flask API under concurrent requests - no running server needed
+(--http instead load-tests a running server, e.g. app.py against serve.py)
+
+Usage:
+    python benchmark.py [--output benchmark.json] [--quick] [--skip-training]
+    python benchmark.py --compare baseline.json [--tolerance 0.15]
+    python benchmark.py --http http://localhost:5000 [--clients 1,4,16] [--duration 10]
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from spam_detector import SpamDetector, MODELS_DIR, ARRAYS_SUBDIR, label_messages
+from model_registry import active_models_dir
+
+DATASET_PATH = 'spam mail.csv'
+
+# Synthetic message sets: messages of the dataset joined up to a target size
+MESSAGE_SIZES = {
+    'sms': 0,         # single dataset messages as they are
+    'email_1kb': 1024,
+    'email_8kb': 8192
+}
+
+
+def quiet():
+    """Silence the detector's progress output"""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p95_ms': round(float(np.percentile(samples, 95)), 4),
+        'p99_ms': round(float(np.percentile(samples, 99)), 4),
+        'mean_ms': round(float(samples.mean()), 4)
+    }
+
+
+def timed(function, *args):
+    """Run function once; returns (result, elapsed ms)"""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def make_message_sets(dataset_path, n_messages, seed=42):
+    """{size name: [{'subject', 'content'}, ...]} drawn from the dataset"""
+    df = label_messages(pd.read_csv(dataset_path, encoding='latin-1'))
+    texts = df['Messages'].astype(str).tolist()
+    rng = np.random.default_rng(seed)
+
+    message_sets = {}
+    for name, target in MESSAGE_SIZES.items():
+        messages = []
+        for _ in range(n_messages):
+            parts = [texts[rng.integers(len(texts))]]
+            while len(' '.join(parts)) < target:
+                parts.append(texts[rng.integers(len(texts))])
+            messages.append({'subject': parts[0][:60], 'content': ' '.join(parts)})
+        message_sets[name] = messages
+    return message_sets
+
+
+def bench_load(models_dir, repeats):
+    """Model load time for each saved format"""
+    results = {}
+    models_dir = active_models_dir(models_dir)
+    array_dir = os.path.join(models_dir, ARRAYS_SUBDIR)
+    loaders = {
+        'arrays': lambda detector: detector.load_arrays(array_dir),
+        'pickles': lambda detector: detector.load_pickles(models_dir)
+    }
+    for name, load in loaders.items():
+        samples = []
+        for _ in range(repeats):
+            detector = SpamDetector(cache_size=0)
+            with quiet():
+                _, elapsed = timed(load, detector)
+            if not detector.models_loaded:
+                break
+            samples.append(elapsed)
+        if samples:
+            results[name] = {'median_ms': round(float(np.median(samples)), 3)}
+    return results
+
+
+def bench_latency(detector, sklearn_models, message_sets, n_calls):
+    """
+    Single-message latency of predict_all, plus each stage and model on its own
+    - fused_linear scores Naive Bayes, SVM and Logistic Regression together
+    - sklearn_* time the original estimators' predict_proba, for comparison
+    """
+    results = {}
+    model_set = detector.model_set
+    for size, messages in message_sets.items():
+        messages = messages[:n_calls]
+
+        # Warm-up (first calls pay for lazy imports and cold caches)
+        for m in messages[:20]:
+            detector.predict_all(m['subject'], m['content'])
+
+        stages = {name: [] for name in ['predict_all', 'preprocess', 'patterns', 'vectorize', 'fused_linear', 'random_forest']}
+        stages.update({f'sklearn_{name}': [] for name in sklearn_models})
+
+        for m in messages:
+            stages['predict_all'].append(timed(detector.predict_all, m['subject'], m['content'])[1])
+
+            (texts, _), cleaning = timed(detector.prepare_messages, [m])
+            text = texts[0]
+            processed, elapsed = timed(detector.preprocess_text, text)
+            stages['preprocess'].append(cleaning + elapsed)
+            stages['patterns'].append(timed(detector.detect_patterns, text)[1])
+            X, elapsed = timed(model_set.vectorize, [text], [processed])
+            stages['vectorize'].append(elapsed)
+            if model_set.linear_models is not None:
+                stages['fused_linear'].append(timed(model_set.linear_models.predict_proba, X)[1])
+            if model_set.packed_forest is not None:
+                stages['random_forest'].append(timed(model_set.packed_forest.predict_proba, X)[1])
+            for name, model in sklearn_models.items():
+                stages[f'sklearn_{name}'].append(timed(model.predict_proba, X)[1])
+
+        results[size] = {
+            'avg_chars': round(float(np.mean([len(m['content']) for m in messages])), 1),
+            'stages': {name: percentiles(samples) for name, samples in stages.items() if samples}
+        }
+    return results
+
+
+def bench_throughput(detector, message_sets, batch_sizes):
+    """predict_batch throughput in messages per second"""
+    results = {}
+    for size, messages in message_sets.items():
+        results[size] = {}
+        for batch_size in batch_sizes:
+            batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+            batches = [b for b in batches if len(b) == batch_size] or [messages]
+            start = time.perf_counter()
+            for batch in batches:
+                detector.predict_batch(batch)
+            elapsed = time.perf_counter() - start
+            count = sum(len(b) for b in batches)
+            results[size][f'batch_{batch_size}'] = {'messages_per_second': round(count / elapsed, 1)}
+    return results
+
+
+def bench_training(dataset_path):
+    """Wall time and peak RSS of train_models in a fresh process"""
+    with tempfile.TemporaryDirectory(prefix='spam_benchmark_') as models_dir:
+        code = (
+            "import sys; from spam_detector import SpamDetector; "
+            "SpamDetector(cache_size=0).train_models(sys.argv[1], models_dir=sys.argv[2])"
+        )
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH')])))
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', code, dataset_path, models_dir],
+                                   stdout=subprocess.DEVNULL, env=env)
+
+        # wait4 gives the child's own resource usage (Unix only)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            peak = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        else:
+            returncode = process.wait()
+            peak = None
+        elapsed = time.perf_counter() - start
+
+    if returncode != 0:
+        raise RuntimeError(f"Training process exited with code {returncode}")
+    return {
+        'wall_seconds': round(elapsed, 3),
+        'peak_rss_mb': round(peak, 1) if peak is not None else None
+    }
+
+
+def bench_flask(detector, messages, threads, n_requests):
+    """/api/predict through Flask's test client from several threads at once"""
+    with quiet():
+        import app as api
+        api.boot_thread.join()
+    api.detector.adopt_models(detector)
+    api.detector.prediction_cache.max_size = 0
+
+    def call(m):
+        client = api.app.test_client()
+        start = time.perf_counter()
+        response = client.post('/api/predict', json=m)
+        return (time.perf_counter() - start) * 1000, response.status_code
+
+    requests = [messages[i % len(messages)] for i in range(n_requests)]
+    results = {}
+    for n_threads in threads:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            outcomes = list(pool.map(call, requests))
+        elapsed = time.perf_counter() - start
+        results[f'threads_{n_threads}'] = dict(
+            percentiles([ms for ms, _ in outcomes]),
+            requests_per_second=round(len(requests) / elapsed, 1),
+            errors=sum(1 for _, code in outcomes if code != 200)
+        )
+    return results
+
+
+def http_client(url, messages, deadline, results):
+    """Client process of bench_http: POST /api/predict until deadline, one connection per request"""
+    address = urllib.parse.urlsplit(url)
+    latencies = []
+    errors = 0
+    i = 0
+    while time.time() < deadline:
+        body = json.dumps(messages[i % len(messages)])
+        i += 1
+        start = time.perf_counter()
+        try:
+            connection = http.client.HTTPConnection(address.hostname, address.port or 80, timeout=30)
+            connection.request('POST', '/api/predict', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            ok = response.status == 200
+        except OSError:
+            ok = False
+        if ok:
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            errors += 1
+    results.put((latencies, errors))
+
+
+def bench_http(url, messages, clients, duration):
+    """/api/predict on a running server from several client processes at once, duration seconds each"""
+    results = {}
+    for n_clients in clients:
+        queue = multiprocessing.Queue()
+        deadline = time.time() + duration
+        processes = [
+            multiprocessing.Process(target=http_client, args=(url, messages[i::n_clients] or messages, deadline, queue))
+            for i in range(n_clients)
+        ]
+        for process in processes:
+            process.start()
+        outcomes = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        latencies = [ms for samples, _ in outcomes for ms in samples]
+        results[f'clients_{n_clients}'] = dict(
+            percentiles(latencies or [0.0]),
+            requests_per_second=round(len(latencies) / duration, 1),
+            errors=sum(errors for _, errors in outcomes)
+        )
+        info = results[f'clients_{n_clients}']
+        print(f"  {n_clients} clients: {info['requests_per_second']:.0f} req/s, "
+              f"p50 {info['p50_ms']:.2f} ms, p99 {info['p99_ms']:.2f} ms, errors {info['errors']}")
+    return results
+
+
+def run(args):
+    """Run every benchmark; returns the results dict"""
+    print("Preparing message sets...")
+    message_sets = make_message_sets(args.dataset, args.messages)
+
+    results = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'messages_per_set': args.messages
+        }
+    }
+
+    print("Benchmarking model loading...")
+    results['load'] = bench_load(args.models_dir, args.repeats)
+
+    detector = SpamDetector(cache_size=0)
+    with quiet():
+        detector.load_models(args.models_dir)
+    if not detector.models_loaded:
+        raise RuntimeError(f"No trained models in {args.models_dir}; run train_model.py first")
+
+    # The original sklearn estimators, when the pickles are there
+    reference = SpamDetector(cache_size=0)
+    with quiet():
+        reference.load_pickles(active_models_dir(args.models_dir))
+
+    print("Benchmarking single-message latency...")
+    results['latency'] = bench_latency(detector, reference.models, message_sets, args.messages)
+
+    print("Benchmarking batch throughput...")
+    results['throughput'] = bench_throughput(detector, message_sets, [1, 100, 1000])
+
+    if not args.skip_training:
+        print("Benchmarking training...")
+        results['training'] = bench_training(args.dataset)
+
+    print("Benchmarking the Flask API under concurrency...")
+    results['flask'] = bench_flask(detector, message_sets['sms'], [1, 4, 16], args.messages)
+
+    return results
+
+
+def flatten(results, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1}, numbers only"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """
+    Metrics that got worse than the baseline by more than tolerance (a fraction)
+    Rates (per second) should go up, everything else (ms, seconds, MB) down.
+    p99 and mean latencies are recorded but not compared: one slow outlier
+    moves them too much to gate on.
+    """
+    current = flatten({k: v for k, v in results.items() if k != 'meta'})
+    previous = flatten({k: v for k, v in baseline.items() if k != 'meta'})
+
+    regressions = []
+    for name, value in sorted(current.items()):
+        old = previous.get(name)
+        if not old or name.endswith(('errors', 'avg_chars', 'p99_ms', 'mean_ms')):
+            continue
+        change = (value - old) / old
+        worse = -change if 'per_second' in name else change
+        if worse > tolerance:
+            regressions.append({'metric': name, 'baseline': old, 'current': value, 'change': round(change, 3)})
+    return regressions
+
+
+def print_summary(results):
+    print("\n" + "=" * 60)
+    print(" BENCHMARK RESULTS ")
+    print("=" * 60)
+    for size, info in results['latency'].items():
+        total = info['stages']['predict_all']
+        print(f"\npredict_all [{size}, ~{info['avg_chars']:.0f} chars]: "
+              f"p50 {total['p50_ms']:.2f} ms  p95 {total['p95_ms']:.2f} ms  p99 {total['p99_ms']:.2f} ms")
+        for stage, stats in info['stages'].items():
+            if stage != 'predict_all':
+                print(f"  {stage:<30} p50 {stats['p50_ms']:.3f} ms  p99 {stats['p99_ms']:.3f} ms")
+    for size, batches in results['throughput'].items():
+        rates = ', '.join(f"{name}: {info['messages_per_second']:.0f}/s" for name, info in batches.items())
+        print(f"\nThroughput [{size}]: {rates}")
+    for name, info in results['load'].items():
+        print(f"Load ({name}): {info['median_ms']:.1f} ms")
+    if 'training' in results:
+        print(f"Training: {results['training']['wall_seconds']:.1f} s, peak RSS {results['training']['peak_rss_mb']} MB")
+    for name, info in results['flask'].items():
+        print(f"Flask {name}: {info['requests_per_second']:.0f} req/s, p50 {info['p50_ms']:.2f} ms, "
+              f"p99 {info['p99_ms']:.2f} ms, errors {info['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline performance benchmarks for the spam detector')
+    parser.add_argument('--dataset', default=DATASET_PATH, help='CSV the message sets are drawn from')
+    parser.add_argument('--models-dir', default=MODELS_DIR, help='directory with the trained models')
+    parser.add_argument('--messages', type=int, default=1000, help='messages per size set')
+    parser.add_argument('--repeats', type=int, default=5, help='repetitions of the load benchmark')
+    parser.add_argument('--quick', action='store_true', help='fewer messages and repeats, no training')
+    parser.add_argument('--skip-training', action='store_true', help="don't benchmark train_models")
+    parser.add_argument('--output', default='benchmark.json', help='where to write the JSON results')
+    parser.add_argument('--compare', default=None, help='baseline JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed slowdown before flagging (fraction)')
+    parser.add_argument('--http', default=None, help='load-test the server running at this URL instead')
+    parser.add_argument('--clients', default='1,4,16', help='concurrent client processes for --http (comma-separated)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per client count for --http')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.messages = min(args.messages, 200)
+        args.repeats = min(args.repeats, 2)
+        args.skip_training = True
+
+    print("\n" + "=" * 60)
+    print(" EMAIL SPAM DETECTION - BENCHMARK ")
+    print("=" * 60 + "\n")
+
+    if args.http:
+        print(f"Load-testing {args.http} (POST /api/predict)...")
+        results = {
+            'meta': {
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'url': args.http,
+                'cpu_count': os.cpu_count()
+            },
+            'http': bench_http(args.http, make_message_sets(args.dataset, args.messages)['sms'],
+                               [int(n) for n in args.clients.split(',')], args.duration)
+        }
+    else:
+        results = run(args)
+        print_summary(results)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if baseline.get('meta', {}).get('messages_per_set') != args.messages:
+            print("\n! Baseline used a different --messages setting; numbers may not be comparable")
+
+        print("\n" + "=" * 60)
+        print(f" COMPARISON WITH {args.compare} (tolerance {args.tolerance:.0%}) ")
+        print("=" * 60)
+        if not regressions:
+            print("✓ No regressions")
+        for r in regressions:
+            print(f"✗ {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.1%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+Bounded Input - Size-Capped Cleaning of Email Text Before Scoring
+Markup, encoded attachments and sheer length cost time and memory in every
+later stage (lowercasing, the pattern regexes, the vectorizer) without
+telling the models much. Each subject and body is read once, in chunks, up
+to a fixed number of characters from its start and its end: HTML is reduced
+to its visible text, base64 and other long runs without spaces are dropped,
+and only a head and a tail window of what is left are scored. Plain text
+that fits the windows comes out unchanged.
+"""
+
+import html
+import re
+
+# Characters of cleaned text kept from the start and from the end of a long message
+HEAD_CHARS = 32 * 1024
+TAIL_CHARS = 8 * 1024
+
+# Raw characters read per window character (HTML markup takes several times the space of its text)
+SCAN_FACTOR = 8
+
+# Raw characters cleaned at a time; chunks end at a tag end or whitespace within the last CUT_SEARCH
+CHUNK_CHARS = 16 * 1024
+CUT_SEARCH = 1024
+
+# Whitespace-free runs: base64 (attachments, inline images) from 64 characters on, anything from 200 on;
+# long links keep their first URL_CHARS characters
+BASE64_RUN = 64
+LONG_RUN = 200
+URL_CHARS = 100
+# (a dropped run takes the whitespace after it along, so a block of base64 lines leaves nothing)
+RUN_PATTERN = re.compile(
+    rf'(?<!\S)(?:[A-Za-z0-9+/]{{{BASE64_RUN},}}={{0,2}}(?!\S)|(\S{{{LONG_RUN},}}))\s*'
+)
+URL_START = re.compile(r'(?:https?://|www\.)', re.IGNORECASE)
+
+# A message is HTML if it has one of these tags (SMS-style text like "<Forwarded from 123>" isn't)
+HTML_PROBE = re.compile(
+    r'<(?:!doctype|html|head|body|div|p|br|span|table|tr|td|a|img|font|b|i|u|strong|em|center|'
+    r'ul|ol|li|h[1-6]|meta|style|script|title)\b',
+    re.IGNORECASE
+)
+# Elements dropped with their content; the rest of the markup leaves its text
+HTML_BLOCK = re.compile(r'<(script|style|head)\b|<!--')
+HTML_TAG = re.compile(r'</?[a-zA-Z!?][^<>]*>')
+
+
+def looks_like_html(text):
+    return HTML_PROBE.search(text) is not None
+
+
+class Cleaner:
+    """
+    Cleans consecutive chunks of one text
+    - html: strip tags, <script>/<style>/<head> elements and comments, decode entities
+      (plain text keeps entities such as "&lt;" as they are)
+    - Remembers an element left open at the end of a chunk, so the next chunk
+      continues skipping it
+    - dropped: whitespace-free runs removed so far
+    """
+
+    def __init__(self, html=False):
+        self.html = html
+        self.closer = None
+        self.dropped = 0
+
+    def feed(self, chunk):
+        if self.html:
+            chunk = ' '.join(self.strip_html(chunk).split())
+        return RUN_PATTERN.sub(self.replace_run, chunk)
+
+    def strip_html(self, chunk):
+        lower = chunk.lower()
+        parts, pos = [], 0
+        while pos < len(chunk):
+            if self.closer is not None:
+                end = lower.find(self.closer, pos)
+                if end < 0:
+                    break
+                end += len(self.closer)
+                if self.closer != '-->':
+                    end = lower.find('>', end) + 1 or len(chunk)
+                self.closer = None
+                pos = end
+                continue
+            match = HTML_BLOCK.search(lower, pos)
+            if match is None:
+                parts.append(chunk[pos:])
+                break
+            parts.append(chunk[pos:match.start()])
+            self.closer = '-->' if match.group(1) is None else f'</{match.group(1)}'
+            pos = match.end()
+        return html.unescape(HTML_TAG.sub(' ', ' '.join(parts)))
+
+    def replace_run(self, match):
+        run = match.group(1)
+        if run is not None and URL_START.match(run):
+            return run[:URL_CHARS] + ' '
+        self.dropped += 1
+        return ''
+
+
+def cut_point(text, start, end):
+    """End of a chunk of text[start:end]: just after a tag end or at whitespace near end, else end"""
+    if end >= len(text):
+        return len(text)
+    low = max(start, end - CUT_SEARCH)
+    tag_end = text.rfind('>', low, end)
+    space = max(text.rfind(' ', low, end), text.rfind('\n', low, end))
+    cut = max(tag_end + 1, space)
+    return cut if cut > start else end
+
+
+def html_to_text(markup):
+    """Visible text of an HTML body"""
+    return Cleaner(html=True).strip_html(markup)
+
+
+class InputLimits:
+    """
+    Bounded cleaning of message text before scoring
+    - head_chars / tail_chars: cleaned characters kept from the start and the
+      end; a message that is longer after cleaning keeps only these windows
+    - At most (head_chars + tail_chars) * SCAN_FACTOR raw characters are read
+      from the start and tail_chars * SCAN_FACTOR from the end, however long
+      the input is
+    """
+
+    def __init__(self, head_chars=HEAD_CHARS, tail_chars=TAIL_CHARS):
+        if head_chars <= 0 or tail_chars < 0:
+            raise ValueError(f"head_chars must be positive and tail_chars non-negative "
+                             f"(got {head_chars}, {tail_chars})")
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+
+    def clean(self, text):
+        """
+        Cleaned, windowed text and what was done to it:
+        (text, {'truncated', 'original_chars', 'analyzed_chars', 'html', 'dropped_runs'})
+        """
+        window = self.head_chars + self.tail_chars
+        limit = cut_point(text, 0, window * SCAN_FACTOR)
+        cleaner = Cleaner(html=looks_like_html(text[:CHUNK_CHARS]))
+
+        # Head: clean chunk by chunk until there is enough text for both windows
+        pieces, size, pos = [], 0, 0
+        while pos < limit and size <= window:
+            end = cut_point(text, pos, min(pos + CHUNK_CHARS, limit))
+            piece = cleaner.feed(text[pos:end])
+            pieces.append(piece)
+            size += len(piece)
+            pos = end
+        cleaned = ''.join(pieces)
+
+        truncated = False
+        if pos < len(text):
+            # Tail: read from the end, starting after a tag end or whitespace
+            start = max(pos, len(text) - self.tail_chars * SCAN_FACTOR)
+            start = cut_point(text, start, min(start + CUT_SEARCH, len(text))) if start > pos else start
+            tail_cleaner = Cleaner(html=cleaner.html)
+            tail = tail_cleaner.feed(text[start:])
+            cleaner.dropped += tail_cleaner.dropped
+            cleaned = f"{head_window(cleaned, self.head_chars)}\n{tail_window(tail, self.tail_chars)}"
+            truncated = True
+        elif len(cleaned) > window:
+            cleaned = f"{head_window(cleaned, self.head_chars)}\n{tail_window(cleaned, self.tail_chars)}"
+            truncated = True
+
+        return cleaned, {
+            'truncated': truncated,
+            'original_chars': len(text),
+            'analyzed_chars': len(cleaned),
+            'html': cleaner.html,
+            'dropped_runs': cleaner.dropped
+        }
+
+    def prepare(self, message):
+        """
+        Combined text of a message dict ('subject', 'content'), each part cleaned
+        Returns (text, info) with info as in clean, for the whole message
+        """
+        subject, subject_info = self.clean(str(message.get('subject', '')))
+        content, content_info = self.clean(str(message.get('content', '')))
+        text = f"{subject} {content}"
+        return text, {
+            'truncated': subject_info['truncated'] or content_info['truncated'],
+            'original_chars': subject_info['original_chars'] + content_info['original_chars'] + 1,
+            'analyzed_chars': len(text),
+            'html': subject_info['html'] or content_info['html'],
+            'dropped_runs': subject_info['dropped_runs'] + content_info['dropped_runs']
+        }
+
+
+def head_window(text, chars):
+    """First chars characters of text, without a word cut in half"""
+    if len(text) <= chars:
+        return text
+    head = text[:chars]
+    if not text[chars].isspace():
+        space = head.rfind(' ')
+        head = head[:space] if space > 0 else head
+    return head
+
+
+def tail_window(text, chars):
+    """Last chars characters of text, without a word cut in half"""
+    if not chars:
+        return ''
+    if len(text) <= chars:
+        return text
+    tail = text[len(text) - chars:]
+    if not text[len(text) - chars - 1].isspace():
+        space = tail.find(' ')
+        tail = tail[space + 1:] if space >= 0 else tail
+    return tail
@@ -0,0 +1,305 @@
+"""
+Campaign Index - Near-Duplicate Lookup of Known Spam
+Spam campaigns send many slightly different copies of one message (other names,
+amounts, links). Each message is reduced to a MinHash signature of its word
+shingles; locality-sensitive hashing (LSH) finds known spam whose shingles mostly
+match without comparing against every entry, and the verdict stored for that
+campaign is returned instead of running the models.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+from model_store import write_atomic
+
+CAMPAIGNS_SUBDIR = 'campaigns'
+INDEX_FILE = 'index.npz'
+META_FILE = 'index.json'
+MODEL_NAMES = ['naive_bayes', 'svm', 'random_forest', 'logistic_regression']
+SOURCES = ['dataset', 'prediction']
+
+# Prime just above 2**32 for the MinHash permutations (a * h + b) % PRIME
+PRIME = 4294967311
+
+# Parts of a message that change from one copy of a campaign to the next
+VARIABLE_PARTS = [
+    (re.compile(r'(?:https?://|www\.)\S+'), ' url '),
+    (re.compile(r'\S+@\S+\.\S+'), ' email '),
+    (re.compile(r'\d+(?:[.,]\d+)*'), ' 0 ')
+]
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def shingles(text, size=3):
+    """Distinct hashes of the word size-grams of a preprocessed message (links, emails and numbers normalized)"""
+    for pattern, replacement in VARIABLE_PARTS:
+        text = pattern.sub(replacement, text)
+    words = WORD_PATTERN.findall(text)
+    grams = [' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))] if words else []
+    return np.unique(np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams),
+                                 dtype=np.uint64, count=len(grams)))
+
+
+class CampaignIndex:
+    """
+    In-memory MinHash/LSH index of known spam
+    - num_perm hash functions, split into bands of num_perm // bands rows;
+      messages sharing any band are candidates, kept if their estimated
+      Jaccard similarity is at least threshold
+    - Holds at most max_entries campaigns (least recently matched evicted first);
+      entries learned from predictions also expire max_age seconds after their
+      last match. Entries seeded from the labeled dataset don't expire.
+    - Adding a near-duplicate of a known campaign refreshes that entry instead
+      of adding a new one, so a campaign takes one slot however many copies arrive
+    - Messages with fewer than min_shingles shingles are too short to compare
+    - min_score: ensemble score a prediction needs to be remembered (see SpamDetector.predict_batch)
+    """
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.7, max_entries=10000, max_age=30 * 86400,
+                 min_shingles=4, min_score=0.99, seed=42):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.min_shingles = min_shingles
+        self.min_score = min_score
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2 ** 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2 ** 32, num_perm, dtype=np.uint64)
+
+        # Entry slots
+        self.signatures = np.zeros((max_entries, num_perm), dtype=np.uint64)
+        self.scores = np.zeros(max_entries)
+        self.probabilities = np.full((max_entries, len(MODEL_NAMES)), np.nan)
+        self.sources = np.zeros(max_entries, dtype=np.int8)
+        self.created = np.zeros(max_entries)
+        self.last_seen = np.zeros(max_entries)
+        self.hit_counts = np.zeros(max_entries, dtype=np.int64)
+        self.free = list(range(max_entries - 1, -1, -1))
+        self.recent = OrderedDict()  # slot -> None, least recently matched first
+
+        # One {band hash: slot, or list of slots when several share it} table per band
+        # (a bare slot for the usual single entry keeps the tables small)
+        self.buckets = [{} for _ in range(bands)]
+        self.lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.added = 0
+        self.refreshed = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def signature(self, hashes):
+        """MinHash signature (num_perm,) of a set of shingle hashes"""
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % PRIME).min(axis=1)
+
+    def band_keys(self, signature):
+        return [hash(band.tobytes()) for band in signature.reshape(self.bands, -1)]
+
+    def match(self, signature, now):
+        """Best live entry with similarity >= threshold: (slot, similarity) or (None, 0.0); lock held"""
+        candidates = set()
+        for table, key in zip(self.buckets, self.band_keys(signature)):
+            slots = table.get(key)
+            if slots is None:
+                continue
+            if isinstance(slots, list):
+                candidates.update(slots)
+            else:
+                candidates.add(slots)
+        if not candidates:
+            return None, 0.0
+
+        slots = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (self.signatures[slots] == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        slot = int(slots[best])
+        if similarity[best] < self.threshold:
+            return None, 0.0
+        if self.expired(slot, now):
+            self.remove(slot)
+            self.expirations += 1
+            return None, 0.0
+        return slot, float(similarity[best])
+
+    def expired(self, slot, now):
+        return SOURCES[self.sources[slot]] != 'dataset' and now - self.last_seen[slot] > self.max_age
+
+    def lookup(self, text):
+        """
+        Known campaign a preprocessed message belongs to, or None
+        Returns {'id', 'similarity', 'score', 'probabilities', 'source'}
+        """
+        hashes = shingles(text)
+        if len(hashes) < self.min_shingles:
+            return None
+        signature = self.signature(hashes)
+        now = time.time()
+
+        with self.lock:
+            self.lookups += 1
+            slot, similarity = self.match(signature, now)
+            if slot is None:
+                return None
+            self.hits += 1
+            self.hit_counts[slot] += 1
+            self.last_seen[slot] = now
+            self.recent.move_to_end(slot)
+            return {
+                'id': slot,
+                'similarity': round(similarity, 4),
+                'score': float(self.scores[slot]),
+                'probabilities': {
+                    name: (None if np.isnan(p) else float(p))
+                    for name, p in zip(MODEL_NAMES, self.probabilities[slot])
+                },
+                'source': SOURCES[self.sources[slot]]
+            }
+
+    def add(self, text, score, probabilities, source='prediction'):
+        """
+        Remember a spam message with the verdict to answer its near-duplicates with
+        - probabilities: {model name: spam probability or None}
+        Returns the slot used (an existing one for a known campaign), or None if the message is too short
+        """
+        hashes = shingles(text)
+        if len(hashes) < self.min_shingles:
+            return None
+        signature = self.signature(hashes)
+        now = time.time()
+
+        with self.lock:
+            slot, _ = self.match(signature, now)
+            if slot is not None:
+                self.last_seen[slot] = now
+                self.recent.move_to_end(slot)
+                self.refreshed += 1
+                return slot
+
+            if not self.free:
+                oldest = next(iter(self.recent))
+                self.remove(oldest)
+                self.evictions += 1
+            slot = self.free.pop()
+
+            self.signatures[slot] = signature
+            self.scores[slot] = score
+            self.probabilities[slot] = [
+                np.nan if probabilities.get(name) is None else probabilities[name] for name in MODEL_NAMES
+            ]
+            self.sources[slot] = SOURCES.index(source)
+            self.created[slot] = now
+            self.last_seen[slot] = now
+            self.hit_counts[slot] = 0
+            self.insert(slot)
+            self.added += 1
+            return slot
+
+    def insert(self, slot):
+        """Put a filled slot into the band tables; lock held"""
+        for table, key in zip(self.buckets, self.band_keys(self.signatures[slot])):
+            slots = table.get(key)
+            if slots is None:
+                table[key] = slot
+            elif isinstance(slots, list):
+                slots.append(slot)
+            else:
+                table[key] = [slots, slot]
+        self.recent[slot] = None
+
+    def remove(self, slot):
+        """Free a slot; lock held"""
+        for table, key in zip(self.buckets, self.band_keys(self.signatures[slot])):
+            slots = table.get(key)
+            if isinstance(slots, list):
+                slots.remove(slot)
+                if len(slots) == 1:
+                    table[key] = slots[0]
+            elif slots == slot:
+                del table[key]
+        del self.recent[slot]
+        self.free.append(slot)
+
+    def __len__(self):
+        return len(self.recent)
+
+    def save(self, path):
+        """Save the live entries to path (index.npz + index.json), atomically"""
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            slots = np.fromiter(self.recent, dtype=np.int64, count=len(self.recent))
+            arrays = {
+                'signatures': self.signatures[slots],
+                'scores': self.scores[slots],
+                'probabilities': self.probabilities[slots],
+                'sources': self.sources[slots],
+                'created': self.created[slots],
+                'last_seen': self.last_seen[slots],
+                'hit_counts': self.hit_counts[slots]
+            }
+        meta = {
+            'num_perm': self.num_perm,
+            'bands': self.bands,
+            'seed': self.seed,
+            'entries': len(slots),
+            'saved': time.time()
+        }
+        write_atomic(os.path.join(path, INDEX_FILE), lambda f: np.savez(f, allow_pickle=False, **arrays))
+        write_atomic(os.path.join(path, META_FILE), lambda f: f.write(json.dumps(meta, indent=2).encode('utf-8')))
+
+    @classmethod
+    def load(cls, path, **settings):
+        """
+        Index saved by save(), with threshold / max_entries / max_age etc. from settings
+        Entries beyond max_entries are dropped, least recently matched first
+        """
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(num_perm=meta['num_perm'], bands=meta['bands'], seed=meta['seed'], **settings)
+        with np.load(os.path.join(path, INDEX_FILE), allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+
+        keep = np.argsort(arrays['last_seen'], kind='stable')[-index.max_entries:]
+        with index.lock:
+            for i in keep:
+                slot = index.free.pop()
+                index.signatures[slot] = arrays['signatures'][i]
+                index.scores[slot] = arrays['scores'][i]
+                index.probabilities[slot] = arrays['probabilities'][i]
+                index.sources[slot] = arrays['sources'][i]
+                index.created[slot] = arrays['created'][i]
+                index.last_seen[slot] = arrays['last_seen'][i]
+                index.hit_counts[slot] = arrays['hit_counts'][i]
+                index.insert(slot)
+        return index
+
+    def stats(self):
+        """Counters for /api/stats"""
+        with self.lock:
+            sources = np.bincount(self.sources[list(self.recent)], minlength=len(SOURCES)) if self.recent else [0, 0]
+            return {
+                'enabled': True,
+                'entries': len(self.recent),
+                'max_entries': self.max_entries,
+                'by_source': {name: int(count) for name, count in zip(SOURCES, sources)},
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                'added': self.added,
+                'refreshed': self.refreshed,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'threshold': self.threshold,
+                'min_score': self.min_score
+            }
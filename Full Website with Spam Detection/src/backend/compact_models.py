@@ -0,0 +1,353 @@
+"""
+Compact Trained Models
+Shrinks saved models for serving: drops the vectorizer's stop_words_ set,
+prunes the feature columns that barely move any model, re-indexes the
+vocabulary, and stores weights, IDF and forest arrays as float32. Reports
+the size and accuracy against the full models. The compacted models are
+saved as a new registry version (source 'compact'), so the full ones stay
+available to roll back to.
+
+Usage:
+    python compact_models.py [--models-dir models] [--version VERSION] [--dataset "spam mail.csv"]
+                             [--max-flip-rate 0.001] [--max-score-change 0.02] [--no-activate]
+"""
+
+from spam_detector import SpamDetector, MODELS_DIR, split_dataset
+from model_registry import ModelRegistry
+from ensemble_search import evaluate as evaluate_ensemble
+from text_features import stack_features
+import argparse
+import copy
+import os
+import sys
+import time
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import normalize
+
+
+def directory_bytes(models_dir):
+    """Size of the saved models: {'pickles': bytes, 'arrays': bytes}"""
+    sizes = {'pickles': 0, 'arrays': 0}
+    for root, _, files in os.walk(models_dir):
+        for name in files:
+            if name.endswith('.pkl'):
+                sizes['pickles'] += os.path.getsize(os.path.join(root, name))
+            elif name.endswith('.npy') or name == 'manifest.json':
+                sizes['arrays'] += os.path.getsize(os.path.join(root, name))
+    return sizes
+
+
+def column_scores(detector, X):
+    """
+    How much each input column matters to the model that needs it most
+    Each model ranks the columns (0 = least important, 1 = most), and a column
+    scores its best rank:
+    - Linear models: largest |weight * value| over the rows of X
+    - Random forest: impurity-based feature importance
+    """
+    importances = []
+    linear = detector.linear_models
+    if linear is not None and linear.weights is not None:
+        largest = np.asarray(abs(X).max(axis=0).todense()).ravel()
+        importances.extend((np.abs(np.asarray(linear.weights)) * largest[:, None]).T)
+
+    forest = detector.models.get('random_forest')
+    if forest is not None and hasattr(forest, 'feature_importances_'):
+        importances.append(forest.feature_importances_)
+
+    ranks = [np.argsort(np.argsort(values, kind='stable'), kind='stable') for values in importances]
+    return np.max(ranks, axis=0) / X.shape[1]
+
+
+def ensemble_scores(detector, X):
+    """Weighted ensemble spam scores for the rows of X"""
+    probabilities = detector.holdout_probabilities(X)
+    return sum(probabilities[name] * weight for name, weight in detector.ensemble_weights.items())
+
+
+def unnormalized_terms(vectorizer, texts):
+    """TF-IDF rows of texts before the vectorizer's row normalization"""
+    raw = copy.deepcopy(vectorizer)
+    raw._tfidf.norm = None
+    return raw.transform(texts)
+
+
+def pruned_rows(terms, features, dropped, norm='l2'):
+    """
+    Model input the compact vectorizer gives for these rows, at full width:
+    dropped terms zeroed and the rest renormalized (the row norm only sees
+    the kept vocabulary), then the text feature columns (or None)
+    """
+    terms = terms.copy()
+    terms.data[dropped[terms.indices]] = 0.0
+    terms.eliminate_zeros()
+    if norm is not None:
+        terms = normalize(terms, norm=norm, copy=False)
+    return terms if features is None else stack_features(terms, features)
+
+
+def select_columns(detector, train, held_out, max_flip_rate=0.001, max_score_change=0.02):
+    """
+    Vocabulary columns to keep: drops the least important terms (see
+    column_scores, ranked on the training rows, where every term occurs)
+    for as long as, on the held-out rows,
+    - at most max_flip_rate of the rows change verdict, and
+    - the 99th percentile of the ensemble score change stays within
+      max_score_change (on the rows the models were fitted to, pruning moves
+      the scores less than on unseen emails)
+    - train, held_out: (terms, features) of each set of rows: unnormalized
+      TF-IDF rows (see unnormalized_terms) and text feature values, which are
+      never dropped (or None)
+    Returns a boolean mask over the vocabulary
+    """
+    norm = detector.vectorizer.norm
+    n_terms = train[0].shape[1]
+    nothing = np.zeros(n_terms, dtype=bool)
+    order = np.argsort(column_scores(detector, pruned_rows(*train, nothing, norm))[:n_terms], kind='stable')
+    terms, features = held_out
+    reference = ensemble_scores(detector, pruned_rows(terms, features, nothing, norm))
+    allowed = int(max_flip_rate * terms.shape[0])
+
+    # Binary search on how many of the least important terms to drop
+    low, high = 0, n_terms
+    while low < high:
+        middle = (low + high + 1) // 2
+        dropped = nothing.copy()
+        dropped[order[:middle]] = True
+        scores = ensemble_scores(detector, pruned_rows(terms, features, dropped, norm))
+        flips = int(((scores >= detector.decision_threshold) != (reference >= detector.decision_threshold)).sum())
+        if flips <= allowed and np.percentile(np.abs(scores - reference), 99) <= max_score_change:
+            low = middle
+        else:
+            high = middle - 1
+
+    keep = np.ones(n_terms, dtype=bool)
+    keep[order[:low]] = False
+    return keep
+
+
+def prune_tree(tree, keep, new_index):
+    """
+    Copy of a fitted sklearn Tree that only reads the kept columns
+    A split on a dropped column is replaced by the branch a zero value takes
+    (what the dropped column always is), so its other subtree goes away too
+    """
+    from sklearn.tree._tree import Tree
+    _, (_, n_classes, n_outputs), state = tree.__reduce__()
+    nodes = state['nodes']
+    left, right = nodes['left_child'], nodes['right_child']
+    feature, threshold = nodes['feature'], nodes['threshold']
+
+    def live(node):
+        while left[node] != -1 and not keep[feature[node]]:
+            node = left[node] if 0.0 <= threshold[node] else right[node]
+        return node
+
+    # Depth-first walk of the live nodes, in the order they are renumbered
+    order = []
+    stack = [(live(0), 0)]
+    depth = 0
+    while stack:
+        node, node_depth = stack.pop()
+        order.append(node)
+        depth = max(depth, node_depth)
+        if left[node] != -1:
+            stack.append((live(right[node]), node_depth + 1))
+            stack.append((live(left[node]), node_depth + 1))
+    order = np.array(order)
+    renumber = np.full(len(nodes), -1, dtype=np.int64)
+    renumber[order] = np.arange(len(order))
+
+    pruned_nodes = nodes[order]
+    internal = pruned_nodes['left_child'] != -1
+    for child in ('left_child', 'right_child'):
+        pruned_nodes[child][internal] = renumber[[live(c) for c in pruned_nodes[child][internal]]]
+    pruned_nodes['feature'][internal] = new_index[pruned_nodes['feature'][internal]]
+
+    pruned = Tree(int(keep.sum()), n_classes, n_outputs)
+    pruned.__setstate__(dict(state, nodes=pruned_nodes, values=state['values'][order],
+                             node_count=len(order), max_depth=depth))
+    return pruned
+
+
+def prune_model(model, keep, new_index):
+    """Copy of a fitted estimator that takes only the kept columns as input"""
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.svm import SVC
+    from sklearn.linear_model import LogisticRegression, SGDClassifier
+    from sklearn.ensemble import RandomForestClassifier
+
+    model = copy.deepcopy(model)
+    if isinstance(model, MultinomialNB):
+        model.feature_count_ = model.feature_count_[:, keep]
+        model.feature_log_prob_ = model.feature_log_prob_[:, keep]
+    elif isinstance(model, (LogisticRegression, SGDClassifier)):
+        model.coef_ = model.coef_[:, keep]
+    elif isinstance(model, SVC):
+        model.support_vectors_ = model.support_vectors_[:, keep]
+        model.shape_fit_ = (model.shape_fit_[0], int(keep.sum()))
+    elif isinstance(model, RandomForestClassifier):
+        for tree_estimator in model.estimators_:
+            tree_estimator.tree_ = prune_tree(tree_estimator.tree_, keep, new_index)
+            tree_estimator.n_features_in_ = int(keep.sum())
+    else:
+        raise ValueError(f"Don't know how to prune {type(model).__name__}")
+    model.n_features_in_ = int(keep.sum())
+    return model
+
+
+def compact(detector, keep):
+    """
+    Prune a detector (with its sklearn estimators loaded) to the kept columns
+    and rebuild its serving engines in float32
+    - keep: boolean mask over the vocabulary; the text feature columns stay
+    """
+    vectorizer = detector.vectorizer
+    n_terms = len(keep)
+    if detector.text_features is not None:
+        keep = np.concatenate([keep, np.ones(detector.text_features.n_features, dtype=bool)])
+    new_index = np.cumsum(keep) - 1
+
+    # Vocabulary: kept terms renumbered in column order; stop_words_ is only
+    # a record of the terms dropped while fitting, never used to transform
+    idf = np.asarray(vectorizer.idf_)[keep[:n_terms]]
+    vectorizer.vocabulary_ = {term: int(new_index[i]) for term, i in vectorizer.vocabulary_.items() if keep[i]}
+    vectorizer.idf_ = idf
+    vectorizer._tfidf.n_features_in_ = len(idf)  # the setter above leaves the fitted input width
+    if hasattr(vectorizer, 'stop_words_'):
+        vectorizer.stop_words_ = None
+
+    detector.models = {name: prune_model(model, keep, new_index) for name, model in detector.models.items()}
+    detector.export_fast_models(compact=True)
+
+
+def compact_models(models_dir=MODELS_DIR, dataset_path='spam mail.csv', max_flip_rate=0.001, max_score_change=0.02,
+                   version=None, activate=True):
+    """
+    Compact a registry version of models_dir (default: the active one; see
+    module docstring) and save the result as a new version whose parent it is
+    - activate: serve the compacted version (see SpamDetector.register_models)
+    - The test split is halved: the pruning bounds are checked on one half,
+      and accuracy and score change are reported on the other
+    Returns the report stored in training_stats['compaction'], plus the
+    on-disk sizes before and after
+    """
+    start = time.perf_counter()
+    registry = ModelRegistry(models_dir)
+    version = version or registry.active()
+    source_dir = registry.path(version) if version is not None else models_dir
+    if version is not None:
+        registry.get(version)
+    detector = SpamDetector(cache_size=0)
+    detector.load_pickles(source_dir)
+    if not detector.models_loaded:
+        raise ValueError(f"No trained models in {source_dir}")
+    if not hasattr(detector.vectorizer, 'vocabulary_'):
+        raise ValueError("Only models with a fitted vocabulary can be compacted (not streaming/hashed ones)")
+    if 'compaction' in detector.training_stats:
+        raise ValueError("Models are already compacted; retrain to compact again")
+    size_before = directory_bytes(source_dir)
+
+    # Same split as train_models; the test rows are the only ones the models weren't fitted to
+    df = detector.load_dataset(dataset_path)
+    df['processed_text'] = df['Messages'].apply(detector.preprocess_text)
+    X_train, X_test, raw_train, raw_test, _, y_test = split_dataset(df)
+    tune_rows, check_rows = train_test_split(
+        np.arange(len(y_test)), test_size=0.5, random_state=42, stratify=y_test
+    )
+    X_tune, raw_tune = X_test.iloc[tune_rows], raw_test.iloc[tune_rows]
+    X_test, raw_test, y_test = X_test.iloc[check_rows], raw_test.iloc[check_rows], y_test.iloc[check_rows]
+
+    def vectorize(texts, raw):
+        X = detector.vectorizer.transform(texts)
+        if detector.text_features is not None:
+            X = stack_features(X, detector.text_features.transform(raw.tolist()))
+        return X
+
+    X_test_vec = vectorize(X_test, raw_test)
+    full_probabilities = detector.holdout_probabilities(X_test_vec)
+    full = evaluate_ensemble(full_probabilities, y_test, detector.ensemble_weights, detector.decision_threshold)
+    full_scores = ensemble_scores(detector, X_test_vec)
+
+    def rows(texts, raw):
+        features = None if detector.text_features is None else detector.text_features.transform(raw.tolist())
+        return unnormalized_terms(detector.vectorizer, texts), features
+
+    keep = select_columns(detector, rows(X_train, raw_train), rows(X_tune, raw_tune),
+                          max_flip_rate, max_score_change)
+    columns_before = X_test_vec.shape[1]
+
+    compact(detector, keep)
+    X_test_vec = vectorize(X_test, raw_test)
+    compact_probabilities = detector.holdout_probabilities(X_test_vec)
+    pruned = evaluate_ensemble(compact_probabilities, y_test, detector.ensemble_weights, detector.decision_threshold)
+    score_change = np.abs(ensemble_scores(detector, X_test_vec) - full_scores)
+
+    report = {
+        'columns_before': int(columns_before),
+        'columns_after': int(X_test_vec.shape[1]),
+        'max_flip_rate': max_flip_rate,
+        'max_score_change': max_score_change,
+        'full': full,
+        'compact': pruned,
+        'score_change_p99': round(float(np.percentile(score_change, 99)), 6),
+        'score_change_max': round(float(score_change.max()), 6)
+    }
+    # Compacted engines are smaller and faster: measure their serving costs again
+    costs = detector.measure_costs(raw_test.tolist(), X_test_vec, compact_probabilities, y_test)
+    detector.training_stats = dict(detector.training_stats, compaction=report, costs=costs,
+                                   feature_count=int(X_test_vec.shape[1]))
+    detector.register_models(models_dir, dataset_path, activate=activate, source='compact',
+                             base_dir=source_dir, parent=version)
+
+    report = dict(report, size_before=size_before, size_after=directory_bytes(detector.models_path),
+                  seconds=round(time.perf_counter() - start, 2))
+    print_report(report)
+    return report
+
+
+def print_report(report):
+    before, after = report['size_before'], report['size_after']
+    print("\nCompaction:")
+    print(f"  Columns:  {report['columns_before']} -> {report['columns_after']}")
+    for kind in ('pickles', 'arrays'):
+        change = (after[kind] - before[kind]) / before[kind] * 100 if before[kind] else 0.0
+        print(f"  {kind.title() + ':':9} {before[kind] / 1024:.0f} KB -> {after[kind] / 1024:.0f} KB ({change:+.1f}%)")
+    for metric in ('accuracy', 'precision', 'recall', 'f1_score'):
+        full, compact_value = report['full'][metric], report['compact'][metric]
+        print(f"  {metric.replace('_', ' ').title() + ':':11} {full*100:.2f}% -> {compact_value*100:.2f}% "
+              f"({(compact_value - full)*100:+.2f} points, check half of the test split)")
+    print(f"  Ensemble score change: {report['score_change_p99']:.4f} (99th percentile), "
+          f"{report['score_change_max']:.4f} (largest)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prune and shrink trained models for serving')
+    parser.add_argument('--models-dir', default=MODELS_DIR, help='directory with the trained models (.pkl files)')
+    parser.add_argument('--version', default=None, help='registry version to compact (default: the active one)')
+    parser.add_argument('--dataset', default='spam mail.csv', help='dataset the models were trained on')
+    parser.add_argument('--max-flip-rate', type=float, default=0.001,
+                        help='share of held-out emails whose verdict pruning may change')
+    parser.add_argument('--max-score-change', type=float, default=0.02,
+                        help='99th percentile of the ensemble score change pruning may cause')
+    parser.add_argument('--no-activate', action='store_true',
+                        help='save the compacted version without serving it (e.g. to shadow-score it first)')
+    args = parser.parse_args()
+
+    print("\n" + "=" * 60)
+    print(" COMPACT MODELS ")
+    print("=" * 60 + "\n")
+
+    try:
+        compact_models(args.models_dir, args.dataset, args.max_flip_rate, args.max_score_change,
+                       args.version, activate=not args.no_activate)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    print("\n✓ Compaction completed successfully!")
+    print("=" * 60 + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Convert Trained Models to the Array Format
+Reads the legacy pickles from models/ and writes the pickle-free,
+memory-mappable model store used for fast server start-up
+
+Usage:
+    python convert_models.py [--models-dir models] [--output models/arrays]
+"""
+
+from spam_detector import SpamDetector, MODELS_DIR, ARRAYS_SUBDIR
+from model_registry import active_models_dir
+import argparse
+import os
+import sys
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert pickled models to the array format')
+    parser.add_argument('--models-dir', default=MODELS_DIR,
+                        help='directory with the legacy .pkl files (its active registry version, if any)')
+    parser.add_argument('--output', default=None, help='output directory (default: <models-dir>/arrays)')
+    args = parser.parse_args()
+
+    models_dir = active_models_dir(args.models_dir)
+    output = args.output or os.path.join(models_dir, ARRAYS_SUBDIR)
+
+    print("\n" + "=" * 60)
+    print(" CONVERT MODELS TO ARRAY FORMAT ")
+    print("=" * 60 + "\n")
+
+    detector = SpamDetector()
+    detector.load_pickles(models_dir)
+    if not detector.models_loaded:
+        sys.exit(1)
+
+    detector.save_arrays(output)
+
+    # Check the converted models give the same predictions
+    converted = SpamDetector()
+    converted.load_arrays(output)
+    sample = [
+        {'subject': 'URGENT: You Won $1,000,000!', 'content': 'Click here to claim your prize'},
+        {'subject': 'Team Meeting Tomorrow', 'content': 'Reminder about our meeting at 10 AM'}
+    ]
+    for before, after in zip(detector.predict_batch(sample), converted.predict_batch(sample)):
+        if abs(before['ensemble'] - after['ensemble']) > 1e-9:
+            print("✗ Converted models give different predictions")
+            sys.exit(1)
+
+    print("\n✓ Conversion completed successfully!")
+    print("=" * 60 + "\n")
+
+if __name__ == '__main__':
+    main()
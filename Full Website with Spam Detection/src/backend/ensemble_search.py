@@ -0,0 +1,122 @@
+"""
+Ensemble Search - Learn Ensemble Weights and the Decision Threshold
+Grid search over the weight simplex on cached held-out probabilities; every
+weight combination and every threshold is scored at once with NumPy
+"""
+
+import itertools
+import time
+import numpy as np
+
+OBJECTIVES = ('f1', 'precision')
+
+
+def simplex_grid(n_models, step=0.05):
+    """All weight vectors with entries in multiples of step that sum to 1: shape (n_combinations, n_models)"""
+    units = int(round(1 / step))
+    # Stars and bars: choose the positions of n_models - 1 bars among units + n_models - 1 slots
+    bars = np.array(list(itertools.combinations(range(units + n_models - 1), n_models - 1)))
+    edges = np.column_stack([np.full(len(bars), -1), bars, np.full(len(bars), units + n_models - 1)])
+    return (np.diff(edges, axis=1) - 1) / units
+
+
+def objective_values(precision, recall, f1, objective, min_precision):
+    """Value to maximize: F1, or recall among cut-offs meeting the precision floor"""
+    if objective == 'f1':
+        return f1
+    return np.where(precision >= min_precision, recall, -np.inf)
+
+
+def best_thresholds(scores, y, objective='f1', min_precision=None):
+    """
+    Best decision threshold for every column of scores (n_samples, n_candidates)
+    Sorting each column gives the confusion counts of every possible cut-off
+    at once. Thresholds sit halfway between neighbouring scores.
+    Returns (value, threshold, precision, recall, f1), one entry per column.
+    """
+    n_samples = scores.shape[0]
+    order = np.argsort(-scores, axis=0, kind='stable')
+    sorted_scores = np.take_along_axis(scores, order, axis=0)
+    labels = y[order]
+
+    # Predicting the top i + 1 rows as spam
+    tp = np.cumsum(labels, axis=0)
+    fp = np.arange(1, n_samples + 1)[:, None] - tp
+    positives = max(int(y.sum()), 1)
+    precision = tp / (tp + fp)
+    recall = tp / positives
+    f1 = 2 * tp / (tp + fp + positives)
+
+    values = objective_values(precision, recall, f1, objective, min_precision)
+    # Only cut between different scores
+    values[:-1][sorted_scores[:-1] == sorted_scores[1:]] = -np.inf
+
+    best = np.argmax(values, axis=0)
+    columns = np.arange(scores.shape[1])
+    below = np.where(best + 1 < n_samples, sorted_scores[np.minimum(best + 1, n_samples - 1), columns], 0.0)
+    thresholds = (sorted_scores[best, columns] + below) / 2
+    return (values[best, columns], thresholds, precision[best, columns],
+            recall[best, columns], f1[best, columns])
+
+
+def evaluate(probabilities, y, weights, threshold, objective='f1', min_precision=None):
+    """
+    Metrics of one weighting and threshold: {score, precision, recall, f1_score, accuracy}
+    score is the objective's value (-1 when the precision floor is missed)
+    """
+    y = np.asarray(y)
+    scores = sum(probabilities[name] * weight for name, weight in weights.items())
+    predicted = scores >= threshold
+    tp = int((predicted & (y == 1)).sum())
+    precision = tp / max(int(predicted.sum()), 1)
+    recall = tp / max(int(y.sum()), 1)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    value = float(objective_values(np.array(precision), np.array(recall), np.array(f1), objective, min_precision))
+    return {
+        'score': value if np.isfinite(value) else -1.0,
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1_score': round(f1, 4),
+        'accuracy': round(float((predicted == (y == 1)).mean()), 4)
+    }
+
+
+def search_ensemble(probabilities, y, objective='f1', min_precision=None, step=0.05, prior_weights=None):
+    """
+    Weights and threshold maximizing the objective on held-out probabilities
+    - probabilities: {model name: spam probability per held-out row}
+    - objective: 'f1', or 'precision' = best recall with precision >= min_precision
+    - Ties go to the weights closest to prior_weights (the current ones)
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective!r} (expected one of {OBJECTIVES})")
+    if objective == 'precision' and min_precision is None:
+        raise ValueError("The precision objective needs min_precision")
+
+    start = time.perf_counter()
+    names = list(probabilities)
+    y = np.asarray(y)
+    P = np.column_stack([probabilities[name] for name in names])
+    grid = simplex_grid(len(names), step)
+
+    values, thresholds, precision, recall, f1 = best_thresholds(P @ grid.T, y, objective, min_precision)
+    if not np.isfinite(values).any():
+        raise ValueError(f"No weighting reaches precision {min_precision}")
+
+    candidates = np.flatnonzero(values == values.max())
+    if prior_weights is not None:
+        prior = np.array([prior_weights.get(name, 0.0) for name in names])
+        candidates = candidates[np.argsort(np.abs(grid[candidates] - prior).sum(axis=1), kind='stable')]
+    best = candidates[0]
+
+    return {
+        'weights': {name: round(float(w), 4) for name, w in zip(names, grid[best])},
+        'threshold': round(float(thresholds[best]), 6),
+        'objective': objective,
+        'min_precision': min_precision,
+        'search_precision': round(float(precision[best]), 4),
+        'search_recall': round(float(recall[best]), 4),
+        'search_f1_score': round(float(f1[best]), 4),
+        'combinations': len(grid),
+        'search_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
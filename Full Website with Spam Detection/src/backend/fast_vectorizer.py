@@ -0,0 +1,155 @@
+"""
+Fast Vectorizer - Vocabulary-Restricted N-Gram Counting for Serving
+sklearn's word analyzer builds every 1-, 2- and 3-gram of a message as a new
+string and then looks it up in the vocabulary, though almost none of them are
+in it. Compiled from a fitted TfidfVectorizer, this vectorizer maps each token
+to a word id once and matches n-grams as integer keys over whole batches; the
+counts then go through the vectorizer's own TF-IDF weighting, so the output is
+identical to transform.
+"""
+
+from itertools import repeat
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+# Word ids of tokens outside every vocabulary term, and of stop words (removed before n-grams)
+UNKNOWN = -1
+STOP = -2
+
+
+class VocabularyVectorizer:
+    """
+    Serving-only stand-in for a fitted word-analyzer TfidfVectorizer (see compile_vectorizer)
+    - words: {word: id} of the words of the vocabulary terms, plus the stop words (STOP)
+    - An n-gram (w1, ..., wn) of word ids is the key ((w1 * n_words + w2) * n_words + ...);
+      keys[n] holds the sorted keys of the n-word terms and columns[n] their columns
+    """
+
+    def __init__(self, vectorizer):
+        self.vectorizer = vectorizer
+        self.decode = vectorizer.decode
+        self.preprocess = vectorizer.build_preprocessor()
+        self.tokenize = vectorizer.build_tokenizer()
+        self.min_n, self.max_n = vectorizer.ngram_range
+        self.n_columns = len(vectorizer.vocabulary_)
+
+        terms = [(term.split(' '), column) for term, column in vectorizer.vocabulary_.items()]
+        self.words = {}
+        for parts, _ in terms:
+            for word in parts:
+                self.words.setdefault(word, len(self.words))
+        self.n_words = max(len(self.words), 1)
+
+        self.keys, self.columns = {}, {}
+        for n in range(self.min_n, self.max_n + 1):
+            grams = [(self.key([self.words[word] for word in parts]), column)
+                     for parts, column in terms if len(parts) == n]
+            grams.sort()
+            self.keys[n] = np.array([key for key, _ in grams], dtype=np.int64)
+            self.columns[n] = np.array([column for _, column in grams], dtype=np.int64)
+
+        # Stop words are dropped before n-grams are formed (even a vocabulary word, as in sklearn)
+        for word in vectorizer.get_stop_words() or ():
+            self.words[word] = STOP
+
+        # TF-IDF weighting: the steps of the fitted TfidfTransformer.transform (sklearn 1.3:
+        # sublinear tf, product with the IDF diagonal, row norm) without its per-call
+        # input validation; other versions fall back to calling it
+        self.tfidf = vectorizer._tfidf
+        self.idf_diag = getattr(self.tfidf, '_idf_diag', None)
+        self.direct = self.idf_diag is not None or not self.tfidf.use_idf
+
+    def key(self, ids):
+        key = 0
+        for word_id in ids:
+            key = key * self.n_words + word_id
+        return key
+
+    def word_ids(self, documents):
+        """Word ids of each document's tokens, stop words removed: (ids, document of each id)"""
+        lookup = self.words.get
+        ids, lengths = [], []
+        for document in documents:
+            tokens = self.tokenize(self.preprocess(self.decode(document)))
+            document_ids = [i for i in map(lookup, tokens, repeat(UNKNOWN)) if i != STOP]
+            ids.extend(document_ids)
+            lengths.append(len(document_ids))
+        ids = np.array(ids, dtype=np.int64)
+        return ids, np.repeat(np.arange(len(lengths)), lengths)
+
+    def count(self, documents):
+        """Vocabulary counts (CSR, sorted indices), as CountVectorizer.transform gives them"""
+        ids, owner = self.word_ids(documents)
+        n_documents = len(documents)
+        rows, columns = [], []
+
+        # keys: n-gram starting at each position; usable: every word known, same document
+        keys = np.zeros(len(ids), dtype=np.int64)
+        usable = np.ones(len(ids), dtype=bool)
+        for n in range(1, self.max_n + 1):
+            end = len(ids) - n + 1
+            if end <= 0:
+                break
+            last = ids[n - 1:]
+            keys = keys[:end] * self.n_words + last
+            usable = usable[:end] & (last >= 0) & (owner[:end] == owner[n - 1:])
+            if n < self.min_n or not len(self.keys[n]):
+                continue
+
+            starts = np.flatnonzero(usable)
+            found = np.searchsorted(self.keys[n], keys[starts])
+            found = np.minimum(found, len(self.keys[n]) - 1)
+            match = self.keys[n][found] == keys[starts]
+            rows.append(owner[starts[match]])
+            columns.append(self.columns[n][found[match]])
+
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        columns = np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64)
+        cells, counts = np.unique(rows * self.n_columns + columns, return_counts=True)
+        indptr = np.zeros(n_documents + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells // self.n_columns, minlength=n_documents), out=indptr[1:])
+
+        index_dtype = np.int32 if len(cells) <= np.iinfo(np.int32).max else np.int64
+        X = sp.csr_matrix(
+            (counts.astype(self.vectorizer.dtype), (cells % self.n_columns).astype(index_dtype),
+             indptr.astype(index_dtype)),
+            shape=(n_documents, self.n_columns)
+        )
+        X.has_sorted_indices = True
+        return X
+
+    def transform(self, documents):
+        """TF-IDF matrix of documents, identical to the compiled vectorizer's transform"""
+        X = self.count(documents)
+        if not self.direct:
+            return self.tfidf.transform(X, copy=False)
+        if self.tfidf.sublinear_tf:
+            np.log(X.data, X.data)
+            X.data += 1
+        if self.tfidf.use_idf:
+            X = X * self.idf_diag
+        if self.tfidf.norm is not None:
+            X = normalize(X, norm=self.tfidf.norm, copy=False)
+        return X
+
+
+def compile_vectorizer(vectorizer):
+    """
+    Fast serving vectorizer for a fitted TfidfVectorizer with a word analyzer,
+    or the vectorizer itself when it can't be compiled (hashed features,
+    character or custom analyzers, keys too wide for int64)
+    """
+    if getattr(vectorizer, 'analyzer', None) != 'word' or not hasattr(vectorizer, 'vocabulary_'):
+        return vectorizer
+    if not hasattr(vectorizer, '_tfidf'):
+        return vectorizer
+
+    terms = [term.split(' ') for term in vectorizer.vocabulary_]
+    if any('' in parts or not vectorizer.ngram_range[0] <= len(parts) <= vectorizer.ngram_range[1]
+           for parts in terms):
+        return vectorizer  # terms aren't plain space-joined tokens
+    n_words = len({word for parts in terms for word in parts})
+    if max(n_words, 1) ** vectorizer.ngram_range[1] >= 2 ** 62:
+        return vectorizer
+    return VocabularyVectorizer(vectorizer)
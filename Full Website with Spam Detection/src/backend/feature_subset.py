@@ -0,0 +1,32 @@
+"""
+Feature Subset - Fit a Model on Selected Columns Only
+Lets a model trained on a few columns of a wide (e.g. hashed) feature matrix
+accept the full matrix at prediction time
+"""
+
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+
+class FeatureSubsetClassifier(ClassifierMixin, BaseEstimator):
+    """
+    Wraps a classifier that only sees the given columns of X
+    - columns: indices of the input columns passed to the estimator, in order
+    """
+
+    def __init__(self, estimator, columns):
+        self.estimator = estimator
+        self.columns = columns
+
+    def fit(self, X, y):
+        self.columns_ = np.asarray(self.columns, dtype=np.int64)
+        self.estimator.fit(X[:, self.columns_], y)
+        self.classes_ = self.estimator.classes_
+        self.n_features_in_ = X.shape[1]
+        return self
+
+    def predict(self, X):
+        return self.estimator.predict(X[:, self.columns_])
+
+    def predict_proba(self, X):
+        return self.estimator.predict_proba(X[:, self.columns_])
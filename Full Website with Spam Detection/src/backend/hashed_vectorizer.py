@@ -0,0 +1,48 @@
+"""
+Hashed Vectorizer - TF-IDF Features Without a Vocabulary
+Maps n-grams to columns with a hash function, so vectorizing needs no fitted
+vocabulary and memory does not grow with the number of distinct n-grams
+"""
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+
+class HashingTfidfVectorizer:
+    """
+    Hashed n-gram counts with optional IDF weighting and L2 normalization
+    - Same weighting as TfidfVectorizer (raw counts, smoothed IDF, L2 norm),
+      but columns are n-gram hashes instead of vocabulary entries
+    - idf_ comes from document frequencies counted in a pass over the data
+      (see idf_from_counts); without it only counts are normalized
+    """
+
+    def __init__(self, n_features=2 ** 18, ngram_range=(1, 3), stop_words='english', idf=None):
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.stop_words = stop_words
+        self.idf_ = idf
+        self.hashing = HashingVectorizer(
+            n_features=n_features,
+            ngram_range=self.ngram_range,
+            stop_words=stop_words,
+            alternate_sign=False,
+            norm=None
+        )
+
+    def count(self, texts):
+        """Hashed n-gram counts (sparse, shape (n_texts, n_features))"""
+        return self.hashing.transform(texts)
+
+    def transform(self, texts):
+        """TF-IDF vectors of texts"""
+        X = self.count(texts)
+        if self.idf_ is not None:
+            X.data *= self.idf_[X.indices]
+        return normalize(X, copy=False)
+
+    @staticmethod
+    def idf_from_counts(document_counts, n_documents):
+        """Smoothed IDF from per-column document counts, as TfidfVectorizer computes it"""
+        return np.log((1 + n_documents) / (1 + np.asarray(document_counts, dtype=np.float64))) + 1
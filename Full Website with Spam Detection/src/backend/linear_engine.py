@@ -0,0 +1,177 @@
+"""
+Linear Engine - Fused Inference for the Linear Models
+Scores Naive Bayes, Logistic Regression and the linear SVM with one sparse x dense product
+"""
+
+import numpy as np
+from scipy.special import expit
+
+
+def libsvm_binary_probability(decision, prob_a, prob_b):
+    """
+    Spam probability of a binary SVC from its decision values
+    Mirrors libsvm's svm_predict_probability: Platt sigmoid on the (sign-flipped)
+    decision value, clipped, then the iterative pairwise coupling solver, which
+    libsvm stops early at eps = 0.005 / k. Reproducing the same iterations is what
+    makes the result match SVC.predict_proba to float precision.
+    """
+    # libsvm's decision value has the opposite sign to sklearn's for binary SVC
+    f_apb = -decision * prob_a + prob_b
+    r01 = np.clip(expit(-f_apb), 1e-7, 1 - 1e-7)
+    r10 = 1 - r01
+
+    # Q matrix of the coupling problem for k = 2 classes, per row
+    q = np.array([[r10 * r10, -r10 * r01], [-r10 * r01, r01 * r01]])
+    p = np.full((2, len(decision)), 0.5)
+    active = np.ones(len(decision), dtype=bool)
+
+    for _ in range(100):
+        qp = np.einsum('tjn,jn->tn', q, p)
+        pqp = (p * qp).sum(axis=0)
+        active &= np.abs(qp - pqp).max(axis=0) >= 0.0025
+        if not active.any():
+            break
+
+        for t in range(2):
+            diff = np.where(active, (pqp - qp[t]) / q[t, t], 0.0)
+            p[t] += diff
+            pqp = (pqp + diff * (diff * q[t, t] + 2 * qp[t])) / (1 + diff) / (1 + diff)
+            qp = (qp + diff * q[t]) / (1 + diff)
+            p = p / (1 + diff)
+
+    return p[1]
+
+
+def pack_linear_model(model):
+    """
+    Weight vector, intercept and link function of a linear binary model
+    Returns None for models that can't be expressed this way
+    """
+    # Only needed for sklearn estimators (not when serving from the array format)
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.svm import SVC
+    from sklearn.linear_model import LogisticRegression, SGDClassifier
+
+    if list(getattr(model, 'classes_', [])) != [0, 1]:
+        return None
+
+    if isinstance(model, MultinomialNB):
+        # Log-odds of the two classes: softmax over 2 classes == sigmoid of the difference
+        weights = model.feature_log_prob_[1] - model.feature_log_prob_[0]
+        intercept = model.class_log_prior_[1] - model.class_log_prior_[0]
+        return weights, intercept, 'sigmoid'
+
+    if isinstance(model, LogisticRegression):
+        return model.coef_[0], model.intercept_[0], 'sigmoid'
+
+    if isinstance(model, SGDClassifier):
+        # SGDClassifier.predict_proba: logistic for log loss, clipped linear for modified Huber
+        if model.loss in ('log_loss', 'log'):
+            return np.ravel(model.coef_), model.intercept_[0], 'sigmoid'
+        if model.loss == 'modified_huber':
+            return np.ravel(model.coef_), model.intercept_[0], 'modified_huber'
+        return None
+
+    if isinstance(model, SVC) and model.kernel == 'linear' and model.probability:
+        coef = model.coef_
+        if hasattr(coef, 'toarray'):
+            coef = coef.toarray()
+        return np.ravel(coef), model.intercept_[0], 'platt'
+
+    return None
+
+
+class FusedLinearModels:
+    """
+    All linear ensemble members packed into one dense weight matrix
+    - predict_proba does a single X @ W product, then applies each model's link
+    - Output matches the models' own predict_proba to float precision
+    """
+
+    def __init__(self, names, links, weights, intercepts, platt=None):
+        self.names = list(names)
+        self.links = list(links)
+        self.weights = weights
+        self.intercepts = np.asarray(intercepts, dtype=np.float64)
+        self.platt = dict(platt or {})
+
+    @classmethod
+    def from_models(cls, models):
+        """Pack every linear model of a {name: fitted estimator} dict"""
+        names, links, columns, intercepts, platt = [], [], [], [], {}
+
+        for name, model in models.items():
+            packed = pack_linear_model(model)
+            if packed is None:
+                continue
+
+            weights, intercept, link = packed
+            names.append(name)
+            links.append(link)
+            columns.append(np.asarray(weights, dtype=np.float64))
+            intercepts.append(float(intercept))
+            if link == 'platt':
+                platt[name] = (float(model.probA_[0]), float(model.probB_[0]))
+
+        weights = np.column_stack(columns) if columns else None
+        return cls(names, links, weights, intercepts, platt)
+
+    def with_models(self, models):
+        """
+        Copy with the columns of the given fitted models re-packed
+        Columns of other models are kept; the weights are copied (same dtype),
+        since they may be a read-only memory map shared with other processes
+        """
+        weights = np.array(self.weights)
+        intercepts = self.intercepts.copy()
+
+        for name, model in models.items():
+            i = self.names.index(name)
+            packed_weights, intercept, link = pack_linear_model(model)
+            if link != self.links[i]:
+                raise ValueError(f"Model {name} changed type ({self.links[i]} -> {link})")
+            weights[:, i] = packed_weights
+            intercepts[i] = float(intercept)
+
+        return FusedLinearModels(self.names, self.links, weights, intercepts, self.platt)
+
+    def subset(self, names):
+        """
+        Engine scoring only the named models (None if none of them is packed here)
+        Returns self when every packed model is named, so a memory-mapped weight
+        matrix stays shared
+        """
+        keep = [i for i, name in enumerate(self.names) if name in names]
+        if not keep:
+            return None
+        if len(keep) == len(self.names):
+            return self
+        return FusedLinearModels(
+            [self.names[i] for i in keep], [self.links[i] for i in keep],
+            np.ascontiguousarray(self.weights[:, keep]), self.intercepts[keep],
+            {name: self.platt[name] for name in self.names if name in self.platt and name in names}
+        )
+
+    def astype(self, dtype):
+        """Copy with the weight matrix stored as dtype (e.g. float32 for compact models)"""
+        weights = None if self.weights is None else np.asarray(self.weights, dtype=dtype)
+        return FusedLinearModels(self.names, self.links, weights, self.intercepts, self.platt)
+
+    def predict_proba(self, X):
+        """Spam probability from each packed model: {name: array of shape (n_samples,)}"""
+        if self.weights is None:
+            return {}
+
+        scores = np.asarray(X @ self.weights) + self.intercepts
+
+        probabilities = {}
+        for i, (name, link) in enumerate(zip(self.names, self.links)):
+            if link == 'platt':
+                prob_a, prob_b = self.platt[name]
+                probabilities[name] = libsvm_binary_probability(scores[:, i], prob_a, prob_b)
+            elif link == 'modified_huber':
+                probabilities[name] = (np.clip(scores[:, i], -1, 1) + 1) / 2
+            else:
+                probabilities[name] = expit(scores[:, i])
+
+        return probabilities
@@ -0,0 +1,306 @@
+"""
+Metrics - Low-Overhead Counters and Histograms
+Collects request, stage and model timings and renders them in the Prometheus text format
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# name: (type, help, buckets)
+METRICS = {
+    'spam_requests_total': ('counter', 'HTTP requests by endpoint, method and status', None),
+    'spam_request_errors_total': ('counter', 'HTTP requests that failed with a server error', None),
+    'spam_request_duration_seconds': ('histogram', 'HTTP request latency', LATENCY_BUCKETS),
+    'spam_messages_total': ('counter', 'Messages scored (including cache hits)', None),
+    'spam_input_chars': ('histogram', 'Length of scored messages (subject + content) in characters', SIZE_BUCKETS),
+    'spam_input_truncated_total': ('counter', 'Messages cut to their head and tail windows before scoring', None),
+    'spam_stage_duration_seconds': ('histogram', 'Time spent in each prediction stage, per predict_batch call', LATENCY_BUCKETS),
+    'spam_model_duration_seconds': ('histogram', 'Time spent scoring each model (or fused group of models), per call', LATENCY_BUCKETS),
+    'spam_cascade_rows_total': ('counter', 'Messages scored in cascade mode', None),
+    'spam_cascade_early_exits_total': ('counter', 'Messages answered without the random forest in cascade mode', None),
+    'spam_campaign_hits_total': ('counter', 'Messages answered from the campaign index (near-duplicates of known spam)', None),
+    'spam_microbatch_size': ('histogram', 'Requests scored together per micro-batch', BATCH_BUCKETS),
+    'spam_microbatch_wait_seconds': ('histogram', 'Time a request waited for its micro-batch to be scored', LATENCY_BUCKETS)
+}
+
+# Extra gauges every worker reports the same value for: combined as the largest, not summed
+SHARED_GAUGES = {'spam_model_version', 'spam_models_loaded'}
+
+# Exited workers remembered in the retired totals (see SharedMetrics.retire)
+RETIRED_PIDS_KEPT = 256
+
+
+class Histogram:
+    """Bucketed observations (non-cumulative counts; cumulated when rendered)"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class StageTimer:
+    """
+    Times consecutive steps of one call
+    Each mark records the time since the previous mark (or since the timer was created)
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.metrics.observe('spam_stage_duration_seconds', now - self.last, stage=stage)
+        self.last = now
+
+    def mark_model(self, model):
+        now = time.perf_counter()
+        self.metrics.observe('spam_model_duration_seconds', now - self.last, model=model)
+        self.last = now
+
+
+class NullTimer:
+    """Timer that records nothing (instrumentation off)"""
+
+    def mark(self, stage):
+        pass
+
+    def mark_model(self, model):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Registry of the metrics in METRICS
+    - enabled=False turns every call into a no-op (timer() returns NULL_TIMER)
+    - Series are keyed by metric name and label values
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def timer(self):
+        """Stage timer for one call"""
+        return StageTimer(self) if self.enabled else NULL_TIMER
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+    def observe_many(self, name, values, **labels):
+        """Observe several values under one lock acquisition"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(METRICS[name][2])
+            for value in values:
+                histogram.observe(value)
+
+    def snapshot(self, extra=()):
+        """JSON-serializable copy of all series (and extra values), for merge()"""
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, list(labels), list(h.counts), h.sum, h.count]
+                    for (name, labels), h in self.histograms.items()
+                ],
+                'extra': [list(item) for item in extra]
+            }
+
+    def merge(self, snapshot):
+        """Add the series of a snapshot() to these (extra values are left to combine_extra)"""
+        with self.lock:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, counts, total, count in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(METRICS[name][2])
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+
+    def render(self, extra=()):
+        """
+        Prometheus text exposition of all series
+        - extra: (name, type, help, value) tuples for values owned elsewhere
+          (cache counters, model version, ...)
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self.histograms.items()
+            }
+
+        lines = []
+        for name, (kind, help_text, _) in METRICS.items():
+            series = counters if kind == 'counter' else histograms
+            keys = sorted(key for key in series if key[0] == name)
+            if not keys:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key in keys:
+                labels = key[1]
+                if kind == 'counter':
+                    lines.append(f'{name}{format_labels(labels)} {format_value(series[key])}')
+                    continue
+                counts, total, count, buckets = series[key]
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    le = bound if bound == '+Inf' else format_value(bound)
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+
+        for name, kind, help_text, value in extra:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def combine_extra(extra):
+    """Extra values of several processes: summed, except SHARED_GAUGES (the largest)"""
+    combined = {}
+    for name, kind, help_text, value in extra:
+        if name in combined:
+            previous = combined[name][3]
+            value = max(previous, value) if name in SHARED_GAUGES else previous + value
+        combined[name] = (name, kind, help_text, value)
+    return list(combined.values())
+
+
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class SharedMetrics:
+    """
+    Metrics of all pre-forked workers (serve.py), through a shared directory
+    - Each worker writes its snapshot to <pid>.json (publish)
+    - The parent folds the last snapshot of a worker that exited into
+      retired.json (retire), so the combined counters never go down when
+      workers are replaced
+    - combined() sums every snapshot: what /api/metrics renders
+    """
+
+    RETIRED = 'retired.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def publish(self, metrics, extra=()):
+        """Worker: write this process's series and extra values"""
+        write_json(self.path(os.getpid()), metrics.snapshot(extra))
+
+    def retire(self, pid):
+        """Parent: fold the snapshot of an exited worker into the retired totals"""
+        snapshot = read_json(self.path(pid))
+        if snapshot is None:
+            return
+        retired_path = os.path.join(self.directory, self.RETIRED)
+        retired = read_json(retired_path) or {'counters': [], 'histograms': [], 'extra': [], 'pids': []}
+        totals = Metrics()
+        totals.merge(retired)
+        totals.merge(snapshot)
+        # An exited worker's gauges (cache entries, queue depth) no longer apply
+        counters = [item for item in snapshot['extra'] if item[1] == 'counter']
+        extra = combine_extra(retired['extra'] + counters)
+        pids = (retired['pids'] + [pid])[-RETIRED_PIDS_KEPT:]
+        # Written before the worker's file is removed; readers skip the files of retired pids
+        write_json(retired_path, dict(totals.snapshot(extra), pids=pids))
+        os.remove(self.path(pid))
+
+    def combined(self):
+        """Metrics and extra values of every worker, running or exited, summed"""
+        snapshots = {}
+        for name in os.listdir(self.directory):
+            pid, ext = os.path.splitext(name)
+            if ext == '.json' and pid.isdigit():
+                snapshot = read_json(os.path.join(self.directory, name))
+                if snapshot is not None:
+                    snapshots[int(pid)] = snapshot
+        # Read after the workers' files: a worker retired meanwhile is then counted once
+        retired = read_json(os.path.join(self.directory, self.RETIRED))
+        if retired is not None:
+            for pid in retired['pids']:
+                snapshots.pop(pid, None)
+            snapshots['retired'] = retired
+
+        totals = Metrics()
+        extra = []
+        for snapshot in snapshots.values():
+            totals.merge(snapshot)
+            extra.extend(snapshot['extra'])
+        return totals, combine_extra(extra)
@@ -0,0 +1,137 @@
+"""
+Micro-Batching - Score Concurrent Predict Requests Together
+Requests that arrive within a few milliseconds of each other are grouped and
+scored with one SpamDetector.predict_batch call (one sparse matrix, one
+product per model) instead of one 1-row call each
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Groups concurrent predictions into batches
+    - A batch closes window seconds after its first request arrived, or when
+      it holds max_batch_size requests
+    - Requests coming one at a time (the previous batch had one request and
+      none is waiting) are scored right away, so low load pays no window
+    - One background thread scores the batches; each caller waits on a Future
+    - The thread starts with the first request (serve.py forks workers from a
+      parent that must not have threads)
+    """
+
+    def __init__(self, detector, window=0.002, max_batch_size=32, metrics=None):
+        self.detector = detector
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.metrics = metrics or detector.metrics
+
+        self.queue = queue.Queue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.last_batch_size = 1
+
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.max_queue_depth = 0
+
+    def submit(self, message):
+        """Queue one message ({'subject', 'content'}); returns a Future of its predict_all result"""
+        if self.thread is None or not self.thread.is_alive():
+            with self.start_lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, daemon=True)
+                    self.thread.start()
+
+        future = Future()
+        self.queue.put((message, future, time.perf_counter()))
+        return future
+
+    def predict(self, subject, content, timeout=None):
+        """predict_all through the batcher"""
+        return self.submit({'subject': subject, 'content': content}).result(timeout)
+
+    def run(self):
+        """Scoring thread: take a batch, score it, hand out the results"""
+        while True:
+            batch = [self.queue.get()]
+            self.collect(batch)
+            self.dispatch(batch)
+
+    def collect(self, batch):
+        """Add waiting requests to batch, waiting up to the window of its first request"""
+        depth = self.queue.qsize() + 1
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if len(batch) == 1 and self.last_batch_size == 1:
+            return
+
+        deadline = batch[0][2] + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+    def dispatch(self, batch):
+        """
+        Score a batch and resolve its futures
+        If the batch fails, its requests are scored one by one, so an error
+        only reaches the request that causes it
+        """
+        now = time.perf_counter()
+        self.last_batch_size = len(batch)
+        self.requests += len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        if self.metrics.enabled:
+            self.metrics.observe('spam_microbatch_size', len(batch))
+            self.metrics.observe_many('spam_microbatch_wait_seconds', [now - queued for _, _, queued in batch])
+
+        try:
+            results = self.detector.predict_batch([message for message, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Score each request on its own: only the one that fails gets the error
+            for message, future, _ in batch:
+                try:
+                    future.set_result(self.detector.predict_batch([message])[0])
+                except Exception as error:
+                    future.set_exception(error)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def queue_depth(self):
+        """Requests waiting for a batch"""
+        return self.queue.qsize()
+
+    def stats(self):
+        """Batching counters for /api/stats"""
+        return {
+            'enabled': True,
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_batch_size,
+            'requests': self.requests,
+            'batches': self.batches,
+            'avg_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+            'queue_depth': self.queue_depth(),
+            'max_queue_depth': self.max_queue_depth
+        }
@@ -0,0 +1,130 @@
+"""
+Model Costs - Serving Cost of Each Ensemble Member
+train_models times every model on the test split, alone (one message at a
+time, and the whole split as one batch), and records how much memory its
+serving engine takes and how large its pickle is. Every combination of the
+models is timed and scored as well, so that with a per-request latency
+budget the server can run the most accurate combination that fits, the
+ensemble weights renormalized over it.
+"""
+
+import itertools
+import pickle
+import time
+import numpy as np
+
+# Test rows scored one message at a time (the median call time is kept)
+SINGLE_ROWS = 200
+
+# Runs over the whole test split as one batch (the fastest is kept)
+BATCH_REPEATS = 3
+
+
+def single_latency(call, rows):
+    """Median and 95th percentile time (ms) of call on each of rows, one at a time"""
+    call(rows[0])  # first call pays one-time set-up
+    times = []
+    for row in rows:
+        start = time.perf_counter()
+        call(row)
+        times.append((time.perf_counter() - start) * 1000)
+    return round(float(np.median(times)), 4), round(float(np.percentile(times, 95)), 4)
+
+
+def batch_latency(call, batch, n_rows):
+    """Fastest time (ms) of call on the whole batch, and the time per message (µs)"""
+    best = min(timed(call, batch) for _ in range(BATCH_REPEATS))
+    return round(best, 3), round(best * 1000 / max(n_rows, 1), 3)
+
+
+def timed(call, argument):
+    start = time.perf_counter()
+    call(argument)
+    return (time.perf_counter() - start) * 1000
+
+
+def latency_report(call, rows, batch, n_rows):
+    """Single-message and batch latency of call (see single_latency and batch_latency)"""
+    single_ms, single_p95_ms = single_latency(call, rows)
+    batch_ms, batch_us = batch_latency(call, batch, n_rows)
+    return {
+        'single_ms': single_ms,
+        'single_p95_ms': single_p95_ms,
+        'batch_ms': batch_ms,
+        'batch_per_message_us': batch_us
+    }
+
+
+def pickled_bytes(model):
+    """Serialized size of a fitted estimator (its .pkl file), None when there is none in memory"""
+    if model is None:
+        return None
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def renormalize(weights, names):
+    """Ensemble weights of names only, scaled to sum to 1 (equal weights if they are all 0)"""
+    total = sum(weights.get(name, 0.0) for name in names)
+    if total <= 0:
+        return {name: 1.0 / len(names) for name in names}
+    return {name: weights.get(name, 0.0) / total for name in names}
+
+
+def subset_quality(probabilities, y, weights, threshold, names):
+    """Test accuracy and F1 of the ensemble of names, weights renormalized"""
+    y = np.asarray(y)
+    subset_weights = renormalize(weights, names)
+    verdict = sum(probabilities[name] * weight for name, weight in subset_weights.items()) >= threshold
+    tp = int((verdict & (y == 1)).sum())
+    precision = tp / max(int(verdict.sum()), 1)
+    recall = tp / max(int((y == 1).sum()), 1)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return round(float((verdict == (y == 1)).mean()), 4), round(f1, 4)
+
+
+def measure_subsets(make_predict, names, rows, probabilities, y, weights, threshold, shared_ms):
+    """
+    Every non-empty combination of names, most accurate first
+    - make_predict(names): callable scoring rows with only those models, as serving would
+    - single_ms: measured single-message time of the models; estimated_ms adds
+      shared_ms (cleaning, vectorizing, patterns), the part every request pays
+    """
+    subsets = []
+    for size in range(1, len(names) + 1):
+        for combination in itertools.combinations(names, size):
+            single_ms, _ = single_latency(make_predict(combination), rows)
+            accuracy, f1 = subset_quality(probabilities, y, weights, threshold, combination)
+            subsets.append({
+                'models': list(combination),
+                'single_ms': single_ms,
+                'estimated_ms': round(shared_ms + single_ms, 4),
+                'accuracy': accuracy,
+                'f1_score': f1
+            })
+    subsets.sort(key=lambda s: (-s['accuracy'], -s['f1_score'], s['estimated_ms']))
+    return subsets
+
+
+def choose_subset(costs, budget_ms):
+    """
+    Most accurate measured combination whose estimated single-message latency
+    fits budget_ms (ties: better F1, then faster); the fastest one if none fits
+    Returns the subset entry of costs['subsets'] with 'fits' added
+    """
+    subsets = costs['subsets']
+    fitting = [s for s in subsets if s['estimated_ms'] <= budget_ms]
+    if fitting:
+        return dict(fitting[0], fits=True)
+    return dict(min(subsets, key=lambda s: s['estimated_ms']), fits=False)
+
+
+def print_costs(costs):
+    """Table of the per-model costs measured by train_models"""
+    shared = costs['shared']
+    print(f"\nServing costs ({costs['rows']} test messages, single = median of {costs['single_rows']}):")
+    print(f"  {'':22}{'single':>10}{'batch/msg':>12}{'memory':>11}{'pickle':>11}")
+    print(f"  {'shared stages':22}{shared['single_ms']:>8.3f}ms{shared['batch_per_message_us']:>10.1f}µs")
+    for name, cost in costs['models'].items():
+        pickle_kb = f"{cost['pickle_bytes'] / 1024:.0f} KB" if cost['pickle_bytes'] is not None else '-'
+        print(f"  {name.replace('_', ' ').title():22}{cost['single_ms']:>8.3f}ms"
+              f"{cost['batch_per_message_us']:>10.1f}µs{cost['memory_bytes'] / 1024:>8.0f} KB{pickle_kb:>11}")
@@ -0,0 +1,290 @@
+"""
+Model Registry - Versioned Model Sets with an Active Pointer
+Each training run is saved as its own version under models/registry/<version>
+(the usual pickles, arrays and campaign index) with a version.json manifest:
+training stats, the SHA-256 of the dataset and a timestamp. active.json
+names the version that is served and remembers the ones active before it,
+so a bad version can be rolled back. Model directories saved before the
+registry existed keep working: without an active version the models are
+loaded from models/ itself.
+
+Usage:
+    python model_registry.py list [--models-dir models]
+    python model_registry.py show VERSION
+    python model_registry.py activate VERSION
+    python model_registry.py rollback
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from model_store import write_atomic
+
+REGISTRY_SUBDIR = 'registry'
+ACTIVE_FILE = 'active.json'
+VERSION_FILE = 'version.json'
+VERSION_PATTERN = re.compile(r'^v(\d+)$')
+
+# Subdirectories of a models directory that aren't part of a model set
+NOT_MODELS = {REGISTRY_SUBDIR, 'feedback'}
+
+# Previously active versions remembered for rollback
+MAX_HISTORY = 20
+
+# Feedback checkpoint versions kept (older ones are removed, unless active)
+MAX_FEEDBACK_VERSIONS = 10
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hex SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_json(path, data):
+    encoded = json.dumps(data, indent=2).encode('utf-8')
+    write_atomic(path, lambda f: f.write(encoded))
+
+
+def active_models_dir(models_dir):
+    """Directory of the active registry version of models_dir, or models_dir itself if there is none"""
+    registry = ModelRegistry(models_dir)
+    version = registry.active()
+    return registry.path(version) if version is not None else models_dir
+
+
+def copy_model_files(source, destination):
+    """
+    Copy the model files and directories of source (pickles, arrays, campaign
+    index) that destination doesn't have; returns the names copied
+    """
+    copied = []
+    for name in sorted(os.listdir(source)):
+        target = os.path.join(destination, name)
+        if name in NOT_MODELS or name == VERSION_FILE or os.path.exists(target):
+            continue
+        path = os.path.join(source, name)
+        if os.path.isdir(path):
+            shutil.copytree(path, target)
+        else:
+            shutil.copy2(path, target)
+        copied.append(name)
+    return copied
+
+
+class ModelRegistry:
+    """
+    Versions of the models saved under models_dir/registry
+    - create() reserves a new version directory; commit() writes its manifest
+      once the models are saved (a version without a manifest is ignored)
+    - activate() moves the active pointer; rollback() returns to the version
+      active before the current one
+    """
+
+    # Serializes pointer updates within a process
+    lock = threading.Lock()
+
+    def __init__(self, models_dir):
+        self.models_dir = models_dir
+        self.root = os.path.join(models_dir, REGISTRY_SUBDIR)
+
+    def path(self, version):
+        return os.path.join(self.root, version)
+
+    def create(self):
+        """Reserve the next version: (version, directory to save the models in)"""
+        os.makedirs(self.root, exist_ok=True)
+        while True:
+            numbers = [int(m.group(1)) for m in map(VERSION_PATTERN.match, os.listdir(self.root)) if m]
+            version = f'v{max(numbers, default=0) + 1:04d}'
+            try:
+                os.makedirs(self.path(version))
+                return version, self.path(version)
+            except FileExistsError:
+                continue  # taken by a concurrent training run
+
+    def commit(self, version, training_stats, dataset_path=None, source='train', parent=None):
+        """
+        Write the manifest of a version whose models are saved; returns the manifest
+        parent: version the models were derived from (default: the active one)
+        """
+        manifest = {
+            'version': version,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'timestamp': time.time(),
+            'source': source,
+            'parent': parent or self.active(),
+            'dataset': None,
+            'training_stats': training_stats
+        }
+        if dataset_path is not None:
+            manifest['dataset'] = {
+                'path': os.path.abspath(dataset_path),
+                'sha256': file_sha256(dataset_path),
+                'bytes': os.path.getsize(dataset_path)
+            }
+        write_json(os.path.join(self.path(version), VERSION_FILE), manifest)
+        return manifest
+
+    def get(self, version):
+        """Manifest of a version (ValueError if there is no such complete version)"""
+        path = os.path.join(self.path(version), VERSION_FILE)
+        if not VERSION_PATTERN.match(version) or not os.path.exists(path):
+            raise ValueError(f"Unknown model version: {version}")
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def versions(self):
+        """Manifests of all complete versions, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        names = sorted((n for n in os.listdir(self.root) if VERSION_PATTERN.match(n)),
+                       key=lambda n: int(n[1:]))
+        return [self.get(name) for name in names if os.path.exists(os.path.join(self.path(name), VERSION_FILE))]
+
+    def pointer(self):
+        path = os.path.join(self.root, ACTIVE_FILE)
+        if not os.path.exists(path):
+            return {'active': None, 'history': [], 'updated': None}
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def active(self):
+        """Version being served, or None (models/ itself is served)"""
+        return self.pointer()['active']
+
+    def activate(self, version):
+        """Make a version the active one; the current one is remembered for rollback"""
+        self.get(version)
+        with self.lock:
+            pointer = self.pointer()
+            if pointer['active'] == version:
+                return pointer
+            history = pointer['history'] + ([pointer['active']] if pointer['active'] else [])
+            pointer = {'active': version, 'history': history[-MAX_HISTORY:], 'updated': time.time()}
+            write_json(os.path.join(self.root, ACTIVE_FILE), pointer)
+            return pointer
+
+    def previous(self):
+        """Version rollback() would return to: (version, history left before it)"""
+        history = list(self.pointer()['history'])
+        while history:
+            version = history.pop()
+            if os.path.exists(os.path.join(self.path(version), VERSION_FILE)):
+                return version, history
+        raise ValueError("No earlier version to roll back to")
+
+    def rollback(self):
+        """Return to the version active before the current one; returns the new pointer"""
+        with self.lock:
+            version, history = self.previous()
+            pointer = {'active': version, 'history': history, 'updated': time.time()}
+            write_json(os.path.join(self.root, ACTIVE_FILE), pointer)
+            return pointer
+
+    def import_legacy(self):
+        """
+        Register models saved directly in models_dir (before the registry) as a
+        version, so they stay available for rollback; returns it, or None if
+        the registry already has versions or there are no such models
+        """
+        if self.versions() or not os.path.exists(os.path.join(self.models_dir, 'vectorizer.pkl')):
+            return None
+        version, path = self.create()
+        copy_model_files(self.models_dir, path)
+
+        stats_path = os.path.join(path, 'training_stats.pkl')
+        training_stats = {}
+        if os.path.exists(stats_path):
+            with open(stats_path, 'rb') as f:
+                training_stats = pickle.load(f)
+        self.commit(version, training_stats, source='legacy')
+        self.activate(version)
+        return version
+
+    def prune(self, source='feedback', keep=MAX_FEEDBACK_VERSIONS):
+        """
+        Remove all but the newest keep versions of a source (the active version
+        stays); returns the versions removed
+        """
+        active = self.active()
+        versions = [m['version'] for m in self.versions() if m['source'] == source]
+        removed = [version for version in versions[:max(len(versions) - keep, 0)] if version != active]
+        for version in removed:
+            # Without its manifest the version is incomplete (ignored) before its files go
+            os.remove(os.path.join(self.path(version), VERSION_FILE))
+            shutil.rmtree(self.path(version), ignore_errors=True)
+        if removed:
+            with self.lock:
+                pointer = self.pointer()
+                pointer['history'] = [version for version in pointer['history'] if version not in removed]
+                write_json(os.path.join(self.root, ACTIVE_FILE), pointer)
+        return removed
+
+    def summary(self):
+        """Registry state for /api/stats"""
+        pointer = self.pointer()
+        return {
+            'active': pointer['active'],
+            'history': pointer['history'],
+            'versions': [m['version'] for m in self.versions()]
+        }
+
+
+def describe(manifest, active):
+    """One line per version for the list command"""
+    results = manifest['training_stats'].get('results', {})
+    accuracy = f"{max(r['test_accuracy'] for r in results.values()) * 100:.2f}%" if results else '-'
+    dataset = manifest['dataset']['sha256'][:12] if manifest['dataset'] else '-'
+    marker = '*' if manifest['version'] == active else ' '
+    return (f" {marker} {manifest['version']}  {manifest['created']}  {manifest['source']:8} "
+            f"dataset {dataset}  best accuracy {accuracy}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List, activate and roll back versions of the trained models')
+    parser.add_argument('command', choices=['list', 'show', 'activate', 'rollback'])
+    parser.add_argument('version', nargs='?', help='version for show / activate (e.g. v0003)')
+    parser.add_argument('--models-dir', default='models', help='models directory holding the registry')
+    args = parser.parse_args()
+    if args.command in ('show', 'activate') and args.version is None:
+        parser.error(f'{args.command} needs a VERSION')
+
+    registry = ModelRegistry(args.models_dir)
+    try:
+        if args.command == 'list':
+            active = registry.active()
+            versions = registry.versions()
+            if not versions:
+                print(f"No registered versions in {registry.root}")
+            for manifest in versions:
+                print(describe(manifest, active))
+        elif args.command == 'show':
+            print(json.dumps(registry.get(args.version), indent=2))
+        elif args.command == 'activate':
+            registry.activate(args.version)
+            print(f"✓ Active version: {args.version}")
+        else:
+            pointer = registry.rollback()
+            print(f"✓ Rolled back to {pointer['active']}")
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    if args.command in ('activate', 'rollback'):
+        print("serve.py picks the change up automatically; app.py: restart it or use /api/models/activate")
+
+
+if __name__ == '__main__':
+    main()
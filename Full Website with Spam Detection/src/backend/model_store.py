@@ -0,0 +1,189 @@
+"""
+Model Store - Pickle-Free Model Artifacts
+Saves the serving models as memory-mappable .npy arrays plus a JSON manifest
+"""
+
+import json
+import os
+from datetime import datetime
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from linear_engine import FusedLinearModels
+from hashed_vectorizer import HashingTfidfVectorizer
+from packed_forest import PackedForest
+from text_features import TextFeatures, FEATURE_NAMES
+
+FORMAT_NAME = 'spam-detector-arrays'
+FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+# TfidfVectorizer settings needed to rebuild the fitted vectorizer
+VECTORIZER_PARAMS = [
+    'analyzer', 'lowercase', 'token_pattern', 'ngram_range', 'stop_words',
+    'strip_accents', 'norm', 'use_idf', 'smooth_idf', 'sublinear_tf', 'binary',
+    'max_df', 'min_df', 'max_features'
+]
+
+
+def is_array_store(path):
+    """True if path holds models in the array format"""
+    return os.path.exists(os.path.join(path, MANIFEST_FILE))
+
+
+def write_atomic(path, write):
+    """
+    Write a file through a temporary name and rename it into place
+    Processes that still have the old file memory-mapped keep reading the old
+    inode instead of seeing a truncated file.
+    """
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save_arrays(path, vectorizer, linear_models, packed_forest, training_stats, ensemble_weights,
+                decision_threshold=0.5, text_features=None, compact=False):
+    """
+    Save the serving models to path as .npy files and a JSON manifest
+    - compact: models pruned by compact_models.py; the IDF weights are stored
+      as float32 (weights and forest arrays are saved in their own dtype)
+    """
+    os.makedirs(path, exist_ok=True)
+    idf_dtype = np.float32 if compact else np.float64
+
+    if isinstance(vectorizer, HashingTfidfVectorizer):
+        # Hashed features: no vocabulary, only the hashing settings and IDF weights
+        arrays = {}
+        vectorizer_info = {
+            'type': 'hashing',
+            'params': {
+                'n_features': vectorizer.n_features,
+                'ngram_range': list(vectorizer.ngram_range),
+                'stop_words': vectorizer.stop_words
+            }
+        }
+        if vectorizer.idf_ is not None:
+            arrays['idf'] = np.asarray(vectorizer.idf_, dtype=idf_dtype)
+    else:
+        params = vectorizer.get_params()
+        if params['tokenizer'] is not None or params['preprocessor'] is not None:
+            raise ValueError("Vectorizers with custom tokenizer/preprocessor can't be saved without pickle")
+
+        # Vocabulary ordered by column index
+        terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+        arrays = {
+            'vocabulary': np.array(terms, dtype=str),
+            'idf': np.asarray(vectorizer.idf_, dtype=idf_dtype)
+        }
+        vectorizer_info = {
+            'type': 'tfidf',
+            'params': {name: params[name] for name in VECTORIZER_PARAMS},
+            'dtype': np.dtype(params['dtype']).name
+        }
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'vectorizer': vectorizer_info,
+        'ensemble_weights': ensemble_weights,
+        'decision_threshold': decision_threshold,
+        'compact': compact,
+        'training_stats': training_stats,
+        'arrays': []
+    }
+
+    if linear_models is not None and linear_models.weights is not None:
+        arrays['linear_weights'] = linear_models.weights
+        arrays['linear_intercepts'] = linear_models.intercepts
+        manifest['linear_models'] = {
+            'names': linear_models.names,
+            'links': linear_models.links,
+            'platt': {name: list(ab) for name, ab in linear_models.platt.items()}
+        }
+
+    if text_features is not None:
+        arrays['text_feature_scale'] = text_features.scale_
+        manifest['text_features'] = {'names': list(FEATURE_NAMES)}
+
+    if packed_forest is not None:
+        for name in ['feature', 'threshold', 'left', 'right', 'value', 'roots']:
+            arrays[f'forest_{name}'] = getattr(packed_forest, name)
+        manifest['random_forest'] = {'n_features': int(packed_forest.n_features)}
+
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        write_atomic(os.path.join(path, f'{name}.npy'), lambda f: np.save(f, array, allow_pickle=False))
+        manifest['arrays'].append(name)
+
+    # Manifest goes last, so a reader never sees it before the arrays it lists
+    data = json.dumps(manifest, indent=2).encode('utf-8')
+    write_atomic(os.path.join(path, MANIFEST_FILE), lambda f: f.write(data))
+
+
+def load_arrays(path, mmap=True):
+    """
+    Load models saved by save_arrays
+    Arrays are memory-mapped read-only by default, so processes loading the
+    same files share their pages through the OS page cache.
+    """
+    with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if manifest.get('format') != FORMAT_NAME:
+        raise ValueError(f"Not a spam detector model store: {path}")
+    if manifest.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model store version {manifest.get('version')} (expected {FORMAT_VERSION})")
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+        for name in manifest['arrays']
+    }
+
+    # Rebuild the fitted vectorizer from its settings (and vocabulary) and IDF weights
+    info = manifest['vectorizer']
+    params = dict(info['params'])
+    params['ngram_range'] = tuple(params['ngram_range'])
+    if info.get('type', 'tfidf') == 'hashing':
+        vectorizer = HashingTfidfVectorizer(idf=arrays.get('idf'), **params)
+    else:
+        vectorizer = TfidfVectorizer(dtype=np.dtype(info['dtype']).type, **params)
+        vectorizer.vocabulary_ = {term: i for i, term in enumerate(arrays['vocabulary'].tolist())}
+        vectorizer.idf_ = arrays['idf']
+
+    linear_models = None
+    if 'linear_models' in manifest:
+        info = manifest['linear_models']
+        linear_models = FusedLinearModels(
+            info['names'], info['links'],
+            arrays['linear_weights'], arrays['linear_intercepts'],
+            {name: tuple(ab) for name, ab in info['platt'].items()}
+        )
+
+    text_features = None
+    if 'text_features' in manifest:
+        if manifest['text_features']['names'] != FEATURE_NAMES:
+            raise ValueError(f"Model store has different text features: {manifest['text_features']['names']}")
+        text_features = TextFeatures(arrays['text_feature_scale'])
+
+    packed_forest = None
+    if 'random_forest' in manifest:
+        packed_forest = PackedForest(
+            arrays['forest_feature'], arrays['forest_threshold'],
+            arrays['forest_left'], arrays['forest_right'],
+            arrays['forest_value'], arrays['forest_roots'],
+            n_features=manifest['random_forest']['n_features']
+        )
+
+    return {
+        'manifest': manifest,
+        'vectorizer': vectorizer,
+        'text_features': text_features,
+        'linear_models': linear_models,
+        'packed_forest': packed_forest,
+        'training_stats': manifest.get('training_stats', {}),
+        'ensemble_weights': manifest.get('ensemble_weights'),
+        'decision_threshold': manifest.get('decision_threshold', 0.5)
+    }
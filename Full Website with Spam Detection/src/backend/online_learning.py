@@ -0,0 +1,335 @@
+"""
+Online Learning - Incremental Model Updates from User Feedback
+Labeled messages are logged to disk, applied to the live models in mini-batches
+and checkpointed so the updates survive a restart
+"""
+
+import json
+import os
+import pickle
+import threading
+import time
+import numpy as np
+from scipy.special import expit
+from linear_engine import pack_linear_model
+from spam_detector import MODELS_DIR
+from model_registry import ModelRegistry, MAX_FEEDBACK_VERSIONS
+
+FEEDBACK_SUBDIR = 'feedback'
+LOG_FILE = 'feedback.jsonl'
+CHECKPOINT_FILE = 'checkpoint.json'
+LABELS = {'ham': 0, 'spam': 1}
+
+
+def logistic_step(model, X, y, learning_rate=0.5, n_steps=5):
+    """
+    Fine-tune a fitted LogisticRegression on a mini-batch with gradient steps
+    on the log loss (LogisticRegression itself has no partial_fit)
+    """
+    y = np.asarray(y, dtype=np.float64)
+    for _ in range(n_steps):
+        error = expit(np.asarray(X @ model.coef_[0]).ravel() + model.intercept_[0]) - y
+        model.coef_[0] -= learning_rate * np.asarray(X.T @ error).ravel() / len(y)
+        model.intercept_[0] -= learning_rate * error.mean()
+
+
+def can_update(model):
+    """True if a model can learn from a mini-batch without a full retrain"""
+    from sklearn.linear_model import LogisticRegression
+    return hasattr(model, 'partial_fit') or isinstance(model, LogisticRegression)
+
+
+class FeedbackLog:
+    """
+    Append-only JSON-lines log of labeled messages
+    Several processes may append at once (serve.py workers): each append is a
+    single O_APPEND write, and readers skip a last line that isn't complete yet
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def append(self, records):
+        data = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def read(self, start=0):
+        """Records from position start on"""
+        if not os.path.exists(self.path):
+            return []
+        with self.lock:
+            with open(self.path, encoding='utf-8') as f:
+                return [
+                    json.loads(line) for i, line in enumerate(f)
+                    if i >= start and line.endswith('\n') and line.strip()
+                ]
+
+    def __len__(self):
+        if not os.path.exists(self.path):
+            return 0
+        with self.lock:
+            with open(self.path, encoding='utf-8') as f:
+                return sum(1 for line in f if line.endswith('\n') and line.strip())
+
+
+class OnlineLearner:
+    """
+    Applies user feedback to the live models
+    - submit() logs labeled messages and buffers them
+    - A background thread applies the buffer every flush_interval seconds (or as
+      soon as batch_size messages are waiting): models with partial_fit are
+      updated in place, Logistic Regression gets a few gradient steps; SVC and
+      the random forest can't learn incrementally and stay as they are
+    - Messages are vectorized with the existing vocabulary; updated models are
+      re-packed into the fused linear engine and published as a new model version
+    - Every checkpoint_interval seconds updated models are saved as a new
+      registry version of models_dir (source 'feedback', its parent the
+      version they were loaded from, the files of models that didn't change
+      copied from it) and activated; only the newest MAX_FEEDBACK_VERSIONS
+      checkpoints are kept. Feedback logged after the last checkpoint is
+      replayed on start-up
+    - apply_updates=False only logs feedback; another process picks it up
+      with follow() (serve.py: workers log, the parent applies)
+    """
+
+    def __init__(self, detector, models_dir=MODELS_DIR, batch_size=32, flush_interval=2.0,
+                 checkpoint_interval=300.0, apply_updates=True):
+        self.detector = detector
+        self.models_dir = models_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.apply_updates = apply_updates
+
+        feedback_dir = os.path.join(models_dir, FEEDBACK_SUBDIR)
+        self.log = FeedbackLog(os.path.join(feedback_dir, LOG_FILE))
+        self.checkpoint_path = os.path.join(feedback_dir, CHECKPOINT_FILE)
+
+        self.pending = []
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+        # Estimators being updated, for the model version they belong to
+        self.estimators = {}
+        self.estimators_version = None
+
+        self.received = 0
+        self.applied = 0
+        self.batches = 0
+        self.checkpoints = 0
+        self.last_update = None
+        self.last_checkpoint = None
+        self.last_error = None
+        self.dirty = False
+        self.checkpoint_due = time.monotonic() + checkpoint_interval
+
+        # Log position covered by the saved models
+        self.checkpointed = self.read_checkpoint()
+        self.logged = len(self.log)
+
+    def read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            return json.load(f).get('applied', 0)
+
+    def start(self):
+        """Replay feedback logged since the last checkpoint and start the update thread"""
+        if self.thread is not None:
+            return
+        self.replay()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def replay(self):
+        """Buffer the feedback logged since the last checkpoint"""
+        replay = self.log.read(self.checkpointed)
+        if replay:
+            print(f"Replaying {len(replay)} feedback messages since the last checkpoint")
+            with self.lock:
+                self.pending.extend(replay)
+
+    def follow(self):
+        """
+        Buffer feedback that other processes appended to the log
+        Returns the number of new messages
+        """
+        with self.lock:
+            records = self.log.read(self.logged)
+            self.logged += len(records)
+            self.received += len(records)
+            self.pending.extend(records)
+        return len(records)
+
+    def submit(self, messages):
+        """
+        Log and buffer labeled messages: dicts with subject, content and label ('spam'/'ham')
+        Returns the number of messages waiting to be applied
+        """
+        records = [{
+            'subject': m.get('subject', ''),
+            'content': m.get('content', ''),
+            'label': LABELS[m['label']],
+            'time': time.time()
+        } for m in messages]
+
+        with self.lock:
+            self.log.append(records)
+            self.logged += len(records)
+            self.received += len(records)
+            if not self.apply_updates:
+                return 0
+            self.pending.extend(records)
+            waiting = len(self.pending)
+
+        if waiting >= self.batch_size:
+            self.wakeup.set()
+        return waiting
+
+    def run(self):
+        """Update thread: apply buffered feedback, checkpoint now and then"""
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.step()
+
+    def step(self):
+        """Apply buffered feedback, then checkpoint if one is due"""
+        try:
+            self.flush()
+            if self.dirty and time.monotonic() >= self.checkpoint_due:
+                self.checkpoint()
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"✗ Feedback update failed: {e}")
+
+    def flush(self):
+        """Apply everything in the buffer, batch_size messages at a time"""
+        while True:
+            with self.lock:
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+            if not batch or not self.apply(batch):
+                return
+
+    def updatable_models(self, model_set):
+        """
+        Estimators of the live models that can be updated incrementally
+        Arrays-loaded detectors serve without sklearn objects, so these come
+        from the pickles saved next to the arrays, checked against the live weights
+        """
+        if self.estimators_version == model_set.version:
+            return self.estimators
+
+        estimators = {}
+        linear = model_set.linear_models
+        for i, name in enumerate(linear.names if linear is not None else []):
+            model = model_set.models.get(name)
+            path = os.path.join(self.detector.models_path or self.models_dir, f'{name}.pkl')
+            if model is None and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    model = pickle.load(f)
+            if model is None or not can_update(model):
+                continue
+
+            weights, intercept, _ = pack_linear_model(model)
+            if not (np.allclose(weights, linear.weights[:, i]) and np.isclose(intercept, linear.intercepts[i])):
+                print(f"✗ Saved {name} doesn't match the live model; not updating it")
+                continue
+            estimators[name] = model
+
+        self.estimators = estimators
+        self.estimators_version = model_set.version
+        return estimators
+
+    def apply(self, batch):
+        """
+        Update the live models with one mini-batch of feedback
+        Returns False if there are no live models yet (the batch stays buffered)
+        """
+        with self.update_lock:
+            model_set = self.detector.model_set
+            if model_set is None:
+                with self.lock:
+                    self.pending[:0] = batch
+                return False
+
+            estimators = self.updatable_models(model_set)
+            if estimators:
+                texts, _ = self.detector.prepare_messages(batch)
+                X = model_set.vectorize(texts, [self.detector.preprocess_text(text) for text in texts])
+                y = np.array([m['label'] for m in batch])
+
+                for model in estimators.values():
+                    if hasattr(model, 'partial_fit'):
+                        model.partial_fit(X, y)
+                    else:
+                        logistic_step(model, X, y)
+
+                # Swap in the updated weights as a new model version
+                detector = self.detector
+                with detector.swap_lock:
+                    if detector.model_set is not model_set:
+                        # Models were replaced meanwhile (e.g. retrained): apply the batch to those
+                        self.estimators_version = None
+                        with self.lock:
+                            self.pending[:0] = batch
+                        return True
+                    detector.linear_models = model_set.linear_models.with_models(estimators)
+                    detector.models = dict(model_set.models, **estimators)
+                    detector.publish_models()
+                    self.estimators_version = detector.model_version
+                self.dirty = True
+
+            self.applied += len(batch)
+            self.batches += 1
+            self.last_update = time.time()
+            return True
+
+    def checkpoint(self):
+        """Save the updated models as the new active version, so they are used after a restart"""
+        with self.update_lock:
+            with self.lock:
+                covered = self.logged - len(self.pending)
+            with self.detector.swap_lock:
+                self.detector.register_models(self.models_dir, None, source='feedback',
+                                              base_dir=self.detector.models_path or self.models_dir)
+            removed = ModelRegistry(self.models_dir).prune('feedback', MAX_FEEDBACK_VERSIONS)
+            if removed:
+                print(f"  ✓ Removed old feedback checkpoints: {', '.join(removed)}")
+            data = json.dumps({'applied': covered, 'time': time.time()})
+            tmp_path = f'{self.checkpoint_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.checkpoint_path)
+            self.checkpointed = covered
+            self.checkpoints += 1
+            self.last_checkpoint = time.time()
+            self.checkpoint_due = time.monotonic() + self.checkpoint_interval
+            self.dirty = False
+
+    def stats(self):
+        """Feedback counters for /api/stats"""
+        with self.lock:
+            pending = len(self.pending)
+        return {
+            'received': self.received,
+            'applied': self.applied,
+            'pending': pending,
+            'batches': self.batches,
+            'updated_models': sorted(self.estimators),
+            'checkpoints': self.checkpoints,
+            'last_update': self.last_update,
+            'last_checkpoint': self.last_checkpoint,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,203 @@
+"""
+Packed Forest - Array-Based Random Forest Evaluator
+Flattens every tree of a trained RandomForestClassifier into shared NumPy arrays
+"""
+
+import pickle
+import numpy as np
+import scipy.sparse as sp
+from feature_subset import FeatureSubsetClassifier
+
+
+def float_array(a):
+    """a as float32 if it already is, else float64 (memory-mapped arrays aren't copied)"""
+    a = np.asarray(a)
+    return a if a.dtype == np.float32 else np.asarray(a, dtype=np.float64)
+
+
+class PackedForest:
+    """
+    Compact random forest for fast inference
+    - Node arrays (feature, threshold, left, right, spam probability) of all trees
+      are concatenated; `roots` holds the index of each tree's root node
+    - Inputs are sparse TF-IDF rows, so almost every split sees a zero feature.
+      Following the "zero" branch from a node gives a chain that ends in a leaf;
+      a row only leaves that chain at nodes where one of its non-zero features
+      sends it the other way. Those deviation nodes are found for the whole batch
+      with one sparse product, and all trees are then walked chain by chain with
+      vectorized NumPy lookups, without sklearn's per-call overhead or joblib
+      thread dispatch.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, n_features=None, chunk_size=512):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = float_array(threshold)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.value = float_array(value)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.n_features = n_features if n_features is not None else int(self.feature.max()) + 1
+        self.chunk_size = chunk_size
+        self.build_chains()
+
+    @classmethod
+    def from_estimator(cls, estimator, **kwargs):
+        """Pack a fitted RandomForestClassifier (optionally inside a FeatureSubsetClassifier)"""
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+
+        # Trees fit on a column subset: map their feature ids back to input columns
+        columns = None
+        n_features = estimator.n_features_in_
+        if isinstance(estimator, FeatureSubsetClassifier):
+            columns = estimator.columns_
+            estimator = estimator.estimator
+
+        for tree_estimator in estimator.estimators_:
+            tree = tree_estimator.tree_
+            leaf = tree.children_left == -1
+
+            feature = tree.feature if columns is None else columns[np.maximum(tree.feature, 0)]
+            features.append(np.where(leaf, -1, feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(leaf, -1, tree.children_left + offset))
+            rights.append(np.where(leaf, -1, tree.children_right + offset))
+
+            # Normalized class distribution at each node (probability of spam)
+            counts = tree.value[:, 0, :]
+            totals = counts.sum(axis=1)
+            totals[totals == 0] = 1
+            values.append(counts[:, 1] / totals)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            np.concatenate(features), np.concatenate(thresholds),
+            np.concatenate(lefts), np.concatenate(rights),
+            np.concatenate(values), roots, n_features=n_features, **kwargs
+        )
+
+    def to_float32(self):
+        """
+        Copy with float32 thresholds and leaf probabilities (half the memory)
+        Thresholds are rounded down to the nearest float32, so every split
+        sends a float32 feature value the same way as before
+        """
+        threshold = self.threshold.astype(np.float32)
+        above = threshold > self.threshold
+        threshold[above] = np.nextafter(threshold[above], np.float32(-np.inf))
+        return PackedForest(
+            self.feature, threshold, self.left, self.right, self.value.astype(np.float32),
+            self.roots, n_features=self.n_features, chunk_size=self.chunk_size
+        )
+
+    def build_chains(self):
+        """Precompute zero-branch chains and the node -> feature incidence matrix"""
+        n_nodes = len(self.feature)
+        nodes = np.arange(n_nodes)
+        self.internal = np.flatnonzero(self.left >= 0)
+
+        # Branch taken by a zero feature value, and the other one
+        zero_left = 0.0 <= self.threshold[self.internal]
+        zero_child = np.where(zero_left, self.left[self.internal], self.right[self.internal])
+        self.other_child = np.full(n_nodes, -1, dtype=np.int32)
+        self.other_child[self.internal] = np.where(zero_left, self.right[self.internal], self.left[self.internal])
+
+        # Head of the zero chain each node belongs to (pointer doubling)
+        head = nodes.copy()
+        head[zero_child] = self.internal
+        while True:
+            jumped = head[head]
+            if np.array_equal(jumped, head):
+                break
+            head = jumped
+        self.head = head.astype(np.int32)
+
+        # Leaf reached by following a chain to its end
+        leaves = np.flatnonzero(self.left < 0)
+        self.chain_end = np.full(n_nodes, -1, dtype=np.int32)
+        self.chain_end[self.head[leaves]] = leaves
+
+        # Column j of X @ node_features is the value of internal node j's feature
+        self.node_features = sp.csr_matrix(
+            (np.ones(len(self.internal), dtype=np.float32),
+             (self.feature[self.internal], np.arange(len(self.internal)))),
+            shape=(self.n_features, len(self.internal))
+        )
+
+    def predict_proba(self, X):
+        """Spam probability for each row of X (sparse or dense), averaged over trees"""
+        n_samples = X.shape[0]
+        proba = np.empty(n_samples)
+
+        for start in range(0, n_samples, self.chunk_size):
+            chunk = X[start:start + self.chunk_size]
+            leaves = self.apply(chunk)
+            proba[start:start + chunk.shape[0]] = self.value[leaves].mean(axis=1)
+
+        return proba
+
+    def apply(self, X):
+        """Leaf node reached in every tree: array of shape (n_rows, n_trees)"""
+        # Trees compare float32 features, like sklearn does
+        X = sp.csr_matrix(X, dtype=np.float32)
+        n_rows = X.shape[0]
+        n_nodes = len(self.feature)
+
+        # Nodes where a row's non-zero feature sends it off the zero chain
+        values = (X @ self.node_features).tocoo()
+        node = self.internal[values.col]
+        threshold = self.threshold[node]
+        deviates = (values.data <= threshold) != (0.0 <= threshold)
+        rows = values.row[deviates].astype(np.int64)
+        node = node[deviates]
+
+        # First deviation on each (row, chain): nodes deeper in a chain have larger ids
+        keys = np.sort((rows * n_nodes + self.head[node]) * n_nodes + node)
+        keys, node = np.divmod(keys, n_nodes)
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        keys = keys[first]
+        node = node[first]
+
+        # Walk every (row, tree) pair from chain to chain until no deviation is left
+        walk_rows = np.repeat(np.arange(n_rows, dtype=np.int64), len(self.roots))
+        current = np.tile(self.roots, n_rows)
+        leaves = np.empty(len(current), dtype=np.int64)
+        pending = np.arange(len(current))
+
+        while pending.size:
+            walk_keys = walk_rows[pending] * n_nodes + current[pending]
+            index = np.searchsorted(keys, walk_keys)
+            index[index == len(keys)] = 0
+            found = keys[index] == walk_keys if len(keys) else np.zeros(len(pending), dtype=bool)
+
+            done = pending[~found]
+            leaves[done] = self.chain_end[current[done]]
+
+            pending = pending[found]
+            current[pending] = self.other_child[node[index[found]]]
+
+        return leaves.reshape(n_rows, len(self.roots))
+
+    def nbytes(self):
+        """Memory used by the packed arrays and the derived lookup structures"""
+        arrays = [
+            self.feature, self.threshold, self.left, self.right, self.value, self.roots,
+            self.internal, self.other_child, self.head, self.chain_end,
+            self.node_features.data, self.node_features.indices, self.node_features.indptr
+        ]
+        return sum(a.nbytes for a in arrays)
+
+    def memory_report(self, estimator=None):
+        """Packed size, compared with the pickled sklearn estimator when given"""
+        report = {
+            'n_trees': len(self.roots),
+            'n_nodes': len(self.feature),
+            'packed_bytes': self.nbytes()
+        }
+        if estimator is not None:
+            report['pickled_bytes'] = len(pickle.dumps(estimator, protocol=pickle.HIGHEST_PROTOCOL))
+            report['compression_ratio'] = round(report['pickled_bytes'] / report['packed_bytes'], 2)
+        return report
@@ -0,0 +1,90 @@
+"""
+Parallel Training - Fit the Ensemble Models in a Process Pool
+The TF-IDF matrices are written once as .npy files and memory-mapped by every worker
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+from spam_detector import fit_and_evaluate
+
+
+def share_matrix(X, directory, name):
+    """Write a CSR matrix's arrays to directory; returns what workers need to map it"""
+    X = sp.csr_matrix(X)
+    paths = {}
+    for part in ['data', 'indices', 'indptr']:
+        paths[part] = os.path.join(directory, f'{name}_{part}.npy')
+        np.save(paths[part], getattr(X, part), allow_pickle=False)
+    return {'paths': paths, 'shape': X.shape}
+
+
+def map_matrix(shared):
+    """
+    Rebuild a CSR matrix from share_matrix output without copying it
+    Copy-on-write mapping: pages stay shared between workers unless written to
+    """
+    parts = {part: np.load(path, mmap_mode='c') for part, path in shared['paths'].items()}
+    return sp.csr_matrix((parts['data'], parts['indices'], parts['indptr']), shape=shared['shape'], copy=False)
+
+
+def train_worker(task):
+    """Worker process: fit and evaluate one model on the shared matrices"""
+    name, model, shared_train, y_train, shared_test, y_test = task
+    metrics = fit_and_evaluate(model, map_matrix(shared_train), y_train, map_matrix(shared_test), y_test)
+    return name, model, metrics
+
+
+def make_pool(n_workers):
+    """
+    Process pool where every task gets a fresh worker, so peak memory is per model
+    fork skips re-importing pandas/sklearn in every worker; spawn where fork is unavailable
+    """
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method).Pool(processes=n_workers, maxtasksperchild=1)
+
+
+def train_parallel(models, X_train, y_train, X_test, y_test, n_workers=None, on_result=None):
+    """
+    Fit and evaluate {name: model} concurrently
+    - n_workers: number of processes (default: one per model)
+    - Models that use threads themselves (n_jobs, e.g. the random forest) get
+      an equal share of the CPUs while fitting, so the pool doesn't
+      oversubscribe them; the fitted models get their own n_jobs back
+    - on_result(name, fitted_model, metrics) is called as each model finishes
+    Returns {name: (fitted_model, metrics)}
+    """
+    n_workers = n_workers or len(models)
+    n_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+    configured = {}
+    for name, model in models.items():
+        if 'n_jobs' in model.get_params():
+            configured[name] = model.get_params()['n_jobs']
+            model.set_params(n_jobs=n_jobs)
+    y_train = np.asarray(y_train)
+    y_test = np.asarray(y_test)
+
+    directory = tempfile.mkdtemp(prefix='spam_training_')
+    try:
+        shared_train = share_matrix(X_train, directory, 'train')
+        shared_test = share_matrix(X_test, directory, 'test')
+        tasks = [
+            (name, model, shared_train, y_train, shared_test, y_test)
+            for name, model in models.items()
+        ]
+
+        fitted = {}
+        with make_pool(n_workers) as pool:
+            for name, model, metrics in pool.imap_unordered(train_worker, tasks):
+                if name in configured:
+                    model.set_params(n_jobs=configured[name])
+                fitted[name] = (model, metrics)
+                if on_result is not None:
+                    on_result(name, model, metrics)
+
+        return fitted
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,175 @@
+"""
+Retrain Jobs - Background Model Retraining
+Trains new models in a separate process, saves them as a new registry version
+and hot-swaps them into the live detector (or keeps them as a candidate)
+"""
+
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from spam_detector import SpamDetector, MODELS_DIR
+from model_registry import ModelRegistry
+
+# Finished jobs kept for status queries
+MAX_FINISHED_JOBS = 20
+
+
+def run_training(dataset_path, models_dir, activate=True):
+    """
+    Child process entry point: train and save models as a new registry version
+    Status is streamed to the parent as JSON lines on stdout; the usual
+    training log goes to stderr.
+    """
+    status = sys.stdout
+
+    def emit(**message):
+        status.write(json.dumps(message) + '\n')
+        status.flush()
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            detector = SpamDetector(cache_size=0)
+            results = detector.train_models(
+                dataset_path,
+                progress=lambda fraction, stage: emit(type='progress', progress=fraction, stage=stage),
+                models_dir=models_dir,
+                activate=activate
+            )
+        emit(type='done', results=results, version=detector.training_stats['version'])
+        return 0
+    except Exception as e:
+        emit(type='error', error=str(e))
+        return 1
+
+
+class RetrainJobs:
+    """
+    Runs retraining jobs in the background, one at a time
+    - Training runs in a separate Python process, so the server keeps its
+      GIL for predictions
+    - The saved models are then loaded into a fresh detector and swapped into
+      the live one with SpamDetector.adopt_models (a single reference swap)
+    - activate=False only saves the new version (not served; it can be
+      shadow-scored and activated later)
+    """
+
+    def __init__(self, detector, models_dir=MODELS_DIR):
+        self.detector = detector
+        self.models_dir = models_dir
+        self.jobs = {}
+        self.active_job = None
+        self.lock = threading.Lock()
+
+    def start(self, dataset_path, activate=True):
+        """
+        Start a retraining job
+        Returns (job, started); started is False if another job is still running
+        """
+        with self.lock:
+            if self.active_job is not None:
+                return dict(self.jobs[self.active_job]), False
+
+            job = {
+                'id': uuid.uuid4().hex[:12],
+                'status': 'queued',
+                'stage': 'queued',
+                'progress': 0.0,
+                'dataset_path': dataset_path,
+                'activate': activate,
+                'version': None,
+                'created_at': time.time(),
+                'finished_at': None,
+                'results': None,
+                'error': None
+            }
+            self.jobs[job['id']] = job
+            self.active_job = job['id']
+            self.prune()
+
+        threading.Thread(target=self.run, args=(job['id'],), daemon=True).start()
+        return dict(job), True
+
+    def get(self, job_id):
+        """Status of a job, or None if unknown"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def finish(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields, finished_at=time.time())
+            self.active_job = None
+
+    def prune(self):
+        """Forget the oldest finished jobs (caller holds the lock)"""
+        finished = [job_id for job_id, job in self.jobs.items() if job['finished_at'] is not None]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def run(self, job_id):
+        """Job thread: train in a child process, then hot-swap the new models"""
+        try:
+            self.update(job_id, status='running', stage='starting')
+
+            # A fresh interpreter: nothing is shared with the serving process
+            job = self.get(job_id)
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), job['dataset_path'], self.models_dir,
+                 'activate' if job['activate'] else 'save'],
+                stdout=subprocess.PIPE,
+                text=True
+            )
+
+            outcome = None
+            for line in process.stdout:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+
+                if message['type'] == 'progress':
+                    # Leave the last 5% for loading and swapping
+                    self.update(job_id, progress=round(message['progress'] * 0.95, 3), stage=message['stage'])
+                else:
+                    outcome = message
+            process.wait()
+
+            if outcome is None:
+                outcome = {'type': 'error', 'error': f'Training process exited with code {process.returncode}'}
+
+            if outcome['type'] == 'error':
+                self.finish(job_id, status='failed', stage='failed', error=outcome['error'])
+                return
+
+            version = outcome['version']
+            self.update(job_id, version=version)
+            if not job['activate']:
+                self.finish(job_id, status='completed', stage='completed', progress=1.0, results=outcome['results'])
+                return
+
+            # Load the new models off to the side, then swap them in
+            self.update(job_id, progress=0.95, stage='loading models')
+            candidate = SpamDetector(cache_size=0, campaigns=self.detector.campaign_settings)
+            candidate.load_models(ModelRegistry(self.models_dir).path(version))
+            if not candidate.models_loaded:
+                self.finish(job_id, status='failed', stage='failed', error='Trained models could not be loaded')
+                return
+
+            self.detector.adopt_models(candidate)
+            self.finish(job_id, status='completed', stage='completed', progress=1.0, results=outcome['results'])
+
+        except Exception as e:
+            self.finish(job_id, status='failed', stage='failed', error=str(e))
+
+
+if __name__ == '__main__':
+    sys.exit(run_training(sys.argv[1], sys.argv[2], activate=sys.argv[3] == 'activate'))
@@ -0,0 +1,376 @@
+"""
+Bulk Mailbox Scoring
+Scores stored mail offline: streams messages out of mbox files, Maildir trees
+and directories of .eml files, parses subject and text body in a pool of
+worker processes (the models are loaded once per worker) and writes one JSON
+line per message. Progress is checkpointed after every batch, so an
+interrupted run continues where it stopped with --resume.
+
+Usage:
+    python score_mailbox.py ARCHIVE [ARCHIVE ...] --output verdicts.jsonl [--resume]
+                            [--workers N] [--batch-size 256] [--models-dir models]
+                            [--max-message-bytes 2097152]
+"""
+
+from spam_detector import SpamDetector, MODELS_DIR
+from model_store import write_atomic
+from bounded_input import html_to_text
+from collections import deque
+import argparse
+import contextlib
+import email
+import email.policy
+import io
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+# Raw bytes read per message (the rest, usually attachments, is skipped)
+MAX_MESSAGE_BYTES = 2 * 1024 * 1024
+
+# A batch closes at batch_size messages or this many raw bytes
+BATCH_BYTES = 8 * 1024 * 1024
+
+# mbox files are read in lines of at most this many bytes (base64 without newlines stays bounded)
+READ_LIMIT = 64 * 1024
+
+MBOX_SEPARATOR = b'From '
+MODEL_NAMES = ['naive_bayes', 'svm', 'random_forest', 'logistic_regression']
+
+# Detector of this process: loaded by the parent before forking, or by init_worker
+detector = None
+
+
+def read_mbox(path, offset=0, max_bytes=MAX_MESSAGE_BYTES):
+    """
+    Messages of an mbox file from byte offset on: (id, raw bytes, offset after)
+    Each message starts at a 'From ' line; a message longer than max_bytes is cut there
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        position = offset
+        start = None
+        parts, size = [], 0
+        at_line_start = True
+        while True:
+            line = f.readline(READ_LIMIT)
+            if not line:
+                break
+            if at_line_start and line.startswith(MBOX_SEPARATOR):
+                if start is not None:
+                    yield f'{path}:{start}', b''.join(parts), position
+                start = position
+                parts, size = [], 0
+            elif start is not None and size < max_bytes:
+                parts.append(line[:max_bytes - size])
+                size += len(parts[-1])
+            at_line_start = line.endswith(b'\n')
+            position += len(line)
+        if start is not None:
+            yield f'{path}:{start}', b''.join(parts), position
+
+
+def is_message_file(parents, name):
+    """Maildir messages (in cur/ or new/) and .eml files"""
+    if name.startswith('.'):
+        return False
+    return name.lower().endswith('.eml') or (bool(parents) and parents[-1] in ('cur', 'new'))
+
+
+def walk_files(directory, after=None, parents=()):
+    """
+    Message files under directory in sorted path order: (path, path parts)
+    - after: path parts (relative to directory) of the last file already
+      scored; it and everything before it are skipped without being listed
+    Only one directory's listing is held at a time
+    """
+    for name in sorted(os.listdir(directory)):
+        parts = list(parents) + [name]
+        if after is not None and parts < after[:len(parts)]:
+            continue
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            if name != 'tmp':  # Maildir deliveries still being written
+                yield from walk_files(path, after, parts)
+        elif is_message_file(parents, name) and (after is None or parts > after):
+            yield path, parts
+
+
+def read_files(path, after=None, max_bytes=MAX_MESSAGE_BYTES):
+    """Messages of a directory (or a single .eml file): (id, raw bytes, parts of the file)"""
+    if os.path.isfile(path):
+        files = [] if after is not None else [(path, [os.path.basename(path)])]
+    else:
+        files = walk_files(path, after)
+    for file_path, parts in files:
+        with open(file_path, 'rb') as f:
+            yield file_path, f.read(max_bytes), parts
+
+
+def archive_sources(paths):
+    """[kind, path] for each archive: 'mbox' for files other than .eml, 'files' for directories and .eml files"""
+    sources = []
+    for path in paths:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Archive not found: {path}")
+        is_mbox = os.path.isfile(path) and not path.lower().endswith('.eml')
+        sources.append(['mbox' if is_mbox else 'files', os.path.abspath(path)])
+    return sources
+
+
+def read_messages(sources, cursor, max_bytes=MAX_MESSAGE_BYTES):
+    """
+    Every message from cursor on: (id, raw bytes, cursor after it)
+    A cursor is {'source': index, 'position': byte offset (mbox) or
+    path parts of the last file read (directories), None = from the start}
+    """
+    for index in range(cursor['source'], len(sources)):
+        kind, path = sources[index]
+        position = cursor['position'] if index == cursor['source'] else None
+        if kind == 'mbox':
+            messages = read_mbox(path, position or 0, max_bytes)
+        else:
+            messages = read_files(path, position, max_bytes)
+        for message_id, raw, after in messages:
+            yield message_id, raw, {'source': index, 'position': after}
+
+
+def batches(messages, batch_size, batch_bytes=BATCH_BYTES):
+    """Group (id, raw, cursor) into ([(id, raw), ...], cursor after the batch)"""
+    batch, size, cursor = [], 0, None
+    for message_id, raw, cursor in messages:
+        batch.append((message_id, raw))
+        size += len(raw)
+        if len(batch) >= batch_size or size >= batch_bytes:
+            yield batch, cursor
+            batch, size = [], 0
+    if batch:
+        yield batch, cursor
+
+
+def part_text(part):
+    """Decoded text of a MIME part (undeclared or unknown charsets decode as UTF-8)"""
+    try:
+        return part.get_content()
+    except (LookupError, UnicodeError, ValueError):
+        payload = part.get_payload(decode=True) or b''
+        return payload.decode('utf-8', errors='replace')
+
+
+def parse_message(raw):
+    """
+    (subject, body, Message-ID) of a raw RFC 822 message
+    The body is the text/plain parts, or the text of the HTML parts when there
+    is no plain text; attachments are skipped
+    """
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    plain, markup = [], []
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_disposition() == 'attachment':
+            continue
+        content_type = part.get_content_type()
+        if content_type == 'text/plain':
+            plain.append(part_text(part))
+        elif content_type == 'text/html':
+            markup.append(part_text(part))
+
+    body = '\n'.join(plain) if plain else html_to_text('\n'.join(markup))
+    return str(message.get('subject') or ''), body, str(message.get('message-id') or '') or None
+
+
+def load_detector(models_dir, quiet=False):
+    """SpamDetector for bulk scoring: no prediction cache, no campaign lookups"""
+    scorer = SpamDetector(cache_size=0)
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        scorer.load_models(models_dir)
+    if not scorer.models_loaded:
+        raise ValueError(f"No trained models in {models_dir}")
+    return scorer
+
+
+def init_worker(models_dir):
+    """
+    Pool initializer: forked workers share the parent's models; spawned ones load their own
+    Ctrl+C is left to the parent, which stops the pool
+    """
+    global detector
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if detector is None:
+        detector = load_detector(models_dir, quiet=True)
+
+
+def predict_each(messages):
+    """
+    predict_batch results for messages; if the batch fails, each message is
+    retried alone, and one that still fails gets its exception instead of a result
+    """
+    try:
+        return detector.predict_batch(messages)
+    except Exception:
+        pass
+    results = []
+    for message in messages:
+        try:
+            results.append(detector.predict_batch([message])[0])
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def score_worker(batch):
+    """
+    Worker: parse and score a batch of (id, raw bytes)
+    A message that can't be parsed or scored gets a line with an 'error'
+    instead of a verdict, so the rest of the run (and --resume) goes on
+    Returns (JSON lines as bytes, spam count, error count)
+    """
+    records, messages = [], []
+    for message_id, raw in batch:
+        try:
+            subject, body, header_id = parse_message(raw)
+        except Exception as e:
+            records.append({'id': message_id, 'error': f'{type(e).__name__}: {e}'})
+            continue
+        records.append({'id': message_id, 'message_id': header_id, 'subject': subject})
+        messages.append({'subject': subject, 'content': body})
+
+    results = iter(predict_each(messages))
+    spam = errors = 0
+    for record in records:
+        if 'error' not in record:
+            result = next(results)
+            if isinstance(result, Exception):
+                record['error'] = f'{type(result).__name__}: {result}'
+        if 'error' in record:
+            errors += 1
+            continue
+        record['is_spam'] = result['is_spam']
+        record['score'] = round(result['ensemble'], 6)
+        record['models'] = {
+            name: None if result[name] is None else round(result[name], 6) for name in MODEL_NAMES
+        }
+        spam += result['is_spam']
+
+    lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+    return lines.encode('utf-8'), spam, errors
+
+
+def make_pool(n_workers, models_dir):
+    """Scoring pool; fork shares the models loaded by the parent, spawn where fork is unavailable"""
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method).Pool(
+        processes=n_workers, initializer=init_worker, initargs=(models_dir,)
+    )
+
+
+def save_progress(path, progress):
+    write_atomic(path, lambda f: f.write(json.dumps(progress, indent=2).encode('utf-8')))
+
+
+def score_archives(paths, output, models_dir=MODELS_DIR, n_workers=None, batch_size=256, resume=False,
+                   max_message_bytes=MAX_MESSAGE_BYTES):
+    """
+    Score every message of the archives into output (JSONL, in archive order)
+    - Progress (cursor, counts, output size) is saved to output + '.progress'
+      after each batch; resume=True continues from it, dropping any lines
+      written after the last checkpoint
+    - At most 2 batches per worker are in flight, so memory is bounded by
+      batch size, not archive size
+    Returns {'messages', 'spam', 'errors', 'seconds', 'messages_per_second'} for this run
+    """
+    global detector
+    n_workers = n_workers or os.cpu_count() or 1
+    sources = archive_sources(paths)
+    progress_path = output + '.progress'
+
+    progress = {'sources': sources, 'cursor': {'source': 0, 'position': None},
+                'messages': 0, 'spam': 0, 'errors': 0, 'output_bytes': 0}
+    if resume and os.path.exists(progress_path):
+        with open(progress_path, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved['sources'] != sources:
+            raise ValueError("The archives differ from the ones in the saved progress; run without --resume")
+        progress = saved
+        print(f"Resuming after {progress['messages']:,} messages")
+    with open(output, 'ab') as f:
+        f.truncate(progress['output_bytes'])
+
+    detector = load_detector(models_dir)
+    print(f"Scoring with {n_workers} worker(s), batches of up to {batch_size} messages\n")
+
+    start = time.perf_counter()
+    done = {'messages': 0, 'spam': 0, 'errors': 0}
+    last_report = start
+
+    def finish(pending_batch):
+        nonlocal last_report
+        result, cursor, size = pending_batch
+        lines, spam, errors = result.get()
+        out.write(lines)
+        out.flush()
+        for key, value in (('messages', size), ('spam', spam), ('errors', errors)):
+            done[key] += value
+            progress[key] += value
+        progress['cursor'] = cursor
+        progress['output_bytes'] = out.tell()
+        save_progress(progress_path, progress)
+
+        now = time.perf_counter()
+        if now - last_report >= 10:
+            print(f"  {progress['messages']:,} messages ({done['messages'] / (now - start):,.0f}/s)")
+            last_report = now
+
+    messages = read_messages(sources, progress['cursor'], max_message_bytes)
+    with make_pool(n_workers, models_dir) as pool, open(output, 'ab') as out:
+        pending = deque()
+        for batch, cursor in batches(messages, batch_size):
+            pending.append((pool.apply_async(score_worker, (batch,)), cursor, len(batch)))
+            if len(pending) >= 2 * n_workers:
+                finish(pending.popleft())
+        while pending:
+            finish(pending.popleft())
+
+    seconds = time.perf_counter() - start
+    return dict(done, seconds=round(seconds, 2),
+                messages_per_second=round(done['messages'] / seconds, 1) if seconds else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score stored mail (mbox, Maildir, .eml) into a JSONL file')
+    parser.add_argument('archives', nargs='+', help='mbox files, Maildir directories, .eml files or directories of them')
+    parser.add_argument('--output', required=True, help='JSONL file with one verdict per message')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run from its .progress file')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=256, help='messages scored together per task')
+    parser.add_argument('--models-dir', default=MODELS_DIR, help='directory with the trained models')
+    parser.add_argument('--max-message-bytes', type=int, default=MAX_MESSAGE_BYTES,
+                        help='raw bytes read per message (the rest, usually attachments, is skipped)')
+    args = parser.parse_args()
+
+    print("\n" + "=" * 60)
+    print(" BULK MAILBOX SCORING ")
+    print("=" * 60 + "\n")
+
+    try:
+        report = score_archives(
+            args.archives, args.output, args.models_dir, args.workers, args.batch_size,
+            args.resume, args.max_message_bytes
+        )
+    except (ValueError, FileNotFoundError) as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n✗ Interrupted; run again with --resume to continue")
+        sys.exit(1)
+
+    print(f"\n✓ Scored {report['messages']:,} messages in {report['seconds']:.1f}s "
+          f"({report['messages_per_second']:,.0f} messages/s)")
+    print(f"  Spam: {report['spam']:,}  Unparseable or failed to score: {report['errors']:,}")
+    print(f"  Verdicts: {args.output}")
+    print("=" * 60 + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+"""
+Production Server - Pre-Forked Workers Sharing the Loaded Models
+The parent process loads and warms up the models once, then forks the workers:
+they share the models copy-on-write and each serves requests with a pool of
+threads. Linux/macOS only (needs os.fork); on Windows run app.py.
+
+Usage:
+    python serve.py [--host 0.0.0.0] [--port 5000] [--workers N] [--threads N]
+                    [--feedback-refresh SECONDS]
+
+Signals to the parent:
+    SIGHUP           reload the models and replace the workers gracefully
+    SIGTERM, SIGINT  stop after in-flight requests finish
+Models saved by train_model.py, /api/retrain or feedback checkpoints, and
+versions activated or rolled back with model_registry.py, are picked up
+automatically (the same graceful reload).
+/api/metrics sums the metrics of all workers (see metrics.SharedMetrics);
+/api/stats reports the worker that answered.
+"""
+
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+# How often the parent checks workers, saved models and feedback (seconds)
+POLL_INTERVAL = 1.0
+
+# Feedback updates are batched into one worker generation per interval (seconds):
+# workers lag the parent's models by at most this much, and are re-forked at most this often
+FEEDBACK_REFRESH_INTERVAL = 60.0
+
+
+class RequestHandler(WSGIRequestHandler):
+    """One request per connection, so idle keep-alive clients don't hold worker threads"""
+    protocol_version = 'HTTP/1.0'
+    access_log = False
+
+    def log_request(self, code='-', size='-'):
+        if self.access_log:
+            super().log_request(code, size)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server that handles connections on a fixed pool of threads"""
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+
+    def get_request(self):
+        # The shared listening socket is non-blocking (workers race to accept)
+        connection, address = self.socket.accept()
+        connection.setblocking(True)
+        return connection, address
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def model_signature(models_dir):
+    """
+    Modification time of the file written last when models are saved: the
+    array store's manifest (replaced atomically after the arrays), or the
+    training stats pickle for pickle-only model directories, of the active
+    registry version (activating or rolling back a version changes the path)
+    """
+    from spam_detector import ARRAYS_SUBDIR
+    from model_registry import active_models_dir
+    models_dir = active_models_dir(models_dir)
+    for path in (os.path.join(models_dir, ARRAYS_SUBDIR, 'manifest.json'),
+                 os.path.join(models_dir, 'training_stats.pkl')):
+        if os.path.exists(path):
+            return path, os.stat(path).st_mtime_ns
+    return None
+
+
+def run_worker(listener, app, threads, parent_pid, publish=None):
+    """
+    Worker process: serve until SIGTERM/SIGINT, then finish in-flight requests and exit
+    - publish: called every POLL_INTERVAL and on exit (shares the worker's metrics)
+    """
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    server = PooledWSGIServer(*listener.getsockname()[:2], app, threads, listener.fileno())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # Also stop if the parent is gone
+    while not stop.wait(POLL_INTERVAL) and os.getppid() == parent_pid:
+        if publish is not None:
+            publish()
+
+    server.shutdown()
+    server.pool.shutdown(wait=True)
+    if publish is not None:
+        publish()
+
+
+class PreforkServer:
+    """
+    Parent process: owns the listening socket, the models and the workers
+    - Workers that die are replaced
+    - Reload: the parent loads the new models, forks a new set of workers and
+      asks the old ones to finish their requests and exit, so some worker is
+      always accepting connections
+    - Feedback: workers only log it; the parent applies it to its models
+      (see OnlineLearner.follow) and forks a new generation from them
+      feedback_refresh seconds after the first unserved update, so the updates
+      of that interval are served together; a checkpoint saves the models the
+      parent already serves, so it doesn't trigger a reload of its own
+    - Metrics: workers publish theirs to a shared directory; the parent keeps
+      the totals of workers that exited
+    """
+
+    def __init__(self, api, host='0.0.0.0', port=5000, workers=None, threads=4,
+                 graceful_timeout=30.0, watch_models=True, feedback_refresh=FEEDBACK_REFRESH_INTERVAL):
+        self.api = api
+        self.host = host
+        self.port = port
+        self.n_workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.watch_models = watch_models
+        self.feedback_refresh = feedback_refresh
+
+        self.listener = None
+        self.workers = {}      # pid -> generation
+        self.retiring = {}     # pid -> kill deadline
+        self.generation = 0
+        self.reload_requested = False
+        self.stop_requested = False
+        self.signature = None
+        self.served_version = None  # model version the current generation was forked with
+        self.refresh_due = None     # when the pending feedback updates get their generation
+        self.metrics_dir = None
+
+        # Applies the feedback logged by the workers
+        from online_learning import OnlineLearner
+        learner = api.online_learner
+        self.learner = OnlineLearner(
+            api.detector, models_dir=learner.models_dir, batch_size=learner.batch_size,
+            flush_interval=learner.flush_interval, checkpoint_interval=learner.checkpoint_interval
+        )
+
+    def bind(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(1024)
+        self.listener.setblocking(False)
+
+    def spawn(self):
+        """Fork one worker of the current generation"""
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                # Each worker scores its shadow samples in its own shadow process
+                if getattr(self.api, 'shadow', None) is not None:
+                    self.api.shadow.start()
+                run_worker(self.listener, self.api.app, self.threads, os.getppid(),
+                           publish=self.api.publish_metrics)
+            except BaseException as e:
+                print(f"✗ Worker {os.getpid()} failed: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = self.generation
+
+    def spawn_generation(self):
+        """Fork a full set of workers sharing the parent's current models"""
+        self.generation += 1
+        # Keep the garbage collector from touching (and so copying) the shared objects;
+        # unfreeze first so cycles left by the previous generation's models can be collected
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.n_workers):
+            self.spawn()
+        self.served_version = self.api.detector.model_version
+        print(f"✓ Started {self.n_workers} workers x {self.threads} threads "
+              f"(generation {self.generation}, model version {self.api.detector.model_version})")
+
+    def retire(self, pids):
+        """Ask workers to finish their requests and exit"""
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.workers.pop(pid, None)
+            self.retiring[pid] = deadline
+            signal_process(pid, signal.SIGTERM)
+
+    def reap(self):
+        """Collect exited workers; replace the ones that weren't asked to stop"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.api.shared_metrics is not None:
+                self.api.shared_metrics.retire(pid)
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            if self.workers.pop(pid, None) is not None and not self.stop_requested:
+                print(f"✗ Worker {pid} exited unexpectedly (status {status}); starting a new one")
+                self.spawn()
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now >= deadline:
+                signal_process(pid, signal.SIGKILL)
+
+    def reload(self):
+        """Load the saved models in the parent and replace the workers"""
+        detector = self.api.detector
+        print("Reloading models...")
+        version = detector.model_version
+        with detector.swap_lock:
+            detector.load_models(self.learner.models_dir)
+        if detector.model_version == version:
+            print("✗ Reload failed; keeping the current workers")
+            return
+        detector.warm_up()
+        self.signature = model_signature(self.learner.models_dir)
+        self.replace_workers()
+
+    def replace_workers(self):
+        """Fork a new generation from the parent's current models and retire the old one"""
+        old = list(self.workers)
+        self.refresh_due = None
+        self.spawn_generation()
+        self.retire(old)
+
+    def run(self):
+        self.bind()
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, 'reload_requested', True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, 'stop_requested', True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, 'stop_requested', True))
+
+        if self.api.metrics.enabled:
+            from metrics import SharedMetrics
+            self.metrics_dir = tempfile.mkdtemp(prefix='spam-metrics-')
+            self.api.shared_metrics = SharedMetrics(self.metrics_dir)
+
+        self.signature = model_signature(self.learner.models_dir)
+        self.learner.replay()
+        self.spawn_generation()
+        print(f"Serving on http://{self.host}:{self.port} (parent pid {os.getpid()})")
+
+        while not self.stop_requested:
+            time.sleep(POLL_INTERVAL)
+            self.reap()
+            self.kill_overdue()
+
+            # Feedback logged by the workers, applied to the parent's models
+            checkpoints = self.learner.checkpoints
+            self.learner.follow()
+            self.learner.step()
+            if self.learner.checkpoints != checkpoints:
+                # The checkpoint is the models the parent serves: nothing to load
+                self.signature = model_signature(self.learner.models_dir)
+            if self.api.detector.model_version != self.served_version:
+                if self.refresh_due is None:
+                    self.refresh_due = time.monotonic() + self.feedback_refresh
+                elif time.monotonic() >= self.refresh_due:
+                    self.replace_workers()
+
+            if self.watch_models and model_signature(self.learner.models_dir) != self.signature:
+                self.reload_requested = True
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop all workers gracefully (killing any that outlive graceful_timeout)"""
+        print("Stopping workers...")
+        self.retire(list(self.workers))
+        while self.retiring:
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.1)
+        self.listener.close()
+        if self.metrics_dir is not None:
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        print("✓ Server stopped")
+
+
+def signal_process(pid, signum):
+    """Send a signal to a worker that may have exited already"""
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the spam detection API with pre-forked workers')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', 0)) or None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 4)),
+                        help='request threads per worker')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='seconds a stopping worker gets to finish its requests')
+    parser.add_argument('--feedback-refresh', type=float,
+                        default=float(os.environ.get('FEEDBACK_REFRESH_INTERVAL', FEEDBACK_REFRESH_INTERVAL)),
+                        help='seconds of feedback updates batched into one worker generation')
+    parser.add_argument('--no-watch', action='store_true', help="don't reload when new models are saved")
+    parser.add_argument('--access-log', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print("serve.py needs os.fork (Linux/macOS). On Windows run: python app.py")
+        sys.exit(1)
+
+    # Workers get the models from the parent: load them (and warm up) before forking
+    os.environ['SPAM_PREFORK'] = '1'
+    import app as api
+
+    RequestHandler.access_log = args.access_log
+    server = PreforkServer(
+        api, host=args.host, port=args.port, workers=args.workers, threads=args.threads,
+        graceful_timeout=args.graceful_timeout, watch_models=not args.no_watch,
+        feedback_refresh=args.feedback_refresh
+    )
+    server.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+"""
+Shadow Scoring - Candidate Models on Live Traffic, off the Request Path
+A registry version that isn't active yet scores a sampled fraction of live
+/api/predict traffic. The request thread only draws a random number and, for
+a sampled request, writes the message and its served verdict to the pipe of
+a child process without blocking (a full pipe drops the sample; nothing
+waits). The child, at the lowest CPU priority, scores each message with both
+the candidate and the saved active version, compares the verdicts with the
+served ones and keeps the counts in a small JSON file that /api/stats reads.
+The serving process runs no extra threads.
+"""
+
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+import numpy as np
+from model_registry import ModelRegistry
+from model_store import write_atomic
+
+# Latencies kept for the percentiles in the stats
+LATENCY_SAMPLES = 10000
+
+# Seconds between writes of the stats file by the shadow process
+STATS_INTERVAL = 0.5
+
+# Priority of the shadow process (os.nice increment) where the SCHED_IDLE policy isn't available:
+# either way it gets the CPU only when serving doesn't need it
+NICENESS = 19
+
+# Shadow process: lowers its priority before importing anything (loading the models included)
+CHILD_CODE = (
+    "import os, sys\n"
+    "try: os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))\n"
+    "except (AttributeError, OSError): hasattr(os, 'nice') and os.nice(%d)\n"
+    "sys.path.insert(0, %r)\n"
+    "import shadow_scoring; sys.exit(shadow_scoring.run_shadow(*sys.argv[1:4]))"
+) % (NICENESS, os.path.dirname(os.path.abspath(__file__)))
+
+ROLES = ['active', 'candidate']
+
+
+def latency_summary(samples):
+    if not samples:
+        return None
+    values = np.fromiter(samples, dtype=float, count=len(samples))
+    return {
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p95': round(float(np.percentile(values, 95)), 3),
+        'p99': round(float(np.percentile(values, 99)), 3),
+        'mean': round(float(values.mean()), 3)
+    }
+
+
+class ShadowTally:
+    """Agreement and latency counts kept by the shadow process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status = 'loading'
+        self.error = None
+        self.scored = 0
+        self.agreed = 0
+        self.candidate_spam = 0    # candidate says spam, served verdict was ham
+        self.candidate_ham = 0     # and the other way round
+        self.score_difference = 0.0
+        self.latencies = {role: deque(maxlen=LATENCY_SAMPLES) for role in ROLES}
+        self.changes = 0
+
+    def add(self, served_spam, served_score, scored):
+        candidate = scored['candidate']
+        with self.lock:
+            self.scored += 1
+            self.agreed += candidate['is_spam'] == served_spam
+            self.candidate_spam += candidate['is_spam'] and not served_spam
+            self.candidate_ham += served_spam and not candidate['is_spam']
+            self.score_difference += abs(candidate['score'] - served_score)
+            for role in ROLES:
+                self.latencies[role].append(scored[role]['ms'])
+            self.changes += 1
+
+    def set_status(self, status, error=None):
+        with self.lock:
+            self.status, self.error = status, error
+            self.changes += 1
+
+    def snapshot(self):
+        with self.lock:
+            scored = self.scored
+            latencies = {role: list(samples) for role, samples in self.latencies.items()}
+            stats = {
+                'status': self.status,
+                'error': self.error,
+                'scored': scored,
+                'agreement_rate': self.agreed / scored if scored else None,
+                'disagreements': {'candidate_spam': self.candidate_spam, 'candidate_ham': self.candidate_ham},
+                'mean_score_difference': self.score_difference / scored if scored else None
+            }
+        stats['latency_ms'] = {role: latency_summary(samples) for role, samples in latencies.items()}
+        return stats
+
+
+def run_shadow(active_dir, candidate_dir, stats_path):
+    """
+    Child process entry point (see CHILD_CODE): score the messages read from
+    stdin (JSON lines with the served 'is_spam' and 'score') with the active
+    and the candidate models; the counts go to stats_path, the usual model
+    loading log to stderr; the stats file is removed when the input closes
+    """
+    tally = ShadowTally()
+    done = threading.Event()
+    writing = threading.Lock()
+
+    def write_stats():
+        encoded = json.dumps(tally.snapshot()).encode('utf-8')
+        with writing:
+            if not done.is_set():
+                write_atomic(stats_path, lambda f: f.write(encoded))
+
+    def write_periodically():
+        written = None
+        while not done.wait(STATS_INTERVAL):
+            if tally.changes != written:
+                written = tally.changes
+                write_stats()
+
+    write_stats()
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            from spam_detector import SpamDetector
+            detectors = {}
+            for role, path in zip(ROLES, (active_dir, candidate_dir)):
+                detector = SpamDetector(cache_size=0)
+                detector.load_models(path)
+                if not detector.models_loaded:
+                    raise ValueError(f"No models in {path}")
+                detector.warm_up()
+                detectors[role] = detector
+    except Exception as e:
+        tally.set_status('failed', str(e))
+        write_stats()
+        return 1
+    tally.set_status('running')
+    threading.Thread(target=write_periodically, daemon=True).start()
+
+    for number, line in enumerate(sys.stdin):
+        message = json.loads(line)
+        scored = {}
+        # Alternate which model goes first, so neither always finds the caches warm
+        for role in (ROLES if number % 2 else ROLES[::-1]):
+            start = time.perf_counter()
+            result = detectors[role].predict_batch([message])[0]
+            scored[role] = {
+                'score': result['ensemble'],
+                'is_spam': result['is_spam'],
+                'ms': (time.perf_counter() - start) * 1000
+            }
+        tally.add(message['is_spam'], message['score'], scored)
+
+    with writing:
+        done.set()
+        with contextlib.suppress(OSError):
+            os.remove(stats_path)
+    return 0
+
+
+class ShadowScorer:
+    """
+    Shadow scoring of one candidate registry version
+    - fraction: share of /api/predict requests sampled
+    - start() launches the shadow process on a helper thread; it is called when
+      scoring is set up, and again by the first sampled request of a process
+      that doesn't have one yet (every worker forked by serve.py gets its own)
+      or when the active models were loaded from another directory
+      (activation or rollback: a restart, with fresh counts)
+    - The pipe to the shadow process is the queue: a sample that doesn't fit
+      is dropped
+    - Agreement is measured against the verdicts that were served; latencies
+      of both versions come from the shadow process, measured side by side
+    """
+
+    def __init__(self, detector, models_dir, version, fraction=0.05):
+        registry = ModelRegistry(models_dir)
+        registry.get(version)
+        if not 0 < fraction <= 1:
+            raise ValueError(f"fraction must be in (0, 1] (got {fraction})")
+        self.detector = detector
+        self.version = version
+        self.candidate_dir = registry.path(version)
+        self.fraction = fraction
+
+        self.lock = threading.Lock()
+        self.owner = None          # pid of the process the shadow process belongs to
+        self.stopped = False
+        self.reset()
+
+    def reset(self):
+        """No shadow process, fresh counters (a new process, e.g. after fork)"""
+        self.process = None
+        self.active_dir = None
+        self.stats_path = None
+        self.starting = False      # a helper thread is starting the shadow process
+        self.backlog = b''         # end of a message the pipe only took in part
+        self.error = None
+        self.sampled = 0
+        self.dropped = 0
+
+    def offer(self, message, result):
+        """
+        Request path: sample a scored message ({'subject', 'content'}) with its
+        predict_all result; returns True if it was passed to the shadow process
+        Never waits: while no shadow process is ready for the live models
+        (starting, or restarting after an activation) samples are dropped
+        """
+        if self.stopped or random.random() >= self.fraction:
+            return False
+        if self.owner != os.getpid() or self.detector.models_path != self.active_dir:
+            self.start()
+        line = json.dumps({
+            'subject': message.get('subject', ''),
+            'content': message.get('content', ''),
+            'is_spam': result['is_spam'],
+            'score': result['ensemble']
+        }).encode('utf-8') + b'\n'
+
+        with self.lock:
+            if self.process is None or self.detector.models_path != self.active_dir:
+                self.dropped += 1
+                return False
+            try:
+                if self.backlog:
+                    self.backlog = self.backlog[self.write(self.backlog):]
+                if self.backlog:
+                    self.dropped += 1
+                    return False
+                written = self.write(line)
+            except OSError as e:
+                self.error = str(e)
+                self.stopped = True
+                self.close()
+                return False
+            if not written:
+                self.dropped += 1
+                return False
+            self.backlog = line[written:]
+            self.sampled += 1
+            return True
+
+    def write(self, data):
+        """Bytes of data the pipe took (0 if it is full)"""
+        try:
+            return os.write(self.process.stdin.fileno(), data)
+        except BlockingIOError:
+            return 0
+
+    def start(self):
+        """
+        Start the shadow process for the live models on a helper thread, or
+        restart it if they changed (activation, rollback); returns right away
+        """
+        with self.lock:
+            if self.owner != os.getpid():
+                self.owner = os.getpid()
+                self.reset()
+            if self.stopped or self.starting or self.detector.models_path is None:
+                return
+            if self.process is not None and self.detector.models_path == self.active_dir:
+                return
+            self.starting = True
+        threading.Thread(target=self.spawn, daemon=True).start()
+
+    def spawn(self):
+        """Helper thread: start a shadow process for the current active models, replacing any previous one"""
+        try:
+            active_dir = self.detector.models_path
+            fd, stats_path = tempfile.mkstemp(prefix='shadow-', suffix='.json')
+            os.close(fd)
+            process = subprocess.Popen(
+                [sys.executable, '-c', CHILD_CODE, active_dir, self.candidate_dir, stats_path],
+                stdin=subprocess.PIPE
+            )
+            os.set_blocking(process.stdin.fileno(), False)
+        except (OSError, TypeError) as e:
+            with self.lock:
+                self.error, self.stopped, self.starting = str(e), True, False
+            return
+
+        with self.lock:
+            self.close()
+            self.process, self.active_dir, self.stats_path = process, active_dir, stats_path
+            self.starting = False
+            if self.stopped:
+                self.close()
+
+    def close(self):
+        """Stop the shadow process (it exits when its input closes) and remove its stats file"""
+        process, self.process = self.process, None
+        self.backlog = b''
+        if process is not None:
+            with contextlib.suppress(OSError):
+                process.stdin.close()
+        if self.stats_path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(self.stats_path)
+            self.stats_path = None
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            if self.owner == os.getpid():
+                self.close()
+
+    def stats(self):
+        """Agreement and latency of the candidate vs the active models, for /api/stats"""
+        with self.lock:
+            process, stats_path = self.process, self.stats_path
+            sampled, dropped, error, stopped = self.sampled, self.dropped, self.error, self.stopped
+            # Not started in this process yet / shadow process being started
+            shadow = {'status': 'starting' if self.starting else 'waiting'}
+        if stats_path is not None:
+            try:
+                with open(stats_path, encoding='utf-8') as f:
+                    shadow = json.load(f)
+            except (OSError, ValueError):
+                shadow = {'status': 'starting'}
+            if process.poll() is not None and shadow['status'] != 'failed':
+                shadow['status'], shadow['error'] = 'failed', 'shadow process exited'
+
+        stats = {
+            'enabled': True,
+            'version': self.version,
+            'status': shadow['status'],
+            'error': error or shadow.get('error'),
+            'fraction': self.fraction,
+            'sampled': sampled,
+            'dropped': dropped,
+            'scored': shadow.get('scored', 0),
+            'agreement_rate': shadow.get('agreement_rate'),
+            'disagreements': shadow.get('disagreements', {'candidate_spam': 0, 'candidate_ham': 0}),
+            'mean_score_difference': shadow.get('mean_score_difference'),
+            'latency_ms': shadow.get('latency_ms', {role: None for role in ROLES})
+        }
+        if error is not None:
+            stats['status'] = 'failed'
+        elif stopped:
+            stats['status'] = 'stopped'
+        return stats
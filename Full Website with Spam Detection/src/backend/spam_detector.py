@@ -3,40 +3,297 @@ Spam Detector - Machine Learning Models
 Trains on spam mail.csv with columns: Category, Messages
 """
 
-import pandas as pd
 import numpy as np
 import pickle
-import re
 import os
-from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.svm import SVC
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
+import sys
+import threading
+import time
+from spam_patterns import SpamPatternMatcher
+from linear_engine import FusedLinearModels
+from packed_forest import PackedForest
+import model_store
+from prediction_cache import PredictionCache, text_key
+from metrics import Metrics, NULL_TIMER
+import cascade
+from campaign_index import CampaignIndex, CAMPAIGNS_SUBDIR
+from text_features import TextFeatures, FEATURE_NAMES, batch_features, stack_features
+from fast_vectorizer import compile_vectorizer
+from bounded_input import InputLimits
+from model_registry import ModelRegistry, active_models_dir, copy_model_files
+from ensemble_search import search_ensemble, evaluate as evaluate_ensemble
+import model_costs
 import warnings
 warnings.filterwarnings('ignore')
 
+# Where trained models are saved (array format in a subdirectory)
+MODELS_DIR = 'models'
+ARRAYS_SUBDIR = 'arrays'
+
+# Training needs pandas and sklearn's estimators, metrics and model_selection;
+# they are imported where they are used so that serving (app.py) starts without them
+
+# Ensemble weights and decision threshold used until learned ones are trained
+# (Random Forest gets highest weight)
+DEFAULT_ENSEMBLE_WEIGHTS = {
+    'naive_bayes': 0.20,
+    'svm': 0.25,
+    'random_forest': 0.35,
+    'logistic_regression': 0.20
+}
+DEFAULT_THRESHOLD = 0.5
+
+# Sample emails scored by warm_up before a server reports ready
+WARMUP_MESSAGES = [
+    {'subject': 'Congratulations! You won!',
+     'content': 'Click here to claim your FREE prize now!!! Call 0800 123 4567 or visit www.win-now.com'},
+    {'subject': 'Meeting Tomorrow', 'content': 'Hi team, reminder about our meeting at 10 AM.'}
+]
+
+def saved_models_exist(models_dir=MODELS_DIR):
+    """True if trained models were saved in either format (the active registry version, if any)"""
+    models_dir = active_models_dir(models_dir)
+    return (model_store.is_array_store(os.path.join(models_dir, ARRAYS_SUBDIR)) or
+            os.path.exists(os.path.join(models_dir, 'vectorizer.pkl')))
+
+def label_messages(df):
+    """
+    Normalize a dataset frame to Category, Messages and a binary label column
+    (0 = ham, 1 = spam); rows with missing values or unknown categories are dropped
+    """
+    # Check if columns exist
+    if 'Category' not in df.columns or 'Messages' not in df.columns:
+        # Try to handle different column names
+        if len(df.columns) >= 2:
+            df.columns = ['Category', 'Messages'] + list(df.columns[2:])
+        else:
+            raise ValueError("CSV must have at least 2 columns: Category and Messages")
+    
+    # Keep only required columns
+    df = df[['Category', 'Messages']]
+    
+    # Remove any NaN values
+    df = df.dropna()
+    
+    # Convert category to binary (0 = ham, 1 = spam)
+    df['label'] = df['Category'].map({'ham': 0, 'spam': 1})
+    
+    # Remove any rows where mapping failed
+    df = df.dropna(subset=['label'])
+    df['label'] = df['label'].astype(int)
+    
+    return df
+
+def split_dataset(df):
+    """
+    80/20 stratified train/test split of a labeled frame with processed_text
+    Returns X_train, X_test, raw_train, raw_test, y_train, y_test (processed
+    texts, raw messages for the hand-crafted features, labels)
+    """
+    from sklearn.model_selection import train_test_split
+    return train_test_split(
+        df['processed_text'], 
+        df['Messages'],
+        df['label'], 
+        test_size=0.2, 
+        random_state=42,
+        stratify=df['label']  # Maintain class distribution
+    )
+
+def reset_peak_rss():
+    """
+    Restart the peak resident memory count of this process (Linux: VmHWM,
+    see peak_rss_mb); returns False where it can't be reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB (None where unsupported)
+    since the last reset_peak_rss on Linux, since the process started elsewhere
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def fit_and_evaluate(model, X_train, y_train, X_test, y_test):
+    """
+    Fit one model and compute its metrics
+    Also records the fit time and the peak memory while fitting and evaluating
+    it (peak_rss_scope 'model'), or where the peak can't be reset, the peak of
+    the process so far ('process')
+    """
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
+    
+    # Train
+    scope = 'model' if reset_peak_rss() else 'process'
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+    
+    # Predict
+    y_pred_train = model.predict(X_train)
+    y_pred_test = model.predict(X_test)
+    
+    # Confusion matrix
+    cm = confusion_matrix(y_test, y_pred_test)
+    
+    return {
+        'train_accuracy': float(accuracy_score(y_train, y_pred_train)),
+        'test_accuracy': float(accuracy_score(y_test, y_pred_test)),
+        'precision': float(precision_score(y_test, y_pred_test)),
+        'recall': float(recall_score(y_test, y_pred_test)),
+        'f1_score': float(f1_score(y_test, y_pred_test)),
+        'confusion_matrix': cm.tolist(),
+        'fit_time_seconds': round(fit_time, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_scope': scope
+    }
+
+def print_model_results(metrics):
+    """Print the metrics computed by fit_and_evaluate"""
+    train_accuracy = metrics['train_accuracy']
+    test_accuracy = metrics['test_accuracy']
+    precision = metrics['precision']
+    recall = metrics['recall']
+    f1 = metrics['f1_score']
+    cm = metrics['confusion_matrix']
+    
+    print(f"  Training Accuracy:   {train_accuracy:.4f} ({train_accuracy*100:.2f}%)")
+    print(f"  Test Accuracy:       {test_accuracy:.4f} ({test_accuracy*100:.2f}%)")
+    print(f"  Precision:           {precision:.4f} ({precision*100:.2f}%)")
+    print(f"  Recall:              {recall:.4f} ({recall*100:.2f}%)")
+    print(f"  F1 Score:            {f1:.4f} ({f1*100:.2f}%)")
+    print(f"  Confusion Matrix:")
+    print(f"    True Neg:  {cm[0][0]}  |  False Pos: {cm[0][1]}")
+    print(f"    False Neg: {cm[1][0]}  |  True Pos:  {cm[1][1]}")
+    print(f"  Fit Time:            {metrics['fit_time_seconds']:.2f}s")
+    if metrics.get('peak_rss_mb') is not None:
+        scope = ' (process peak so far)' if metrics.get('peak_rss_scope') == 'process' else ''
+        print(f"  Peak Memory:         {metrics['peak_rss_mb']:.1f} MB{scope}")
+
+def split_holdout(y):
+    """
+    Halves of the held-out split: (search rows, check rows)
+    The ensemble weights are searched on the first half; everything measured
+    with them (their check, cascade validation, serving costs) uses the second
+    """
+    from sklearn.model_selection import train_test_split
+    y = np.asarray(y)
+    return train_test_split(np.arange(len(y)), test_size=0.5, random_state=42, stratify=y)
+
+def restrict_models(linear_models, packed_forest, models, names):
+    """Fused linear engine, packed forest and other estimators of the named models only"""
+    linear_models = linear_models.subset(names) if linear_models is not None else None
+    packed_forest = packed_forest if 'random_forest' in names else None
+    return linear_models, packed_forest, {name: model for name, model in models.items() if name in names}
+
+class ModelSet:
+    """
+    Snapshot of everything predictions need
+    Replaced as a whole (one reference swap) whenever models change, so a
+    request never sees a half-updated set of models
+    - ensemble_weights: weights of the models that score requests; a latency
+      budget leaves out some models (see SpamDetector.select_models), whose
+      engines stay in linear_models / packed_forest / models for online updates
+    - Models with a weight of 0 (e.g. learned weights that drop the forest)
+      don't score requests either
+    """
+    def __init__(self, version, vectorizer, models, linear_models, packed_forest, ensemble_weights,
+                 decision_threshold=DEFAULT_THRESHOLD, text_features=None, term_vectorizer=None):
+        self.version = version
+        self.vectorizer = vectorizer
+        # Serving vectorizer compiled from the fitted one (same output, see fast_vectorizer.py)
+        self.term_vectorizer = term_vectorizer or compile_vectorizer(vectorizer)
+        self.models = dict(models)
+        self.linear_models = linear_models
+        self.packed_forest = packed_forest
+        self.ensemble_weights = {name: weight for name, weight in ensemble_weights.items() if weight > 0}
+        self.decision_threshold = decision_threshold
+        self.text_features = text_features
+        
+        # Engines of the models in the ensemble
+        self.scoring_linear, self.scoring_forest, self.scoring_models = restrict_models(
+            linear_models, packed_forest, self.models, self.ensemble_weights
+        )
+    
+    def vectorize(self, texts, processed):
+        """
+        Model input for a batch: TF-IDF of the preprocessed texts, plus the
+        hand-crafted features of the raw texts when the models were trained with them
+        """
+        X = self.term_vectorizer.transform(processed)
+        if self.text_features is None:
+            return X
+        return stack_features(X, self.text_features.transform(texts))
+
 class SpamDetector:
-    def __init__(self):
+    def __init__(self, cache_size=10000, cache_ttl=None, metrics=None, cascade_band=None, campaigns=None,
+                 input_limits=None, latency_budget_ms=None):
         self.vectorizer = None
+        self.text_features = None
         self.models = {}
+        self.linear_models = None
+        self.packed_forest = None
         self.models_loaded = False
         self.training_stats = {}
         
-        # Spam patterns for additional detection
-        self.spam_patterns = [
-            r'\b(win|won|winner)\s+(money|\$|₹|prize|cash)',
-            r'\b(free|claim|collect)\s+(money|cash|reward|prize)',
-            r'\b(urgent|immediately|act\s+now)',
-            r'\b(click|verify|confirm)\s+(here|now|account)',
-            r'\b(account|password)\s+(suspended|blocked|verify)',
-            r'\blottery\b',
-            r'\bcongratulations?\b',
-            r'\bselected\b',
-            r'https?://[^\s]+',  # URLs
-        ]
+        # Directory the live models were loaded from or saved to (a registry version, see model_registry.py)
+        self.models_path = None
+        
+        # Cache of recent predictions, keyed on cleaned text + model version
+        self.prediction_cache = PredictionCache(cache_size, cache_ttl)
+        self.model_version = 0
+        
+        # Stage/model timings (off unless a Metrics registry is passed in)
+        self.metrics = metrics or Metrics(enabled=False)
+        
+        # Cascade mode: skip the random forest when the linear models are confident
+        # (band = (low, high) of the linear ensemble that still needs the forest)
+        self.cascade_band = tuple(cascade_band) if cascade_band is not None else None
+        self.cascade_stats = cascade.CascadeStats()
+        
+        # Campaign index: near-duplicates of known spam are answered without the models
+        # (campaigns = CampaignIndex settings to turn lookups on, None = off)
+        self.campaign_settings = dict(campaigns) if campaigns is not None else None
+        self.campaign_index = CampaignIndex(**self.campaign_settings) if campaigns is not None else None
+        
+        # Cleaning and head/tail windows applied to every message before scoring
+        self.input_limits = input_limits or InputLimits()
+        
+        # Latency budget: serve the most accurate combination of models whose measured
+        # single-message latency fits it (None = all models; see select_models)
+        self.latency_budget_ms = latency_budget_ms
+        self.model_subset = None
+        
+        # Models used for predictions (see publish_models)
+        self.model_set = None
+        
+        # Held while replacing the live models (retraining, online updates)
+        self.swap_lock = threading.RLock()
+        
+        # Spam patterns for additional detection (compiled once)
+        self.pattern_matcher = SpamPatternMatcher()
+        
+        # Ensemble weights and spam threshold (learned by train_models)
+        self.ensemble_weights = dict(DEFAULT_ENSEMBLE_WEIGHTS)
+        self.decision_threshold = DEFAULT_THRESHOLD
     
     def preprocess_text(self, text):
         """
@@ -45,7 +302,7 @@ class SpamDetector:
         - Remove extra whitespace
         - Keep special characters for pattern matching
         """
-        if pd.isna(text):
+        if text is None or (isinstance(text, float) and text != text):  # missing (None/NaN)
             return ""
         
         # Convert to string and lowercase
@@ -56,39 +313,28 @@ class SpamDetector:
         
         return text
     
+    def prepare_messages(self, messages):
+        """
+        Combined subject + content texts of a batch of message dicts, cleaned and
+        cut to the input limits (see bounded_input.py), and what was done to each
+        """
+        prepared = [self.input_limits.prepare(m) for m in messages]
+        return [text for text, _ in prepared], [info for _, info in prepared]
+    
     def extract_features(self, text):
-        """Extract additional features beyond TF-IDF"""
-        features = {}
-        
-        # Length features
-        features['char_count'] = len(text)
-        features['word_count'] = len(text.split())
-        features['avg_word_length'] = np.mean([len(word) for word in text.split()]) if text.split() else 0
-        
-        # Special character features
-        features['exclamation_count'] = text.count('!')
-        features['question_count'] = text.count('?')
-        features['dollar_count'] = text.count('$')
-        features['rupee_count'] = text.count('₹')
-        
-        # Capital letters ratio
-        if len(text) > 0:
-            features['caps_ratio'] = sum(1 for c in text if c.isupper()) / len(text)
-        else:
-            features['caps_ratio'] = 0
-        
-        # URL count
-        features['url_count'] = len(re.findall(r'https?://[^\s]+', text))
-        
-        return features
+        """
+        Extract additional features beyond TF-IDF (unscaled, for one raw text)
+        The models get them for whole batches through text_features.TextFeatures
+        """
+        return dict(zip(FEATURE_NAMES, batch_features([text])[0].tolist()))
     
     def detect_patterns(self, text):
-        """Detect spam patterns in text"""
-        patterns_found = []
-        for pattern in self.spam_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                patterns_found.append(pattern)
-        return patterns_found
+        """Detect spam patterns in text (returns pattern descriptions)"""
+        return self.pattern_matcher.match(text)
+    
+    def detect_patterns_batch(self, texts):
+        """Detect spam patterns in each text of a batch"""
+        return self.pattern_matcher.match_batch(texts)
     
     def load_dataset(self, csv_path):
         """
@@ -96,31 +342,11 @@ class SpamDetector:
         Expected format: Category, Messages
         Category values: 'ham' or 'spam'
         """
+        import pandas as pd
         print(f"Loading dataset from: {csv_path}")
         
         # Read CSV file
-        df = pd.read_csv(csv_path, encoding='latin-1')
-        
-        # Check if columns exist
-        if 'Category' not in df.columns or 'Messages' not in df.columns:
-            # Try to handle different column names
-            if len(df.columns) >= 2:
-                df.columns = ['Category', 'Messages'] + list(df.columns[2:])
-            else:
-                raise ValueError("CSV must have at least 2 columns: Category and Messages")
-        
-        # Keep only required columns
-        df = df[['Category', 'Messages']]
-        
-        # Remove any NaN values
-        df = df.dropna()
-        
-        # Convert category to binary (0 = ham, 1 = spam)
-        df['label'] = df['Category'].map({'ham': 0, 'spam': 1})
-        
-        # Remove any rows where mapping failed
-        df = df.dropna(subset=['label'])
-        df['label'] = df['label'].astype(int)
+        df = label_messages(pd.read_csv(csv_path, encoding='latin-1'))
         
         print(f"Dataset loaded: {len(df)} emails")
         print(f"  - Ham (legitimate): {(df['label'] == 0).sum()}")
@@ -128,33 +354,48 @@ class SpamDetector:
         
         return df
     
-    def train_models(self, dataset_path):
-        """Train all ML models"""
+    def train_models(self, dataset_path, progress=None, models_dir=MODELS_DIR, parallel=False, n_workers=None,
+                     ensemble_objective='f1', min_precision=None, activate=True):
+        """
+        Train all ML models and save them as a new version in the registry of models_dir
+        - progress: optional callback(fraction, stage) for status reporting
+        - parallel: fit the models concurrently in a process pool of n_workers
+          (default: one per model) that memory-maps the TF-IDF matrices
+        - ensemble_objective: what the learned ensemble weights and threshold
+          maximize ('f1', or 'precision' = best recall with precision >=
+          min_precision); None keeps the default weights and 0.5
+        - activate: make the new version the one served (see register_models)
+        - Each model's latency and size are measured on the test split (see measure_costs)
+        - Predictions keep using the previous models until training finishes
+        """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        from sklearn.svm import SVC
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.linear_model import LogisticRegression
+        report = progress or (lambda fraction, stage: None)
+        
         print("\n" + "=" * 60)
         print("TRAINING SPAM DETECTION MODELS")
         print("=" * 60)
         
         # Load dataset
+        report(0.0, 'loading dataset')
         df = self.load_dataset(dataset_path)
         
         # Preprocess
         print("\nPreprocessing text...")
         df['processed_text'] = df['Messages'].apply(self.preprocess_text)
         
-        # Split data
+        # Split data (raw messages too, for the hand-crafted features)
         print("Splitting data (80% train, 20% test)...")
-        X_train, X_test, y_train, y_test = train_test_split(
-            df['processed_text'], 
-            df['label'], 
-            test_size=0.2, 
-            random_state=42,
-            stratify=df['label']  # Maintain class distribution
-        )
+        X_train, X_test, raw_train, raw_test, y_train, y_test = split_dataset(df)
         
         print(f"Training set: {len(X_train)} emails")
         print(f"Test set: {len(X_test)} emails")
         
         # Vectorize using TF-IDF
+        report(0.1, 'vectorizing')
         print("\nVectorizing text with TF-IDF...")
         self.vectorizer = TfidfVectorizer(
             max_features=3000,
@@ -167,7 +408,12 @@ class SpamDetector:
         X_train_vec = self.vectorizer.fit_transform(X_train)
         X_test_vec = self.vectorizer.transform(X_test)
         
-        print(f"Feature vector shape: {X_train_vec.shape}")
+        # Hand-crafted features of the raw text as extra columns (scaled on the training split)
+        self.text_features = TextFeatures().fit(raw_train.tolist())
+        X_train_vec = stack_features(X_train_vec, self.text_features.transform(raw_train.tolist()))
+        X_test_vec = stack_features(X_test_vec, self.text_features.transform(raw_test.tolist()))
+        
+        print(f"Feature vector shape: {X_train_vec.shape} (TF-IDF + {len(FEATURE_NAMES)} text features)")
         
         # Initialize models
         self.models = {
@@ -194,62 +440,144 @@ class SpamDetector:
         
         results = {}
         
-        for name, model in self.models.items():
-            print(f"\nTraining {name.replace('_', ' ').title()}...")
-            
-            # Train
-            model.fit(X_train_vec, y_train)
-            
-            # Predict
-            y_pred_train = model.predict(X_train_vec)
-            y_pred_test = model.predict(X_test_vec)
-            
-            # Calculate metrics
-            train_accuracy = accuracy_score(y_train, y_pred_train)
-            test_accuracy = accuracy_score(y_test, y_pred_test)
-            precision = precision_score(y_test, y_pred_test)
-            recall = recall_score(y_test, y_pred_test)
-            f1 = f1_score(y_test, y_pred_test)
+        if parallel:
+            # Fit all models at once in worker processes sharing the TF-IDF matrices
+            from parallel_training import train_parallel
+            report(0.2, 'training models in parallel')
+            print(f"\nTraining {len(self.models)} models in parallel...")
             
-            # Confusion matrix
-            cm = confusion_matrix(y_test, y_pred_test)
+            def model_done(name, model, metrics):
+                self.models[name] = model
+                results[name] = metrics
+                report(0.2 + 0.7 * len(results) / len(self.models), f'trained {name}')
+                print(f"\n{name.replace('_', ' ').title()}:")
+                print_model_results(metrics)
             
-            results[name] = {
-                'train_accuracy': float(train_accuracy),
-                'test_accuracy': float(test_accuracy),
-                'precision': float(precision),
-                'recall': float(recall),
-                'f1_score': float(f1),
-                'confusion_matrix': cm.tolist()
-            }
-            
-            print(f"  Training Accuracy:   {train_accuracy:.4f} ({train_accuracy*100:.2f}%)")
-            print(f"  Test Accuracy:       {test_accuracy:.4f} ({test_accuracy*100:.2f}%)")
-            print(f"  Precision:           {precision:.4f} ({precision*100:.2f}%)")
-            print(f"  Recall:              {recall:.4f} ({recall*100:.2f}%)")
-            print(f"  F1 Score:            {f1:.4f} ({f1*100:.2f}%)")
-            print(f"  Confusion Matrix:")
-            print(f"    True Neg:  {cm[0][0]}  |  False Pos: {cm[0][1]}")
-            print(f"    False Neg: {cm[1][0]}  |  True Pos:  {cm[1][1]}")
+            train_parallel(self.models, X_train_vec, y_train, X_test_vec, y_test,
+                           n_workers=n_workers, on_result=model_done)
+            results = {name: results[name] for name in self.models}
+        else:
+            for i, (name, model) in enumerate(self.models.items()):
+                report(0.2 + 0.7 * i / len(self.models), f'training {name}')
+                print(f"\nTraining {name.replace('_', ' ').title()}...")
+                
+                # Train and evaluate
+                results[name] = fit_and_evaluate(model, X_train_vec, y_train, X_test_vec, y_test)
+                print_model_results(results[name])
+        
+        # Build the fast inference engines
+        self.export_fast_models()
+        
+        # Held-out probabilities of every model, computed once for the ensemble search
+        # and the cascade validation
+        probabilities = self.holdout_probabilities(X_test_vec)
+        
+        # Learn the ensemble weights and decision threshold
+        report(0.9, 'learning ensemble weights')
+        ensemble = self.learn_ensemble(probabilities, y_test, ensemble_objective, min_precision)
+        
+        # The rest is measured on the rows the weights weren't searched on
+        _, check_rows = split_holdout(y_test)
+        check_probabilities = {name: p[check_rows] for name, p in probabilities.items()}
+        y_check = np.asarray(y_test)[check_rows]
+        
+        # How much accuracy the cascade gives up on the held-out split
+        cascade_validation = self.validate_cascade(check_probabilities, y_check)
+        
+        # What each model costs at serving time, alone and combined with the others
+        report(0.9, 'measuring serving costs')
+        costs = self.measure_costs(raw_test.iloc[check_rows].tolist(), X_test_vec[check_rows],
+                                   check_probabilities, y_check)
+        
+        # Index the spam of the dataset as known campaigns
+        report(0.9, 'indexing spam campaigns')
+        spam = df[df['label'] == 1]
+        self.campaign_index = self.seed_campaigns(spam['Messages'].tolist(), spam['processed_text'].tolist())
         
         # Store training statistics
         self.training_stats = {
+            'cascade_validation': cascade_validation,
+            'ensemble': ensemble,
+            'costs': costs,
             'dataset_size': len(df),
             'train_size': len(X_train),
             'test_size': len(X_test),
             'spam_count': int((df['label'] == 1).sum()),
             'ham_count': int((df['label'] == 0).sum()),
             'feature_count': X_train_vec.shape[1],
+            'text_features': list(FEATURE_NAMES),
             'results': results
         }
         
         # Save models
+        report(0.9, 'saving models')
         print("\n" + "=" * 60)
         print("SAVING MODELS")
         print("=" * 60)
-        self.save_models()
+        self.register_models(models_dir, dataset_path, activate)
         
-        self.models_loaded = True
+        self.publish_models()
+        report(1.0, 'completed')
+        
+        print("\n✓ Training completed successfully!")
+        print("=" * 60 + "\n")
+        
+        return results
+    
+    def train_streaming(self, dataset_path, progress=None, models_dir=MODELS_DIR, chunk_size=10000,
+                        n_features=2 ** 18, epochs=1, reservoir_size=20000, activate=True):
+        """
+        Train all ML models out of core and save them as a new registry version of models_dir
+        - The CSV is read chunk_size rows at a time and never held in memory
+        - Hashed TF-IDF features (n_features columns) replace the fitted vocabulary
+        - Naive Bayes and SGD-based SVM / Logistic Regression learn with partial_fit;
+          the random forest is fit on a random sample of reservoir_size rows
+        - Metrics come from a hash-based 20% holdout, evaluated chunk by chunk
+        """
+        from streaming_training import train_streaming
+        report = progress or (lambda fraction, stage: None)
+        
+        print("\n" + "=" * 60)
+        print("TRAINING SPAM DETECTION MODELS (STREAMING)")
+        print("=" * 60)
+        print(f"Reading {dataset_path} in chunks of {chunk_size} rows")
+        
+        trained = train_streaming(
+            dataset_path, self.preprocess_text,
+            chunk_size=chunk_size, n_features=n_features, epochs=epochs,
+            reservoir_size=reservoir_size, report=report
+        )
+        self.vectorizer = trained['vectorizer']
+        self.text_features = None
+        self.models = trained['models']
+        self.ensemble_weights = dict(DEFAULT_ENSEMBLE_WEIGHTS)
+        self.decision_threshold = DEFAULT_THRESHOLD
+        results = trained['results']
+        
+        for name, metrics in results.items():
+            print(f"\n{name.replace('_', ' ').title()}:")
+            print_model_results(metrics)
+        
+        # Build the fast inference engines
+        self.export_fast_models()
+        
+        # Store training statistics
+        self.training_stats = dict(
+            trained['counts'],
+            feature_count=n_features,
+            vectorization='Hashed TF-IDF',
+            results=results
+        )
+        
+        # Save models
+        report(0.9, 'saving models')
+        print("\n" + "=" * 60)
+        print("SAVING MODELS")
+        print("=" * 60)
+        self.register_models(models_dir, dataset_path, activate, source='streaming')
+        
+        self.publish_models()
+        report(1.0, 'completed')
         
         print("\n✓ Training completed successfully!")
         print("=" * 60 + "\n")
@@ -258,100 +586,698 @@ class SpamDetector:
     
     def predict_all(self, subject, content):
         """Get predictions from all models"""
-        if not self.models_loaded:
+        return self.predict_batch([{'subject': subject, 'content': content}])[0]
+    
+    def predict_batch(self, messages):
+        """
+        Get predictions from all models for a batch of emails
+        - Each message is a dict with 'subject' and 'content' keys
+        - Vectorizes the whole batch once and calls predict_proba once per model
+        - Repeated texts are answered from the prediction cache
+        - Large and HTML bodies are cleaned and cut first; each result's 'input'
+          says how (see bounded_input.InputLimits.clean)
+        - Returns one predict_all-style result per message, in order
+        """
+        # Use one snapshot of the models for the whole batch
+        model_set = self.model_set
+        if model_set is None:
             raise Exception("Models not loaded. Please train or load models first.")
         
-        # Combine subject and content
-        text = f"{subject} {content}"
-        processed = self.preprocess_text(text)
+        if not messages:
+            return []
+        
+        timer = self.metrics.timer()
+        
+        # Combine subject and content (cleaned, at most the head and tail windows of each)
+        texts, inputs = self.prepare_messages(messages)
+        processed = [self.preprocess_text(text) for text in texts]
+        timer.mark('preprocess')
+        
+        if self.metrics.enabled:
+            self.metrics.inc('spam_messages_total', len(texts))
+            self.metrics.observe_many('spam_input_chars', [info['original_chars'] for info in inputs])
+            self.metrics.inc('spam_input_truncated_total', sum(info['truncated'] for info in inputs))
+        
+        # Look up cached predictions; identical texts in the batch are scored once
+        # (keyed on the cleaned text, not the preprocessed one: the text features
+        # and patterns read case and punctuation, which preprocessing drops)
+        results = [None] * len(texts)
+        pending = {}
+        for i, text in enumerate(texts):
+            key = text_key(text, model_set.version)
+            cached = self.prediction_cache.get(key)
+            if cached is not None:
+                results[i] = dict(cached, patterns=list(cached['patterns']))
+            else:
+                pending.setdefault(key, []).append(i)
+        timer.mark('cache_lookup')
+        
+        # Near-duplicates of known spam campaigns take the campaign's verdict
+        campaigns = self.campaign_index if self.campaign_settings is not None else None
+        if pending and campaigns is not None:
+            hits = 0
+            for key, indices in list(pending.items()):
+                match = campaigns.lookup(processed[indices[0]])
+                if match is None:
+                    continue
+                result = self.campaign_result(model_set, match, texts[indices[0]])
+                self.prediction_cache.put(key, result)
+                for i in indices:
+                    results[i] = dict(result, patterns=list(result['patterns']))
+                del pending[key]
+                hits += 1
+            self.metrics.inc('spam_campaign_hits_total', hits)
+            timer.mark('campaign_lookup')
+        
+        if pending:
+            first = [indices[0] for indices in pending.values()]
+            scored = self.score_batch(model_set, [texts[i] for i in first], [processed[i] for i in first], timer)
+            for (key, indices), result in zip(pending.items(), scored):
+                self.prediction_cache.put(key, result)
+                for i in indices:
+                    results[i] = dict(result, patterns=list(result['patterns']))
+                
+                # Confident spam verdicts start (or refresh) a campaign
+                if campaigns is not None and result['ensemble'] >= campaigns.min_score:
+                    campaigns.add(processed[indices[0]], result['ensemble'],
+                                  {name: result[name] for name in DEFAULT_ENSEMBLE_WEIGHTS})
+        
+        # Cached results are shared by texts that only match after cleaning (e.g. the same
+        # body with and without HTML markup): set each message's own
+        for result, info in zip(results, inputs):
+            result['input'] = info
+        
+        return results
+    
+    def campaign_result(self, model_set, match, text):
+        """predict_all-style result for a message matching a known campaign (see CampaignIndex.lookup)"""
+        result = dict(match['probabilities'])
+        result['ensemble'] = match['score']
+        result['is_spam'] = bool(match['score'] >= model_set.decision_threshold)
+        result['models_run'] = []
+        result['patterns'] = self.detect_patterns(text)
+        result['campaign'] = {'id': match['id'], 'similarity': match['similarity'], 'source': match['source']}
+        return result
+    
+    def seed_campaigns(self, spam_texts, processed):
+        """
+        Campaign index of labeled spam (raw and preprocessed texts), with the
+        models' probabilities for each message and a score of 1.0
+        """
+        start = time.perf_counter()
+        index = CampaignIndex(**(self.campaign_settings or {}))
+        X = self.vectorizer.transform(processed)
+        if self.text_features is not None:
+            X = stack_features(X, self.text_features.transform(spam_texts))
+        probabilities = self.holdout_probabilities(X)
+        for i, text in enumerate(processed):
+            index.add(text, 1.0, {name: float(p[i]) for name, p in probabilities.items()}, source='dataset')
+        print(f"\nCampaign index: {len(index)} campaigns from {len(processed)} spam emails "
+              f"({time.perf_counter() - start:.2f}s)")
+        return index
+    
+    def score_batch(self, model_set, texts, processed, timer=NULL_TIMER, record=True):
+        """
+        Run all models of a ModelSet on a batch of combined texts (raw and preprocessed)
+        - timer: StageTimer that records the time of each stage and model
+        - record: count the rows in the cascade stats and metrics
+        - In cascade mode the random forest (and any other model outside the
+          fused linear engine) only runs on rows where the linear models'
+          ensemble falls inside the cascade band; other rows exit early
+        """
+        # Vectorize (TF-IDF + hand-crafted features)
+        text_vec = model_set.vectorize(texts, processed)
+        timer.mark('vectorize')
+        n_rows = text_vec.shape[0]
+        
+        # Get spam probabilities from each model for the whole batch
+        # (linear models are scored together by the fused engine,
+        # random forest by the packed forest)
+        probabilities = {}
+        if model_set.scoring_linear is not None:
+            probabilities.update(model_set.scoring_linear.predict_proba(text_vec))
+            timer.mark_model('fused_linear')
+        first_stage = list(probabilities)
+        
+        # Cascade: rows the linear models are unsure about go on to the other models
+        run = np.ones(n_rows, dtype=bool)
+        partial = None
+        band = self.cascade_band
+        if band is not None and first_stage:
+            partial = cascade.partial_ensemble(probabilities, model_set.ensemble_weights)
+            run = cascade.uncertain(partial, band)
+            if record:
+                exits = int(n_rows - run.sum())
+                self.cascade_stats.record(n_rows, exits)
+                self.metrics.inc('spam_cascade_rows_total', n_rows)
+                self.metrics.inc('spam_cascade_early_exits_total', exits)
+        rows = np.flatnonzero(run)
+        rest_vec = text_vec if run.all() else text_vec[rows]
+        
+        second_stage = {}
+        if model_set.scoring_forest is not None:
+            second_stage['random_forest'] = lambda X: model_set.scoring_forest.predict_proba(X)
+        for name, model in model_set.scoring_models.items():
+            if name not in probabilities and name not in second_stage:
+                second_stage[name] = lambda X, model=model: model.predict_proba(X)[:, 1]
+        
+        for name, predict in second_stage.items():
+            scores = np.full(n_rows, np.nan)
+            if len(rows):
+                scores[rows] = predict(rest_vec)
+            probabilities[name] = scores
+            timer.mark_model(name)
+        
+        # Ensemble prediction (weighted average - Random Forest gets highest weight)
+        ensemble = sum(probabilities[name] * weight for name, weight in model_set.ensemble_weights.items())
+        if partial is not None:
+            ensemble = np.where(run, ensemble, partial)
+        timer.mark('ensemble')
         
         # Detect patterns
-        patterns = self.detect_patterns(text)
-        pattern_descriptions = [
-            'win money', 'free money', 'urgent', 'click here', 
-            'account suspended', 'lottery', 'congratulations', 
-            'selected', 'contains URL'
-        ]
-        detected = [pattern_descriptions[i] for i, p in enumerate(self.spam_patterns) if re.search(p, text, re.IGNORECASE)]
-        
-        # Vectorize
-        text_vec = self.vectorizer.transform([processed])
-        
-        # Get predictions from each model
-        predictions = {}
+        patterns = self.detect_patterns_batch(texts)
+        timer.mark('patterns')
+        
+        results = []
+        for i, detected in enumerate(patterns):
+            result = {
+                name: (float(probabilities[name][i]) if name in probabilities and (run[i] or name in first_stage)
+                       else None)
+                for name in ['naive_bayes', 'svm', 'random_forest', 'logistic_regression']
+            }
+            result['ensemble'] = float(ensemble[i])
+            result['is_spam'] = bool(ensemble[i] >= model_set.decision_threshold)
+            result['models_run'] = first_stage + list(second_stage) if run[i] else list(first_stage)
+            result['patterns'] = detected
+            result['campaign'] = None
+            results.append(result)
+        
+        return results
+    
+    def warm_up(self, messages=WARMUP_MESSAGES):
+        """
+        Score sample emails so the first real request doesn't pay one-time costs
+        (vectorizer set-up, first touches of memory-mapped model arrays, lazy
+        initialization inside NumPy/SciPy)
+        - Bypasses the prediction cache, stats and metrics
+        Returns the time taken in seconds
+        """
+        model_set = self.model_set
+        if model_set is None:
+            return 0.0
+        
+        start = time.perf_counter()
+        
+        # Read memory-mapped weights once so their pages are resident
+        if model_set.linear_models is not None and isinstance(model_set.linear_models.weights, np.memmap):
+            np.asarray(model_set.linear_models.weights).sum()
+        
+        # A single email and a batch take different paths through the sparse code
+        texts, _ = self.prepare_messages(messages)
+        processed = [self.preprocess_text(text) for text in texts]
+        for i in range(len(texts)):
+            self.score_batch(model_set, texts[i:i + 1], processed[i:i + 1], record=False)
+        self.score_batch(model_set, texts, processed, record=False)
+        
+        return time.perf_counter() - start
+    
+    def holdout_probabilities(self, X):
+        """Spam probabilities of every model on vectorized held-out data, from the fast engines"""
+        probabilities = {}
+        if self.linear_models is not None:
+            probabilities.update(self.linear_models.predict_proba(X))
+        if self.packed_forest is not None:
+            probabilities['random_forest'] = self.packed_forest.predict_proba(X)
         for name, model in self.models.items():
-            pred_proba = model.predict_proba(text_vec)[0]
-            predictions[name] = float(pred_proba[1])  # Probability of spam
+            if name not in probabilities:
+                probabilities[name] = model.predict_proba(X)[:, 1]
+        return probabilities
+    
+    def learn_ensemble(self, probabilities, y, objective='f1', min_precision=None):
+        """
+        Choose the ensemble weights and decision threshold from held-out probabilities
+        - The held-out split is halved: weights and threshold are searched on
+          one half (see ensemble_search) and checked on the other against the defaults
+        - The learned values are kept only if they do at least as well as the
+          defaults on the check half, and meet the precision floor there
+        Returns the search report stored in training_stats['ensemble']
+        """
+        self.ensemble_weights = dict(DEFAULT_ENSEMBLE_WEIGHTS)
+        self.decision_threshold = DEFAULT_THRESHOLD
+        if objective is None:
+            return {}
         
-        # Ensemble prediction (weighted average - Random Forest gets highest weight)
-        ensemble = (
-            predictions['naive_bayes'] * 0.20 +
-            predictions['svm'] * 0.25 +
-            predictions['random_forest'] * 0.35 +
-            predictions['logistic_regression'] * 0.20
+        y = np.asarray(y)
+        search_rows, check_rows = split_holdout(y)
+        names = [name for name in DEFAULT_ENSEMBLE_WEIGHTS if name in probabilities]
+        search_probabilities = {name: probabilities[name][search_rows] for name in names}
+        check_probabilities = {name: probabilities[name][check_rows] for name in names}
+        
+        try:
+            found = search_ensemble(
+                search_probabilities, y[search_rows], objective, min_precision,
+                prior_weights=DEFAULT_ENSEMBLE_WEIGHTS
+            )
+        except ValueError as e:
+            print(f"\n✗ Ensemble search failed, keeping the default weights: {e}")
+            return {'objective': objective, 'min_precision': min_precision, 'adopted': False, 'error': str(e)}
+        
+        default = evaluate_ensemble(check_probabilities, y[check_rows], DEFAULT_ENSEMBLE_WEIGHTS,
+                                    DEFAULT_THRESHOLD, objective, min_precision)
+        learned = evaluate_ensemble(check_probabilities, y[check_rows], found['weights'],
+                                    found['threshold'], objective, min_precision)
+        # A score of -1 means the floor was missed: two misses tie without either being good
+        adopted = learned['score'] >= default['score'] and learned['score'] >= 0
+        if adopted:
+            self.ensemble_weights = dict(found['weights'])
+            self.decision_threshold = found['threshold']
+        
+        print(f"\nEnsemble search ({found['combinations']} weightings, {found['search_ms']:.0f} ms, objective: {objective}):")
+        print("  Weights: " + ", ".join(f"{name} {weight:.2f}" for name, weight in found['weights'].items()))
+        print(f"  Threshold: {found['threshold']:.3f}")
+        for label, metrics in (('Default', default), ('Learned', learned)):
+            print(f"  {label}: precision {metrics['precision']*100:.2f}%, recall {metrics['recall']*100:.2f}%, "
+                  f"F1 {metrics['f1_score']*100:.2f}% (check half)")
+        if adopted:
+            print("  ✓ Using learned weights")
+        elif learned['score'] < 0:
+            print(f"  Keeping default weights (learned ones miss precision {min_precision} on the check half)")
+        else:
+            print("  Keeping default weights (learned ones did worse)")
+        
+        return dict(found, default=default, learned=learned, adopted=adopted)
+    
+    def validate_cascade(self, probabilities, y):
+        """
+        Compare cascade mode with the full ensemble on held-out probabilities
+        (see holdout_probabilities) for a few uncertainty bands (see cascade.validate_bands)
+        Only models with a weight score requests: without a weighted model
+        after the linear ones, the cascade has nothing to skip
+        """
+        weights = {name: weight for name, weight in self.ensemble_weights.items() if weight > 0}
+        if self.linear_models is None or weights.get('random_forest', 0) <= 0 or 'random_forest' not in probabilities:
+            if 'random_forest' in self.ensemble_weights and 'random_forest' not in weights:
+                print("\nCascade validation: skipped (the random forest has a weight of 0 and never runs)")
+            return []
+        
+        first_stage = [name for name in self.linear_models.names if name in weights]
+        if not first_stage:
+            return []
+        results = cascade.validate_bands(probabilities, weights, first_stage, y,
+                                         threshold=self.decision_threshold)
+        
+        print("\nCascade validation (held-out split):")
+        for r in results:
+            print(f"  band {r['band'][0]:.2f}-{r['band'][1]:.2f}: early exit {r['early_exit_rate']*100:.1f}%, "
+                  f"accuracy {r['accuracy']*100:.2f}% (full {r['full_accuracy']*100:.2f}%), "
+                  f"agreement {r['agreement']*100:.2f}%")
+        return results
+    
+    def measure_costs(self, raw_texts, X, probabilities, y):
+        """
+        Serving cost of each model on the test split (see model_costs.py)
+        - raw_texts / X: test messages and their vectorized rows
+        - Per model: single-message and batch latency of its serving engine,
+          memory of that engine and size of the pickled estimator
+        - shared: cleaning, preprocessing, vectorizing and pattern detection,
+          paid by every request whatever models run
+        - subsets: every combination of models with its single-message latency
+          and its test accuracy, weights renormalized (for select_models)
+        Returns the report stored in training_stats['costs']
+        """
+        start = time.perf_counter()
+        n_single = min(model_costs.SINGLE_ROWS, X.shape[0])
+        rows = [X[i:i + 1] for i in range(n_single)]
+        names = [name for name in DEFAULT_ENSEMBLE_WEIGHTS if name in probabilities]
+        
+        def make_predict(subset):
+            linear_models, packed_forest, models = restrict_models(
+                self.linear_models, self.packed_forest, self.models, subset
+            )
+            scored = set(linear_models.names if linear_models is not None else [])
+            if packed_forest is not None:
+                scored.add('random_forest')
+            others = [model for name, model in models.items() if name not in scored]
+            
+            def predict(X):
+                if linear_models is not None:
+                    linear_models.predict_proba(X)
+                if packed_forest is not None:
+                    packed_forest.predict_proba(X)
+                for model in others:
+                    model.predict_proba(X)
+            return predict
+        
+        # Stages every request pays, from the raw message to the model input
+        model_set = ModelSet(0, self.vectorizer, {}, None, None, {}, text_features=self.text_features)
+        messages = [{'subject': '', 'content': text} for text in raw_texts]
+        
+        def shared(batch):
+            texts, _ = self.prepare_messages(batch)
+            model_set.vectorize(texts, [self.preprocess_text(text) for text in texts])
+            self.detect_patterns_batch(texts)
+        
+        shared_cost = model_costs.latency_report(
+            shared, [messages[i:i + 1] for i in range(n_single)], messages, len(messages)
         )
         
-        return {
-            'naive_bayes': predictions['naive_bayes'],
-            'svm': predictions['svm'],
-            'random_forest': predictions['random_forest'],
-            'logistic_regression': predictions['logistic_regression'],
-            'ensemble': float(ensemble),
-            'patterns': detected
+        models = {}
+        for name in names:
+            linear_models, packed_forest, estimators = restrict_models(
+                self.linear_models, self.packed_forest, self.models, [name]
+            )
+            if linear_models is not None:
+                memory = linear_models.weights.nbytes + linear_models.intercepts.nbytes
+            elif packed_forest is not None:
+                memory = packed_forest.nbytes()
+            else:
+                memory = model_costs.pickled_bytes(estimators.get(name)) or 0
+            models[name] = dict(
+                model_costs.latency_report(make_predict([name]), rows, X, X.shape[0]),
+                memory_bytes=int(memory),
+                pickle_bytes=model_costs.pickled_bytes(self.models.get(name))
+            )
+        
+        subsets = model_costs.measure_subsets(
+            make_predict, names, rows, probabilities, y, self.ensemble_weights,
+            self.decision_threshold, shared_cost['single_ms']
+        )
+        costs = {
+            'rows': int(X.shape[0]),
+            'single_rows': n_single,
+            'shared': shared_cost,
+            'models': models,
+            'subsets': subsets,
+            'seconds': round(time.perf_counter() - start, 2)
         }
+        model_costs.print_costs(costs)
+        return costs
+    
+    def select_models(self):
+        """
+        Ensemble weights to serve with: all models, or with a latency budget the
+        most accurate combination measured by measure_costs whose estimated
+        single-message latency fits it, weights renormalized over it
+        Records the choice in self.model_subset (for /api/stats)
+        """
+        self.model_subset = None
+        if self.latency_budget_ms is None:
+            return self.ensemble_weights
+        
+        costs = self.training_stats.get('costs')
+        if not costs:
+            self.model_subset = {'budget_ms': self.latency_budget_ms, 'models': list(self.ensemble_weights),
+                                 'error': 'No cost measurements for these models (retrain to measure them)'}
+            return self.ensemble_weights
+        
+        chosen = model_costs.choose_subset(costs, self.latency_budget_ms)
+        weights = model_costs.renormalize(self.ensemble_weights, chosen['models'])
+        self.model_subset = dict(chosen, budget_ms=self.latency_budget_ms, weights=weights)
+        return weights
+    
+    def set_latency_budget(self, budget_ms):
+        """
+        Serve the combination of models that fits a per-request latency budget
+        (ms), or all models with None; republishes the live models
+        """
+        if budget_ms is not None and budget_ms <= 0:
+            raise ValueError(f"Latency budget must be positive (got {budget_ms})")
+        with self.swap_lock:
+            self.latency_budget_ms = budget_ms
+            if self.model_set is not None:
+                self.publish_models()
+    
+    def set_cascade(self, band):
+        """
+        Turn cascade mode on with an uncertainty band (low, high), or off with None
+        Cached predictions are dropped, since they were made in the other mode
+        """
+        self.cascade_band = tuple(band) if band is not None else None
+        self.prediction_cache.clear()
+    
+    def publish_models(self):
+        """
+        Make the current models live for predictions
+        - Swaps in a new ModelSet in one assignment
+        - With a latency budget, only the models chosen by select_models score
+        - Starts a new model version: cached predictions no longer apply
+        """
+        self.model_version += 1
+        # Same vectorizer (e.g. an online update): keep its compiled serving vectorizer
+        previous = self.model_set
+        term_vectorizer = previous.term_vectorizer if previous is not None and previous.vectorizer is self.vectorizer else None
+        self.model_set = ModelSet(
+            self.model_version, self.vectorizer, self.models,
+            self.linear_models, self.packed_forest, self.select_models(),
+            self.decision_threshold, self.text_features, term_vectorizer
+        )
+        self.models_loaded = True
+        self.prediction_cache.clear()
+    
+    def adopt_models(self, other):
+        """Take over the models of another (trained or loaded) detector and publish them"""
+        with self.swap_lock:
+            self.vectorizer = other.vectorizer
+            self.text_features = other.text_features
+            self.models = other.models
+            self.linear_models = other.linear_models
+            self.packed_forest = other.packed_forest
+            self.ensemble_weights = other.ensemble_weights
+            self.decision_threshold = other.decision_threshold
+            self.training_stats = other.training_stats
+            self.models_path = other.models_path
+            if self.campaign_settings is not None and other.campaign_index is not None:
+                self.campaign_index = other.campaign_index
+            self.publish_models()
+    
+    def export_fast_models(self, compact=False):
+        """
+        Build the fast inference engines from the trained models
+        - Naive Bayes, Logistic Regression and linear SVM coefficients are
+          packed into one weight matrix and scored with a single product
+        - Random Forest trees are flattened into NumPy node arrays
+        - compact: float32 weights and forest arrays (see compact_models.py)
+        """
+        self.linear_models = FusedLinearModels.from_models(self.models)
+        if compact:
+            self.linear_models = self.linear_models.astype(np.float32)
+        print(f"  ✓ Fused linear models: {', '.join(self.linear_models.names)}")
+        
+        self.packed_forest = None
+        forest = self.models.get('random_forest')
+        if forest is not None:
+            self.packed_forest = PackedForest.from_estimator(forest)
+            if compact:
+                self.packed_forest = self.packed_forest.to_float32()
+            report = self.forest_memory_report()
+            print(f"  ✓ Packed random forest: {report['n_nodes']} nodes, "
+                  f"{report['packed_bytes'] / 1024:.0f} KB (pickled: {report['pickled_bytes'] / 1024:.0f} KB)")
+    
+    def forest_memory_report(self):
+        """Memory used by the packed random forest vs the pickled estimator"""
+        if self.packed_forest is None:
+            return {}
+        return self.packed_forest.memory_report(self.models.get('random_forest'))
     
-    def save_models(self):
-        """Save trained models to disk"""
+    def save_models(self, models_dir=MODELS_DIR):
+        """
+        Save trained models to disk
+        - Legacy pickles in models/
+        - Pickle-free, memory-mappable arrays in models/arrays
+        - The campaign index, if any, in models/campaigns
+        """
         # Create models directory if it doesn't exist
-        os.makedirs('models', exist_ok=True)
+        os.makedirs(models_dir, exist_ok=True)
         
         # Save vectorizer
-        with open('models/vectorizer.pkl', 'wb') as f:
+        with open(os.path.join(models_dir, 'vectorizer.pkl'), 'wb') as f:
             pickle.dump(self.vectorizer, f)
         print("  ✓ Saved vectorizer")
         
+        # Save the scaling of the hand-crafted features (models trained without them have none)
+        features_path = os.path.join(models_dir, 'text_features.pkl')
+        if self.text_features is not None:
+            with open(features_path, 'wb') as f:
+                pickle.dump(self.text_features, f)
+            print("  ✓ Saved text feature scaling")
+        elif os.path.exists(features_path):
+            os.remove(features_path)
+        
         # Save each model
         for name, model in self.models.items():
-            with open(f'models/{name}.pkl', 'wb') as f:
+            with open(os.path.join(models_dir, f'{name}.pkl'), 'wb') as f:
                 pickle.dump(model, f)
             print(f"  ✓ Saved {name}")
         
         # Save training stats
-        with open('models/training_stats.pkl', 'wb') as f:
+        with open(os.path.join(models_dir, 'training_stats.pkl'), 'wb') as f:
             pickle.dump(self.training_stats, f)
         print("  ✓ Saved training statistics")
+        
+        # Save the campaign index (before the arrays: their manifest marks the save as complete)
+        if self.campaign_index is not None:
+            self.campaign_index.save(os.path.join(models_dir, CAMPAIGNS_SUBDIR))
+            print(f"  ✓ Saved campaign index ({len(self.campaign_index)} campaigns)")
+        
+        # Save the serving models as arrays
+        self.save_arrays(os.path.join(models_dir, ARRAYS_SUBDIR))
+    
+    def register_models(self, models_dir, dataset_path, activate=True, source='train', base_dir=None, parent=None):
+        """
+        Save the trained models as a new version in the registry of models_dir
+        - Models saved directly in models_dir before the registry existed are
+          registered first, so there is a version to roll back to
+        - base_dir: models directory the new version completes its files from:
+          what isn't held in memory (e.g. the SVC and forest pickles of
+          array-loaded models, the campaign index when lookups are off) is
+          copied from there unchanged
+        - parent: version the models were derived from (default: the active one)
+        - activate: point the registry at the new version (served from the next
+          load); otherwise it is only saved, e.g. to be shadow-scored
+        Returns the version
+        """
+        registry = ModelRegistry(models_dir)
+        legacy = registry.import_legacy()
+        if legacy is not None:
+            print(f"  ✓ Registered the existing models as version {legacy}")
+        
+        version, path = registry.create()
+        self.training_stats['version'] = version
+        self.save_models(path)
+        if base_dir is not None:
+            copied = copy_model_files(base_dir, path)
+            if copied:
+                print(f"  ✓ Copied unchanged {', '.join(copied)} from {base_dir}")
+        registry.commit(version, self.training_stats, dataset_path, source, parent)
+        self.models_path = path
+        
+        if activate:
+            registry.activate(version)
+            print(f"  ✓ Saved as version {version} (active)")
+        else:
+            print(f"  ✓ Saved as version {version} (not active; activate with: python model_registry.py activate {version})")
+        return version
+    
+    def save_arrays(self, path):
+        """Save the serving models in the pickle-free array format"""
+        model_store.save_arrays(
+            path, self.vectorizer, self.linear_models, self.packed_forest,
+            self.training_stats, self.ensemble_weights, self.decision_threshold,
+            self.text_features, compact='compaction' in self.training_stats
+        )
+        print(f"  ✓ Saved array models to {path}")
+    
+    def load_models(self, models_dir=MODELS_DIR):
+        """
+        Load trained models from disk
+        - Loads the active registry version of models_dir, or models_dir itself
+          if it has no registry (see model_registry.py)
+        - Uses the pickle-free array format (models/arrays) when present
+        - Falls back to the legacy pickles in models/
+        - Loads the campaign index too when campaign lookups are on
+        """
+        models_dir = active_models_dir(models_dir)
+        version = self.model_version
+        array_dir = os.path.join(models_dir, ARRAYS_SUBDIR)
+        if model_store.is_array_store(array_dir):
+            self.load_arrays(array_dir)
+        else:
+            self.load_pickles(models_dir)
+        if self.model_version != version:
+            self.models_path = models_dir
+        
+        if self.campaign_settings is not None:
+            self.load_campaigns(os.path.join(models_dir, CAMPAIGNS_SUBDIR))
+    
+    def load_campaigns(self, path):
+        """Load the saved campaign index (an empty one is kept if there is none)"""
+        try:
+            self.campaign_index = CampaignIndex.load(path, **self.campaign_settings)
+            print(f"✓ Campaign index loaded ({len(self.campaign_index)} campaigns)")
+        except FileNotFoundError:
+            print("No saved campaign index; starting an empty one")
+        except (ValueError, KeyError) as e:
+            print(f"✗ Error loading campaign index: {e}")
+    
+    def load_arrays(self, path):
+        """Load models from the array format (memory-mapped, no unpickling)"""
+        try:
+            loaded = model_store.load_arrays(path)
+            
+            self.vectorizer = loaded['vectorizer']
+            self.text_features = loaded['text_features']
+            self.linear_models = loaded['linear_models']
+            self.packed_forest = loaded['packed_forest']
+            self.training_stats = loaded['training_stats']
+            if loaded['ensemble_weights']:
+                self.ensemble_weights = loaded['ensemble_weights']
+            self.decision_threshold = loaded['decision_threshold']
+            
+            # Served entirely by the fast engines: no sklearn estimators in memory
+            self.models = {}
+            
+            self.publish_models()
+            print(f"✓ Models loaded successfully (array format, {path})")
+            
+        except (FileNotFoundError, ValueError) as e:
+            print(f"✗ Error loading models: {e}")
+            print("Please train models first by running: python train_model.py")
+            self.models_loaded = self.model_set is not None
     
-    def load_models(self):
-        """Load trained models from disk"""
+    def load_pickles(self, models_dir=MODELS_DIR):
+        """Load models from the legacy pickle files"""
         try:
             # Load vectorizer
-            with open('models/vectorizer.pkl', 'rb') as f:
+            with open(os.path.join(models_dir, 'vectorizer.pkl'), 'rb') as f:
                 self.vectorizer = pickle.load(f)
             
+            # Load the text feature scaling (absent for models trained without the features)
+            features_path = os.path.join(models_dir, 'text_features.pkl')
+            self.text_features = None
+            if os.path.exists(features_path):
+                with open(features_path, 'rb') as f:
+                    self.text_features = pickle.load(f)
+            
             # Load models
             model_names = ['naive_bayes', 'svm', 'random_forest', 'logistic_regression']
             for name in model_names:
-                with open(f'models/{name}.pkl', 'rb') as f:
+                with open(os.path.join(models_dir, f'{name}.pkl'), 'rb') as f:
                     self.models[name] = pickle.load(f)
             
             # Load training stats
-            if os.path.exists('models/training_stats.pkl'):
-                with open('models/training_stats.pkl', 'rb') as f:
+            stats_path = os.path.join(models_dir, 'training_stats.pkl')
+            if os.path.exists(stats_path):
+                with open(stats_path, 'rb') as f:
                     self.training_stats = pickle.load(f)
             
-            self.models_loaded = True
+            # Learned ensemble weights and threshold, if any
+            ensemble = self.training_stats.get('ensemble', {})
+            if ensemble.get('adopted'):
+                self.ensemble_weights = dict(ensemble['weights'])
+                self.decision_threshold = ensemble['threshold']
+            else:
+                self.ensemble_weights = dict(DEFAULT_ENSEMBLE_WEIGHTS)
+                self.decision_threshold = DEFAULT_THRESHOLD
+            
+            # Build the fast inference engines
+            self.export_fast_models(compact='compaction' in self.training_stats)
+            
+            self.publish_models()
             print("✓ Models loaded successfully")
             
         except FileNotFoundError as e:
             print(f"✗ Error loading models: {e}")
             print("Please train models first by running: python train_model.py")
-            self.models_loaded = False
+            self.models_loaded = self.model_set is not None
     
     def get_stats(self):
         """Get model statistics"""
         if not self.training_stats:
             return {
-                'message': 'No training statistics available. Please train models first.'
+                'message': 'No training statistics available. Please train models first.',
+                'cache': self.prediction_cache.stats(),
+                'cascade': self.cascade_stats.stats(self.cascade_band),
+                'campaigns': self.campaign_stats()
             }
         
         stats = {
@@ -364,23 +1290,46 @@ class SpamDetector:
             },
             'features': {
                 'total_features': self.training_stats.get('feature_count', 0),
-                'vectorization': 'TF-IDF',
-                'ngram_range': '(1, 3)'
+                'vectorization': self.training_stats.get('vectorization', 'TF-IDF'),
+                'ngram_range': '(1, 3)',
+                'text_features': self.training_stats.get('text_features', []),
+                'compaction': self.training_stats.get('compaction')
             },
-            'models': {}
+            'models': {},
+            'ensemble': {
+                'weights': dict(self.ensemble_weights),
+                'threshold': self.decision_threshold,
+                'search': self.training_stats.get('ensemble', {})
+            },
+            'cache': self.prediction_cache.stats(),
+            'cascade': dict(
+                self.cascade_stats.stats(self.cascade_band),
+                validation=self.training_stats.get('cascade_validation', [])
+            ),
+            'latency_budget': self.model_subset or {'budget_ms': None},
+            'costs': {key: value for key, value in self.training_stats.get('costs', {}).items() if key != 'models'},
+            'campaigns': self.campaign_stats()
         }
         
-        # Add model results
+        # Add model results (and serving costs, for models trained with them measured)
+        costs = self.training_stats.get('costs', {}).get('models', {})
         if 'results' in self.training_stats:
             for model_name, results in self.training_stats['results'].items():
                 stats['models'][model_name] = {
                     'accuracy': results['test_accuracy'],
                     'precision': results['precision'],
                     'recall': results['recall'],
-                    'f1_score': results['f1_score']
+                    'f1_score': results['f1_score'],
+                    'cost': costs.get(model_name)
                 }
         
         return stats
+    
+    def campaign_stats(self):
+        """Campaign index counters for /api/stats"""
+        if self.campaign_settings is None or self.campaign_index is None:
+            return {'enabled': False}
+        return self.campaign_index.stats()
 
 if __name__ == "__main__":
     # Test the detector
@@ -0,0 +1,111 @@
+"""
+Spam Patterns - Compiled Pattern Matcher
+Finds every known spam pattern in an email with one combined regex scan
+"""
+
+import re
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# Spam patterns for additional detection: (description, regex)
+SPAM_PATTERNS = [
+    ('win money', r'\b(win|won|winner)\s+(money|\$|₹|prize|cash)'),
+    ('free money', r'\b(free|claim|collect)\s+(money|cash|reward|prize)'),
+    ('urgent', r'\b(urgent|immediately|act\s+now)'),
+    ('click here', r'\b(click|verify|confirm)\s+(here|now|account)'),
+    ('account suspended', r'\b(account|password)\s+(suspended|blocked|verify)'),
+    ('lottery', r'\blottery\b'),
+    ('congratulations', r'\bcongratulations?\b'),
+    ('selected', r'\bselected\b'),
+    ('contains URL', r'https?://[^\s]+'),
+]
+
+
+def leading_chars(items):
+    """
+    Characters that can start a match of a parsed regex
+    Returns None when they can't be worked out (e.g. optional or wildcard start)
+    """
+    for op, arg in items:
+        if op is sre_parse.AT:
+            # Zero-width anchor such as \b
+            continue
+        if op is sre_parse.LITERAL:
+            return {chr(arg)}
+        if op is sre_parse.SUBPATTERN:
+            return leading_chars(arg[-1])
+        if op is sre_parse.BRANCH:
+            chars = set()
+            for branch in arg[1]:
+                branch_chars = leading_chars(branch)
+                if branch_chars is None:
+                    return None
+                chars |= branch_chars
+            return chars
+        if op is sre_parse.IN:
+            chars = set()
+            for set_op, set_arg in arg:
+                if set_op is not sre_parse.LITERAL:
+                    return None
+                chars.add(chr(set_arg))
+            return chars
+        return None
+    return None
+
+
+class SpamPatternMatcher:
+    """
+    Matches all spam patterns in a single pass over the text
+    - All patterns are combined into one precompiled regex with a named group each,
+      behind a lookahead on the characters a match can start with
+    - At every position where the combined regex hits, the remaining patterns are
+      also tried there, so overlapping matches are never missed
+    """
+
+    def __init__(self, patterns=SPAM_PATTERNS):
+        self.descriptions = [description for description, _ in patterns]
+        self.compiled = [re.compile(regex, re.IGNORECASE) for _, regex in patterns]
+
+        combined = '|'.join(f'(?P<p{i}>{regex})' for i, (_, regex) in enumerate(patterns))
+
+        # Let the regex engine skip positions where no pattern can start
+        first = set()
+        for _, regex in patterns:
+            chars = leading_chars(sre_parse.parse(regex, re.IGNORECASE))
+            if chars is None:
+                first = None
+                break
+            first |= chars
+        if first:
+            combined = '(?=[' + ''.join(re.escape(c) for c in sorted(first)) + '])(?:' + combined + ')'
+
+        self.combined = re.compile(combined, re.IGNORECASE)
+
+    def match(self, text):
+        """Return descriptions of all patterns found in text, in pattern order"""
+        found = set()
+        pos = 0
+
+        while len(found) < len(self.compiled):
+            m = self.combined.search(text, pos)
+            if m is None:
+                break
+
+            start = m.start()
+            found.add(int(m.lastgroup[1:]))
+
+            # Another pattern may also match at this position
+            for i, pattern in enumerate(self.compiled):
+                if i not in found and pattern.match(text, start):
+                    found.add(i)
+
+            pos = start + 1
+
+        return [self.descriptions[i] for i in sorted(found)]
+
+    def match_batch(self, texts):
+        """Return matched descriptions for each text in a batch"""
+        return [self.match(text) for text in texts]
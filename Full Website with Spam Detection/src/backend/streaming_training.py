@@ -0,0 +1,239 @@
+"""
+Streaming Training - Out-of-Core Training for Large Datasets
+Reads the CSV in chunks, hashes n-grams instead of building a vocabulary and
+fits the models incrementally, so memory stays flat as the dataset grows
+"""
+
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.linear_model import SGDClassifier
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import confusion_matrix
+from hashed_vectorizer import HashingTfidfVectorizer
+from feature_subset import FeatureSubsetClassifier
+from spam_detector import label_messages, peak_rss_mb
+
+CLASSES = np.array([0, 1])
+HOLDOUT_BUCKETS = 10000
+
+
+def read_chunks(csv_path, preprocess, chunk_size=10000):
+    """Yield (preprocessed texts, labels) for each chunk of a Category, Messages CSV"""
+    for df in pd.read_csv(csv_path, encoding='latin-1', chunksize=chunk_size):
+        df = label_messages(df)
+        if len(df):
+            yield [preprocess(text) for text in df['Messages']], df['label'].to_numpy()
+
+
+def holdout_mask(texts, test_fraction):
+    """
+    Rows that belong to the holdout set
+    Decided by a hash of the text, so every pass makes the same split without
+    storing it, and duplicate messages never end up on both sides
+    """
+    cutoff = int(test_fraction * HOLDOUT_BUCKETS)
+    return np.array(
+        [zlib.crc32(text.encode('utf-8', 'surrogatepass')) % HOLDOUT_BUCKETS < cutoff for text in texts],
+        dtype=bool
+    )
+
+
+def split_chunks(chunks, test_fraction, holdout=False):
+    """Yield only the training rows (or only the holdout rows) of each chunk"""
+    for texts, labels in chunks:
+        mask = holdout_mask(texts, test_fraction)
+        if not holdout:
+            mask = ~mask
+        if mask.any():
+            yield [text for text, keep in zip(texts, mask) if keep], labels[mask]
+
+
+class Reservoir:
+    """Uniform random sample of at most `size` rows of a stream (algorithm R)"""
+
+    def __init__(self, size, random_state=42):
+        self.size = size
+        self.rng = np.random.default_rng(random_state)
+        self.texts = []
+        self.labels = []
+        self.seen = 0
+
+    def add(self, texts, labels):
+        # Fill up first, then row i replaces a random slot with probability size / (i + 1)
+        fill = min(len(texts), self.size - len(self.texts))
+        self.texts.extend(texts[:fill])
+        self.labels.extend(labels[:fill].tolist())
+
+        positions = self.seen + np.arange(fill, len(texts))
+        slots = self.rng.integers(0, positions + 1)
+        for i in np.flatnonzero(slots < self.size):
+            self.texts[slots[i]] = texts[fill + i]
+            self.labels[slots[i]] = int(labels[fill + i])
+
+        self.seen += len(texts)
+
+
+def confusion_counts(y_true, y_pred):
+    """2x2 confusion matrix of one chunk"""
+    return confusion_matrix(y_true, y_pred, labels=CLASSES)
+
+
+def metrics_from_counts(train_cm, test_cm):
+    """fit_and_evaluate-style metrics from accumulated confusion matrices"""
+    (tn, fp), (fn, tp) = test_cm
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        'train_accuracy': float(np.trace(train_cm) / max(train_cm.sum(), 1)),
+        'test_accuracy': float(np.trace(test_cm) / max(test_cm.sum(), 1)),
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1_score': float(f1),
+        'confusion_matrix': test_cm.tolist()
+    }
+
+
+def frequent_columns(document_counts, n_documents, max_columns=3000, min_df=2, max_df=0.9):
+    """
+    Most common hashed columns, with TfidfVectorizer's min_df / max_df / max_features rules
+    The random forest splits only on these: with hundreds of thousands of
+    mostly empty columns, random feature sampling rarely finds useful splits
+    """
+    usable = (document_counts >= min_df) & (document_counts <= max_df * n_documents)
+    candidates = np.flatnonzero(usable)
+    top = candidates[np.argsort(document_counts[candidates], kind='stable')[::-1][:max_columns]]
+    return np.sort(top)
+
+
+def streaming_models(random_state=42):
+    """
+    Models that learn one chunk at a time with partial_fit
+    SGD with modified Huber loss is the incremental stand-in for the linear SVM
+    (a smoothed hinge loss that also gives probabilities)
+    """
+    return {
+        'naive_bayes': MultinomialNB(alpha=0.1),
+        'svm': SGDClassifier(loss='modified_huber', alpha=1e-5, random_state=random_state),
+        'logistic_regression': SGDClassifier(loss='log_loss', alpha=1e-5, random_state=random_state)
+    }
+
+
+def train_streaming(csv_path, preprocess, chunk_size=10000, test_fraction=0.2, n_features=2 ** 18,
+                    epochs=1, reservoir_size=20000, report=None):
+    """
+    Train the ensemble from a CSV without loading it into memory
+    1. Count rows and hashed document frequencies (IDF) of the training rows
+    2. Fit Naive Bayes and the SGD models chunk by chunk with partial_fit;
+       keep a fixed-size random sample of rows for the random forest
+    3. Fit the random forest on that sample, using the most frequent columns
+    4. Evaluate every model on the holdout rows, again chunk by chunk
+    Training accuracy of the incremental models is progressive validation
+    (each chunk is scored before the models learn from it).
+    Returns vectorizer, models, results and dataset counts.
+    """
+    report = report or (lambda fraction, stage: None)
+    vectorizer = HashingTfidfVectorizer(n_features=n_features)
+    chunks = lambda: read_chunks(csv_path, preprocess, chunk_size)
+
+    # Pass 1: dataset counts and document frequencies
+    report(0.0, 'counting document frequencies')
+    print("\nPass 1: counting rows and document frequencies...")
+    document_counts = np.zeros(n_features, dtype=np.int64)
+    counts = {'train_size': 0, 'test_size': 0, 'spam_count': 0, 'ham_count': 0}
+    for texts, labels in chunks():
+        holdout = holdout_mask(texts, test_fraction)
+        counts['test_size'] += int(holdout.sum())
+        counts['train_size'] += int((~holdout).sum())
+        counts['spam_count'] += int((labels == 1).sum())
+        counts['ham_count'] += int((labels == 0).sum())
+
+        train_texts = [text for text, held in zip(texts, holdout) if not held]
+        if train_texts:
+            X = vectorizer.count(train_texts)
+            document_counts += np.bincount(X.indices, minlength=n_features)
+
+    if counts['train_size'] == 0 or counts['test_size'] == 0:
+        raise ValueError("Dataset too small to split into training and holdout rows")
+
+    vectorizer.idf_ = HashingTfidfVectorizer.idf_from_counts(document_counts, counts['train_size'])
+    forest_columns = frequent_columns(document_counts, counts['train_size'])
+    del document_counts
+    print(f"Training rows: {counts['train_size']}, holdout rows: {counts['test_size']}")
+
+    # Pass 2: incremental fit (progressive validation for training accuracy)
+    models = streaming_models()
+    fit_times = {name: 0.0 for name in models}
+    train_cms = {name: np.zeros((2, 2), dtype=np.int64) for name in models}
+    reservoir = Reservoir(reservoir_size)
+    rng = np.random.default_rng(42)
+
+    for epoch in range(epochs):
+        print(f"\nPass 2: fitting incremental models (epoch {epoch + 1}/{epochs})...")
+        rows_done = 0
+        for texts, labels in split_chunks(chunks(), test_fraction):
+            # Shuffle within the chunk, in case the file is sorted by label
+            order = rng.permutation(len(texts))
+            texts = [texts[i] for i in order]
+            labels = labels[order]
+            X = vectorizer.transform(texts)
+
+            for name, model in models.items():
+                if epoch == 0 and hasattr(model, 'classes_'):
+                    train_cms[name] += confusion_counts(labels, model.predict(X))
+                start = time.perf_counter()
+                model.partial_fit(X, labels, classes=CLASSES)
+                fit_times[name] += time.perf_counter() - start
+
+            if epoch == 0:
+                reservoir.add(texts, labels)
+
+            rows_done += len(texts)
+            report(0.3 + 0.4 * (epoch + rows_done / counts['train_size']) / epochs, f'training (epoch {epoch + 1})')
+
+    # Random forest on the reservoir sample
+    report(0.7, 'training random_forest')
+    print(f"\nFitting random forest on a sample of {len(reservoir.texts)} rows...")
+    forest = FeatureSubsetClassifier(
+        RandomForestClassifier(n_estimators=100, max_depth=50, random_state=42, n_jobs=-1),
+        forest_columns
+    )
+    X_sample = vectorizer.transform(reservoir.texts)
+    y_sample = np.array(reservoir.labels)
+    start = time.perf_counter()
+    forest.fit(X_sample, y_sample)
+    fit_times['random_forest'] = time.perf_counter() - start
+    train_cms['random_forest'] = confusion_counts(y_sample, forest.predict(X_sample))
+    models['random_forest'] = forest
+    del X_sample, y_sample, reservoir
+
+    # Pass 3: streamed holdout evaluation
+    report(0.8, 'evaluating')
+    print("\nPass 3: evaluating on the holdout rows...")
+    test_cms = {name: np.zeros((2, 2), dtype=np.int64) for name in models}
+    for texts, labels in split_chunks(chunks(), test_fraction, holdout=True):
+        X = vectorizer.transform(texts)
+        for name, model in models.items():
+            test_cms[name] += confusion_counts(labels, model.predict(X))
+
+    # Same model order as train_models
+    order = ['naive_bayes', 'svm', 'random_forest', 'logistic_regression']
+    models = {name: models[name] for name in order}
+    results = {}
+    for name in order:
+        results[name] = metrics_from_counts(train_cms[name], test_cms[name])
+        results[name]['fit_time_seconds'] = round(fit_times[name], 3)
+        # The models learn chunk by chunk side by side: only the process peak exists
+        results[name]['peak_rss_mb'] = peak_rss_mb()
+        results[name]['peak_rss_scope'] = 'process'
+
+    counts['dataset_size'] = counts['train_size'] + counts['test_size']
+    return {
+        'vectorizer': vectorizer,
+        'models': models,
+        'results': results,
+        'counts': counts
+    }
@@ -0,0 +1,27 @@
+"""
+Tests for the learned ensemble weights and threshold
+Run with: python -m pytest test_ensemble.py
+"""
+
+import numpy as np
+import spam_detector
+from spam_detector import SpamDetector, DEFAULT_ENSEMBLE_WEIGHTS, DEFAULT_THRESHOLD
+
+
+def test_both_miss_precision_floor(monkeypatch):
+    """Learned values that miss the precision floor aren't adopted, even when the defaults miss it too"""
+    learned_weights = {name: 1.0 if i == 0 else 0.0 for i, name in enumerate(DEFAULT_ENSEMBLE_WEIGHTS)}
+    monkeypatch.setattr(spam_detector, 'search_ensemble', lambda *args, **kwargs: {
+        'weights': learned_weights, 'threshold': 0.3, 'combinations': 1, 'search_ms': 0.0
+    })
+    # Every message looks the same: calling any of them spam gives precision 0.5
+    y = np.array([0, 1] * 50)
+    probabilities = {name: np.full(len(y), 0.6) for name in DEFAULT_ENSEMBLE_WEIGHTS}
+
+    detector = SpamDetector(cache_size=0)
+    report = detector.learn_ensemble(probabilities, y, objective='precision', min_precision=0.99)
+
+    assert report['default']['score'] == report['learned']['score'] == -1.0
+    assert not report['adopted']
+    assert detector.ensemble_weights == DEFAULT_ENSEMBLE_WEIGHTS
+    assert detector.decision_threshold == DEFAULT_THRESHOLD
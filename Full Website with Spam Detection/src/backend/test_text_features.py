@@ -0,0 +1,27 @@
+"""
+Tests for the batch hand-crafted features
+Run with: python -m pytest test_text_features.py
+"""
+
+import numpy as np
+from text_features import batch_features, FEATURE_NAMES
+
+
+def test_lone_surrogate():
+    """A lone surrogate (JSON accepts "\\ud800") is counted as one character, like any other"""
+    texts = ['WIN \ud800 now!', 'hello \udfff', 'plain text']
+    features = batch_features(texts)
+    assert features.shape == (3, len(FEATURE_NAMES))
+    assert features[0, FEATURE_NAMES.index('char_count')] == len(texts[0])
+    assert features[0, FEATURE_NAMES.index('word_count')] == 3
+    assert features[0, FEATURE_NAMES.index('exclamation_count')] == 1
+    # The other messages of the batch are unaffected
+    np.testing.assert_array_equal(features[2], batch_features(['plain text'])[0])
+
+
+def test_caps_ratio_is_isupper():
+    """Capitals are the characters str.isupper() counts: not titlecase 'ǅ', but 'ℋ' and '𝐀'"""
+    texts = ['ǅ ℋ 𝐀 İ Ab', 'no caps']
+    features = batch_features(texts)
+    for row, text in zip(features, texts):
+        assert row[FEATURE_NAMES.index('caps_ratio')] == sum(c.isupper() for c in text) / len(text)
@@ -0,0 +1,146 @@
+"""
+Text Features - Hand-Crafted Signals Beyond TF-IDF
+Length, punctuation, currency, capitalization and URL counts of the raw
+(not lowercased) text, computed for a whole batch at once: the batch is
+joined into one string and every statistic is a NumPy operation over its
+code points, summed per message
+"""
+
+import re
+import numpy as np
+from scipy import sparse
+
+FEATURE_NAMES = [
+    'char_count', 'word_count', 'avg_word_length',
+    'exclamation_count', 'question_count', 'dollar_count', 'rupee_count',
+    'caps_ratio', 'url_count'
+]
+
+# Features that are counts (log-scaled); the others are already ratios or averages
+COUNT_FEATURES = ['char_count', 'word_count', 'exclamation_count', 'question_count',
+                  'dollar_count', 'rupee_count', 'url_count']
+
+# Code points str.split() treats as whitespace, as a lookup table (last entry: everything above)
+WHITESPACE = np.zeros(0x3002, dtype=bool)
+WHITESPACE[[9, 10, 11, 12, 13, 28, 29, 30, 31, 32, 0x85, 0xA0, 0x1680,
+            *range(0x2000, 0x200B), 0x2028, 0x2029, 0x202F, 0x205F, 0x3000]] = True
+
+# Characters counted by the *_count features
+COUNTED_CHARS = {'exclamation_count': '!', 'question_count': '?', 'dollar_count': '$', 'rupee_count': '₹'}
+COUNTED_CODES = np.array([ord(c) for c in COUNTED_CHARS.values()], dtype=np.uint32)
+
+URL_PATTERN = re.compile(r'https?://[^\s]+')
+
+# str.isupper() of every code point of the Basic Multilingual Plane (the ones above are checked one by one)
+UPPERCASE = np.array([chr(code).isupper() for code in range(0x10000)], dtype=bool)
+
+
+def batch_features(texts):
+    """
+    Unscaled features (n_texts, len(FEATURE_NAMES)) of a batch of raw texts
+    - word_count / avg_word_length follow str.split()
+    - caps_ratio counts the characters for which str.isupper() is true
+      (not titlecase letters such as 'ǅ')
+    """
+    if not len(texts):
+        return np.zeros((0, len(FEATURE_NAMES)))
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    # Each text followed by a newline: words and URLs never run from one text into the next
+    joined = '\n'.join(texts) + '\n'
+    starts = np.cumsum(lengths + 1) - (lengths + 1)
+
+    # surrogatepass: a lone surrogate (valid in JSON, e.g. "\ud800") stays one code point
+    codes = np.frombuffer(joined.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    capitals = UPPERCASE.take(np.minimum(codes, len(UPPERCASE) - 1))
+    astral = np.flatnonzero(codes >= len(UPPERCASE))
+    if len(astral):
+        capitals[astral] = [joined[i].isupper() for i in astral]
+
+    # One row per per-character statistic, summed over each text (and its newline) at once
+    masks = np.empty((3 + len(COUNTED_CODES), len(codes)), dtype=bool)
+    space = masks[0]
+    WHITESPACE.take(np.minimum(codes, len(WHITESPACE) - 1), out=space)
+    masks[1, 0] = not space[0]
+    np.greater(space[:-1], space[1:], out=masks[1, 1:])  # word starts: whitespace, then not
+    masks[2] = capitals
+    np.equal(codes, COUNTED_CODES[:, None], out=masks[3:])
+    sums = np.add.reduceat(masks, starts, axis=1, dtype=np.int64)
+    spaces, words, capital_count = sums[0] - 1, sums[1], sums[2]
+
+    url_starts = np.fromiter((m.start() for m in URL_PATTERN.finditer(joined)), dtype=np.int64)
+    urls = np.bincount(np.searchsorted(starts, url_starts, side='right') - 1, minlength=len(texts))
+
+    columns = {
+        'char_count': lengths,
+        'word_count': words,
+        'avg_word_length': (lengths - spaces) / np.maximum(words, 1),
+        'caps_ratio': capital_count / np.maximum(lengths, 1),
+        'url_count': urls
+    }
+    columns.update(zip(COUNTED_CHARS, sums[3:]))
+    return np.column_stack([columns[name] for name in FEATURE_NAMES]).astype(np.float64)
+
+
+class TextFeatures:
+    """
+    Scaled hand-crafted features, appended to the TF-IDF matrix as extra sparse columns
+    - Counts are log1p-scaled, then every feature is divided by its 99th
+      percentile on the training texts (scale_; outliers such as one very long
+      word don't squash everyone else) and clipped to [0, 1]: non-negative, as
+      Multinomial Naive Bayes requires, and on the same order as TF-IDF weights
+    """
+
+    def __init__(self, scale=None):
+        self.scale_ = None if scale is None else np.asarray(scale, dtype=np.float64)
+
+    @property
+    def n_features(self):
+        return len(FEATURE_NAMES)
+
+    def log_scaled(self, texts):
+        values = batch_features(texts)
+        counts = [FEATURE_NAMES.index(name) for name in COUNT_FEATURES]
+        values[:, counts] = np.log1p(values[:, counts])
+        return values
+
+    def fit(self, texts):
+        high = np.percentile(self.log_scaled(texts), 99, axis=0)
+        self.scale_ = np.where(high > 0, high, 1.0)
+        return self
+
+    def transform(self, texts):
+        """Scaled features (n_texts, n_features), dense (see stack_features)"""
+        if self.scale_ is None:
+            raise ValueError("TextFeatures is not fitted")
+        return np.clip(self.log_scaled(texts) / self.scale_, 0.0, 1.0)
+
+    def fit_transform(self, texts):
+        return self.fit(texts).transform(texts)
+
+
+def stack_features(X, features):
+    """
+    CSR matrix X with dense feature columns (n_rows, k) appended
+    Builds the CSR arrays directly: each row's own entries, then its k
+    feature values (scipy.sparse.hstack costs more than the features themselves
+    on small batches)
+    """
+    X = X.tocsr()
+    n_rows, k = features.shape
+    row_nnz = np.diff(X.indptr)
+    indptr = X.indptr + k * np.arange(n_rows + 1)
+
+    # Where X's entries and the feature values land in the new arrays
+    x_positions = np.arange(X.nnz) + k * np.repeat(np.arange(n_rows), row_nnz)
+    feature_positions = (indptr[1:] - k)[:, None] + np.arange(k)
+
+    data = np.empty(X.nnz + n_rows * k, dtype=np.result_type(X.dtype, features.dtype))
+    indices = np.empty(len(data), dtype=X.indices.dtype)
+    data[x_positions] = X.data
+    indices[x_positions] = X.indices
+    data[feature_positions] = features
+    indices[feature_positions] = X.shape[1] + np.arange(k)
+
+    stacked = sparse.csr_matrix((data, indices, indptr), shape=(n_rows, X.shape[1] + k))
+    stacked.has_sorted_indices = X.has_sorted_indices
+    return stacked
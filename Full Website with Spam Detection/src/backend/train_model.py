@@ -3,14 +3,42 @@ Train Spam Detection Models
 Run this script first to train models on spam mail.csv
 
 Usage:
-    python train_model.py
+    python train_model.py [--parallel] [--workers N] [--objective f1|precision|default] [--min-precision P]
+                          [--compact [--max-score-change C]] [--no-activate]
+    python train_model.py --streaming [--chunk-size ROWS] [--hash-features N] [--epochs N] [--no-activate]
+
+Each run is saved as a new version in models/registry (see model_registry.py)
 """
 
 from spam_detector import SpamDetector
+import argparse
 import os
 import sys
 
 def main():
+    parser = argparse.ArgumentParser(description='Train the spam detection models')
+    parser.add_argument('--parallel', action='store_true', help='fit the models concurrently in worker processes')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: one per model)')
+    parser.add_argument('--streaming', action='store_true', help='train out of core, reading the CSV in chunks')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='rows per chunk in streaming mode')
+    parser.add_argument('--hash-features', type=int, default=2 ** 18, help='hashed feature columns in streaming mode')
+    parser.add_argument('--epochs', type=int, default=1, help='passes over the training rows in streaming mode')
+    parser.add_argument('--objective', choices=['f1', 'precision', 'default'], default='f1',
+                        help='what the learned ensemble weights and threshold maximize (default: keep 0.5 and fixed weights)')
+    parser.add_argument('--min-precision', type=float, default=None,
+                        help='precision floor for --objective precision (e.g. 0.99)')
+    parser.add_argument('--compact', action='store_true',
+                        help='prune and shrink the trained models for serving (see compact_models.py)')
+    parser.add_argument('--max-score-change', type=float, default=0.02,
+                        help='with --compact: 99th percentile of the ensemble score change pruning may cause')
+    parser.add_argument('--no-activate', action='store_true',
+                        help='save the new version without serving it (e.g. to shadow-score it first)')
+    args = parser.parse_args()
+    if args.objective == 'precision' and args.min_precision is None:
+        parser.error('--objective precision needs --min-precision')
+    if args.compact and args.streaming:
+        parser.error('--compact needs a fitted vocabulary (not --streaming)')
+    
     print("\n" + "=" * 60)
     print(" EMAIL SPAM DETECTION - MODEL TRAINING ")
     print("=" * 60 + "\n")
@@ -30,7 +58,18 @@ def main():
     
     # Train models
     try:
-        results = detector.train_models(dataset_path)
+        if args.streaming:
+            results = detector.train_streaming(
+                dataset_path, chunk_size=args.chunk_size,
+                n_features=args.hash_features, epochs=args.epochs,
+                activate=not args.no_activate
+            )
+        else:
+            results = detector.train_models(
+                dataset_path, parallel=args.parallel, n_workers=args.workers,
+                ensemble_objective=None if args.objective == 'default' else args.objective,
+                min_precision=args.min_precision, activate=not args.no_activate
+            )
         
         # Print summary
         print("\n" + "=" * 60)
@@ -47,6 +86,7 @@ def main():
             print(f"  Precision: {metrics['precision']*100:.2f}%")
             print(f"  Recall:    {metrics['recall']*100:.2f}%")
             print(f"  F1 Score:  {metrics['f1_score']*100:.2f}%")
+            print(f"  Fit Time:  {metrics['fit_time_seconds']:.2f}s")
         
         # Find best model
         best_model = max(results.items(), key=lambda x: x[1]['test_accuracy'])
@@ -55,6 +95,12 @@ def main():
         print(f"Accuracy: {best_model[1]['test_accuracy']*100:.2f}%")
         print("-" * 60)
         
+        if args.compact:
+            from compact_models import compact_models
+            print("\nCompacting models...")
+            compact_models(dataset_path=dataset_path, max_score_change=args.max_score_change,
+                           version=detector.training_stats['version'], activate=not args.no_activate)
+        
         print("\n✓ Models trained and saved successfully!")
         print("\nYou can now run the Flask API server:")
         print("  python app.py")
@@ -72,7 +72,7 @@ export async function checkAPIHealth(): Promise<boolean> {
     }
     
     const data = await response.json();
-    return data.status === 'running' && data.models_loaded === true;
+    return data.status === 'ready' && data.models_loaded === true;
   } catch (error) {
     return false;
   }